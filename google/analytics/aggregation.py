@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Merge counter-style Event hits and send one hit per window.
+
+
+Example:
+    ```
+    ga = GoogleAnalytics('UA-12345-6', aggregate_events=True, event_window=10)
+
+    for item in items:
+        ga.send_event('queue', 'processed', 'emails') # no hit yet
+    ga.flush() # one event hit with ev=len(items)
+    ```
+
+Events are merged per (category, action, label, non-interaction, Custom
+Dimensions) of the tracker, i.e. of its Client ID. Once per window, one
+Event hit is sent for each of them, with the total of their event values
+and Custom Metrics. An event without a value counts as 1.
+
+A timer closes each window that has events when it ends, even if no
+event follows, and the totals are sent from a background thread, so
+send_event() never waits on the network.
+
+
+"""
+
+from threading import Lock, Timer
+from time import monotonic
+
+from .worker import BackgroundWorker
+
+class EventAggregator(object):
+    """Sums Event hits per category, action, label and dimension set over a
+            time window."""
+
+    def __init__(self, tracker, window=60, worker=None):
+        """Create a new event aggregator.
+
+        Params:
+            tracker (GoogleAnalytics): Tracker to send Event hits with.
+            window (int): (optional) Seconds between merged hits.
+                    Default: 60.
+            worker (BackgroundWorker): (optional) Worker to send the totals
+                    of closed windows from.
+
+        Raises:
+            ValueError if window is not a positive number.
+
+        """
+        if not isinstance(window, (float, int)) or window <= 0:
+            raise ValueError('window should be a positive number.')
+
+        self.tracker = tracker
+        self.window = window
+        self.worker = worker or BackgroundWorker(
+            max_queue=100,
+            name='google-analytics-events',
+        )
+        self.events = {}
+        self.window_start = monotonic()
+        # closes the current window when it ends, while it has events
+        self.window_timer = None
+        self.lock = Lock()
+
+    def after_fork_in_child(self):
+        """Start a new window in a forked child. The parent still sends
+                the events of the current one."""
+        self.events = {}
+        self.window_start = monotonic()
+        self.window_timer = None
+        self.lock = Lock()
+
+    def __split(self, custom_dimensions, custom_metrics, custom_definitions):
+        """Get the Custom Dimensions and Metrics of an event by index, with
+                named definitions resolved."""
+        dimensions = {
+            str(index): value for index, value in (custom_dimensions or {}).items()
+        }
+        metrics = {}
+        for index, value in (custom_metrics or {}).items():
+            if not isinstance(value, (float, int)):
+                raise ValueError(
+                    '"{}" custom_metric should be a number.'.format(value)
+                )
+            metrics[str(index)] = value
+
+        if custom_definitions:
+            if self.tracker.definitions is None:
+                raise ValueError('Missing definitions for custom_definitions.')
+            resolved = self.tracker.definitions.resolve(custom_definitions)
+            for key, value in resolved.items():
+                if key.startswith('cd'):
+                    dimensions[key[2:]] = value
+                else:
+                    metrics[key[2:]] = value
+        return dimensions, metrics
+
+    def record(
+            self,
+            event_category,
+            event_action,
+            event_label=None,
+            event_value=None,
+            non_interaction=False,
+            custom_dimensions=None,
+            custom_metrics=None,
+            custom_definitions=None,
+            now=None,
+        ):
+        """Add an event to its total. The totals are sent from the worker
+                once the window closes.
+
+        Params:
+            Refer to GoogleAnalytics.send_event().
+            now (float): (optional) Monotonic time of the event.
+
+        Raises:
+            ValueError if a Custom Metric value is not a number.
+
+        """
+        dimensions, metrics = self.__split(
+            custom_dimensions,
+            custom_metrics,
+            custom_definitions,
+        )
+        key = (
+            event_category,
+            event_action,
+            event_label,
+            non_interaction,
+            tuple(sorted(dimensions.items())),
+        )
+        now = monotonic() if now is None else now
+
+        with self.lock:
+            if not self.events and now - self.window_start >= self.window:
+                # a window starts with its first event
+                self.window_start = now
+            total = self.events.get(key)
+            if total is None:
+                total = self.events[key] = [0, {}]
+            total[0] += 1 if event_value is None else event_value
+            for index, value in metrics.items():
+                if value is not None:
+                    total[1][index] = total[1].get(index, 0) + value
+
+            if now - self.window_start < self.window:
+                self.__schedule(now)
+                return
+            events = self.__swap(now)
+
+        # the caller may be a hot path, which should not wait on the network
+        self.worker.submit(self.__send, events)
+
+    def __schedule(self, now):
+        """Start the timer that closes the window. The lock must be held."""
+        if self.window_timer is not None or not self.events:
+            return
+        self.window_timer = Timer(
+            max(0, self.window_start + self.window - now),
+            self.__close,
+        )
+        self.window_timer.daemon = True
+        self.window_timer.start()
+
+    def __close(self):
+        """Close the window when no event came after it ended."""
+        now = monotonic()
+        with self.lock:
+            self.window_timer = None
+            if now - self.window_start < self.window:
+                self.__schedule(now)
+                return
+            events = self.__swap(now)
+        if events:
+            self.worker.submit(self.__send, events)
+
+    def __swap(self, now):
+        """Start a new window. The lock must be held."""
+        if self.window_timer is not None:
+            self.window_timer.cancel()
+            self.window_timer = None
+        events = self.events
+        self.events = {}
+        self.window_start = now
+        return events
+
+    def __send(self, events):
+        """Send one Event hit per total."""
+        for key, total in events.items():
+            event_category, event_action, event_label, non_interaction, \
+                dimensions = key
+            event_value, metrics = total
+            self.tracker.send_event(
+                event_category,
+                event_action,
+                event_label,
+                event_value,
+                non_interaction,
+                custom_dimensions=dict(dimensions) or None,
+                custom_metrics=metrics or None,
+                aggregate=False,
+            )
+
+    def flush(self, timeout=None):
+        """Send the totals of the current window and start a new one,
+                after those of closed windows.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait for the
+                    totals of closed windows.
+
+        """
+        self.worker.flush(timeout)
+        with self.lock:
+            events = self.__swap(monotonic())
+        self.__send(events)
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""Encode and send hits from columnar data, a column at a time.
+
+
+Example:
+    ```
+    ga = GoogleAnalytics('UA-12345-6')
+    frame = pandas.read_parquet('events.parquet')
+    ga.send_columns(frame, {
+        'category': 'ec',
+        'action': 'ea',
+        'value': 'ev',
+        'user': 'cid',
+        'time': 'timestamp',
+    })
+    ```
+
+Columns can be a pandas DataFrame, or a dict of NumPy arrays, Arrow arrays,
+pandas Series or lists. The mapping gives the parameter of each column, a
+name in the tracker's definitions, or 'timestamp' for the UNIX time at
+which each hit happened.
+
+Each column is checked and URL-encoded as a whole, and each distinct value
+is encoded once, so columns with few distinct values, e.g. categories, cost
+one dict lookup per row. Rows are then joined to the tracker's base
+payload, which is encoded once per call, and packed into batch bodies.
+Missing values, i.e. None or NaN, leave the parameter out of the row.
+
+
+"""
+
+from random import getrandbits as random_getrandbits
+from time import monotonic, time
+from urllib.parse import quote_plus, urlencode
+
+from .hit import MAX_QUEUE_TIME, Hit
+from .sender import BATCH_MAX_BYTES, BATCH_MAX_HITS, HIT_MAX_BYTES
+
+# hit type -> parameters that every row needs, as in the send_* methods
+REQUIRED_PARAMETERS = {
+    'pageview': ['dp', 'dh'],
+    'screenview': ['cd'],
+    'event': ['ec', 'ea'],
+    'social': ['sn', 'sa', 'st'],
+    'exception': [],
+    'timing': ['utc', 'utv', 'utt'],
+    'transaction': ['ti'],
+    'item': ['ti', 'in'],
+}
+
+INTEGER_PARAMETERS = ['ev', 'utt', 'plt', 'iq']
+BOOLEAN_PARAMETERS = ['ni', 'exf']
+TIMESTAMP = 'timestamp'
+
+def column_values(column):
+    """Get the values of a column as a list of Python objects.
+
+    Params:
+        column: NumPy array, pandas Series, Arrow array or iterable.
+
+    Returns:
+        (list): Values, e.g. int instead of numpy.int64.
+
+    """
+    if hasattr(column, 'tolist'):
+        # NumPy arrays and pandas Series
+        return column.tolist()
+    if hasattr(column, 'to_pylist'):
+        # Arrow arrays
+        return column.to_pylist()
+    return list(column)
+
+def is_missing(value):
+    if value is None:
+        return True
+    try:
+        # NaN is the only value that is not equal to itself
+        return bool(value != value)
+    except TypeError:
+        # pandas.NA compares to NA, which has no truth value
+        return True
+
+def check_integers(key, values):
+    """Check an integer column, turning whole floats into integers, as
+            pandas stores integer columns with missing values as floats.
+
+    Raises:
+        ValueError if a value is not an integer.
+
+    """
+    if all(type(value) is int for value in values):
+        return values
+    checked = []
+    for row, value in enumerate(values):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        elif not (is_missing(value) or isinstance(value, int)) \
+                or isinstance(value, bool):
+            raise ValueError('{} should be an integer in row {}: "{}".'.format(
+                key,
+                row,
+                value,
+            ))
+        checked.append(value)
+    return checked
+
+def check_numbers(key, values):
+    """Check a number column, e.g. a Custom Metric.
+
+    Raises:
+        ValueError if a value is not a number.
+
+    """
+    for row, value in enumerate(values):
+        if not isinstance(value, (float, int)) and not is_missing(value) \
+                or isinstance(value, bool):
+            raise ValueError('{} should be a number in row {}: "{}".'.format(
+                key,
+                row,
+                value,
+            ))
+    return values
+
+def encode_column(key, values):
+    """URL-encode a column as 'key=value' pieces.
+
+    Params:
+        key (str): Parameter of the column, e.g. 'ec'.
+        values (list): Checked values.
+
+    Returns:
+        (list): Pieces, with None for missing values.
+
+    """
+    prefix = quote_plus(key) + '='
+    if key in BOOLEAN_PARAMETERS:
+        pieces = {True: prefix + '1', False: prefix + '0'}
+        return [
+            None if is_missing(value) else pieces[bool(value)]
+            for value in values
+        ]
+
+    pieces = {}
+    encoded = []
+    append = encoded.append
+    for value in values:
+        try:
+            piece = pieces[value]
+        except KeyError:
+            if is_missing(value):
+                piece = None
+            elif type(value) is int:
+                # digits need no quoting
+                piece = prefix + str(value)
+            else:
+                piece = prefix + quote_plus(str(value))
+            pieces[value] = piece
+        except TypeError:
+            # unhashable, e.g. a list; encode it like urlencode() would
+            piece = prefix + quote_plus(str(value))
+        append(piece)
+    return encoded
+
+def resolve_mapping(mapping, definitions=None):
+    """Get the parameter of each column.
+
+    Params:
+        mapping (dict): Parameter, definition name or 'timestamp' by column.
+        definitions (DefinitionRegistry): (optional) Named definitions.
+
+    Returns:
+        (dict): Parameter or 'timestamp' by column.
+
+    Raises:
+        ValueError if two columns have the same parameter.
+
+    """
+    parameters = {}
+    for column, parameter in mapping.items():
+        if definitions is not None and parameter in definitions:
+            parameter = definitions.definitions[parameter].key
+        parameters[column] = parameter
+    if len(set(parameters.values())) < len(parameters):
+        raise ValueError('Each parameter should be mapped from one column.')
+    return parameters
+
+def encode_columns(
+        base_payload,
+        columns,
+        mapping,
+        hit_type='event',
+        destinations=None,
+        definitions=None,
+        counters=None,
+    ):
+    """Encode one hit per row of columnar data.
+
+    Params:
+        base_payload (dict): Parameters of every hit, e.g. v and cid,
+                without None values.
+        columns: DataFrame, or dict of columns by name.
+        mapping (dict): Parameter, definition name or 'timestamp' by column.
+                Example: { 'category': 'ec', 'action': 'ea', 'time': 'timestamp' }
+        hit_type (str): (optional) Type of the hits. Default: 'event'.
+        destinations (list): (optional) Destinations to copy hits for.
+                Default: None, i.e. base_payload's tid only.
+        definitions (DefinitionRegistry): (optional) Named definitions.
+        counters (dict): (optional) Counts of rows that are skipped, by
+                reason, to add to.
+
+    Returns:
+        (iterator): Hits, in row order.
+
+    Raises:
+        ValueError if hit_type is not found in REQUIRED_PARAMETERS.
+        ValueError if a column or a required parameter is missing.
+        ValueError if a column is not of its parameter's type.
+
+    """
+    if hit_type not in REQUIRED_PARAMETERS:
+        raise ValueError('Invalid hit_type: {}.'.format(hit_type))
+
+    parameters = resolve_mapping(mapping, definitions)
+    for parameter in REQUIRED_PARAMETERS[hit_type]:
+        if parameter not in parameters.values() and parameter not in base_payload:
+            raise ValueError('Missing column for {}.'.format(parameter))
+
+    pieces = []
+    required = []
+    timestamps = None
+    client_ids = None
+    for column, parameter in parameters.items():
+        try:
+            values = column_values(columns[column])
+        except KeyError:
+            raise ValueError('Missing column: {}.'.format(column))
+        if parameter == TIMESTAMP:
+            timestamps = check_numbers(TIMESTAMP, values)
+            continue
+        if parameter == 'cid':
+            client_ids = values
+        if parameter in INTEGER_PARAMETERS or parameter.startswith('cm'):
+            check = check_integers if parameter in INTEGER_PARAMETERS else check_numbers
+            values = check(parameter, values)
+        if parameter in REQUIRED_PARAMETERS[hit_type] or parameter == 'cid':
+            required.append(len(pieces))
+        pieces.append(encode_column(parameter, values))
+    if not pieces:
+        raise ValueError('Missing columns to send.')
+
+    # the base payload, less the columns' parameters, is encoded once
+    payload = dict(base_payload)
+    payload['t'] = hit_type
+    for parameter in parameters.values():
+        payload.pop(parameter, None)
+    tid = payload.pop('tid', None)
+    prefix = urlencode(payload)
+    if destinations is None:
+        destinations = []
+        if tid is not None:
+            prefix = 'tid={}&{}'.format(quote_plus(tid), prefix)
+    base_client_id = payload.get('cid')
+
+    counters = {} if counters is None else counters
+    for reason in ['missing', 'oversized', 'expired']:
+        counters.setdefault(reason, 0)
+    # the columns are checked by now; the rows are joined as they are taken
+    return join_rows(
+        prefix,
+        pieces,
+        required,
+        hit_type,
+        base_client_id,
+        client_ids,
+        timestamps,
+        destinations,
+        counters,
+    )
+
+def join_rows(
+        prefix,
+        pieces,
+        required,
+        hit_type,
+        base_client_id,
+        client_ids,
+        timestamps,
+        destinations,
+        counters,
+    ):
+    """Join the encoded columns into hits, row by row. Refer to
+            encode_columns()."""
+    # only look for missing values in the columns that have some
+    sparse = any(None in column for column in pieces)
+    required = [index for index in required if None in pieces[index]]
+    prefix += '&'
+    created = monotonic()
+    now = time()
+    for row, row_pieces in enumerate(zip(*pieces)):
+        if required and any(row_pieces[index] is None for index in required):
+            counters['missing'] += 1
+            continue
+        timestamp = None
+        if timestamps is not None:
+            timestamp = timestamps[row]
+            if is_missing(timestamp):
+                timestamp = None
+            elif now - timestamp > MAX_QUEUE_TIME:
+                counters['expired'] += 1
+                continue
+
+        if sparse:
+            row_pieces = [piece for piece in row_pieces if piece is not None]
+        body = '{}{}&z={:016x}'.format(
+            prefix,
+            '&'.join(row_pieces),
+            random_getrandbits(64),
+        )
+        client_id = base_client_id if client_ids is None else client_ids[row]
+        if not destinations:
+            if len(body) > HIT_MAX_BYTES:
+                counters['oversized'] += 1
+                continue
+            yield Hit(body, hit_type, client_id, created, timestamp)
+            continue
+        for destination in destinations:
+            if not destination.accepts(hit_type, client_id):
+                continue
+            if len(destination.prefix) + len(body) > HIT_MAX_BYTES:
+                counters['oversized'] += 1
+                continue
+            yield Hit(
+                destination.prefix + body,
+                hit_type,
+                client_id,
+                created,
+                timestamp,
+            )
+
+def pack_batches(hits, max_hits=BATCH_MAX_HITS, max_bytes=BATCH_MAX_BYTES):
+    """Pack hits into bodies for GA's batch endpoint. Queue times are
+            worked out as each batch is packed.
+
+    Params:
+        hits (iterable): Hits.
+        max_hits (int): (optional) Most hits per batch. Default: 20.
+        max_bytes (int): (optional) Most bytes per batch. Default: 16 KiB.
+
+    Returns:
+        (generator): Batch bodies, one hit per line.
+
+    """
+    batch = []
+    batch_bytes = 0
+    now = time()
+    for hit in hits:
+        line = hit.body if hit.timestamp is None else hit.encode(now)
+        size = len(line) + 1
+        if batch and (len(batch) >= max_hits or batch_bytes + size > max_bytes):
+            yield '\n'.join(batch)
+            batch = []
+            batch_bytes = 0
+            now = time()
+        batch.append(line)
+        batch_bytes += size
+    if batch:
+        yield '\n'.join(batch)
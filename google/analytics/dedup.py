@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Drop hits that were already sent, in bounded memory.
+
+
+Example:
+    ```
+    dedup = DedupFilter(window=3600, capacity=2000000, error_rate=0.0001)
+    sender = QueuedSender(dedup=dedup)
+    ...
+    resend(archives, sender) # hits that were sent in the last hour are dropped
+    ```
+
+Each hit carries an idempotency key, made of its property ID and its
+random cache buster, so copies of a hit share the key however they come
+back: retried, replayed from an archive or relayed twice.
+
+Keys are remembered in two Bloom filters. New keys go into the current
+one; when it is older than window, or holds capacity keys, it becomes the
+previous one and the oldest is dropped. Keys are therefore remembered for
+at least one window (unless more than capacity keys arrive in it) and
+memory stays flat. A Bloom filter can mistake a new key for a seen one,
+with a probability of about error_rate, but never the other way round.
+
+Senders only check keys when hits are queued, and remember them once GA
+has accepted their batch. A hit that failed, expired or was dropped can
+therefore be sent again, e.g. with resend(archives, sender, [None]), but
+copies queued before the first one is posted are all sent.
+
+
+"""
+
+from hashlib import blake2b
+from math import ceil, log
+from threading import Lock
+from time import monotonic
+
+class BloomFilter(object):
+    """Set of keys in a fixed number of bits, with false positives."""
+
+    __slots__ = ['size', 'hashes', 'bits', 'count']
+
+    def __init__(self, capacity, error_rate):
+        """Create a new, empty filter.
+
+        Params:
+            capacity (int): Number of keys to hold at error_rate.
+            error_rate (float): Probability that a new key looks seen.
+
+        """
+        self.size = max(8, int(ceil(-capacity * log(error_rate) / log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / float(capacity) * log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        """Get the bit positions of a key, by double hashing one digest."""
+        digest = blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [
+            (first + i * second) % self.size
+            for i in range(self.hashes)
+        ]
+
+    def contains(self, positions):
+        bits = self.bits
+        for position in positions:
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, positions):
+        bits = self.bits
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+class DedupFilter(object):
+    """Rotating pair of Bloom filters that remembers keys for a window."""
+
+    def __init__(self, window=3600, capacity=1000000, error_rate=0.001):
+        """Create a new filter.
+
+        Params:
+            window (float): (optional) Seconds for which keys are
+                    remembered. Default: 3600.
+            capacity (int): (optional) Most keys per window. Beyond it,
+                    keys are remembered for less than window.
+                    Default: 1000000, i.e. about 2 MB per filter.
+            error_rate (float): (optional) Probability that a new hit is
+                    dropped as a duplicate. Default: 0.001.
+
+        Raises:
+            ValueError if window is not a positive number.
+            ValueError if capacity is not a positive integer.
+            ValueError if error_rate is not between 0 and 1.
+
+        """
+        if not isinstance(window, (float, int)) or window <= 0:
+            raise ValueError('window should be a positive number.')
+        if not isinstance(capacity, int) or capacity <= 0:
+            raise ValueError('capacity should be a positive integer.')
+        if not isinstance(error_rate, float) or not 0 < error_rate < 1:
+            raise ValueError('error_rate should be between 0 and 1.')
+
+        self.window = window
+        self.capacity = capacity
+        # both filters are checked, so each gets half of the error rate
+        self.filter_error_rate = error_rate / 2.0
+        self.current = self.__new_filter()
+        self.previous = self.__new_filter()
+        self.rotated = monotonic()
+        self.duplicates = 0
+        self.lock = Lock()
+
+    def __new_filter(self):
+        return BloomFilter(self.capacity, self.filter_error_rate)
+
+    @property
+    def bytes(self):
+        """Memory used by the filters' bits."""
+        return len(self.current.bits) + len(self.previous.bits)
+
+    def __rotate(self, now):
+        # called with the lock held
+        if now - self.rotated >= self.window \
+                or self.current.count >= self.capacity:
+            if now - self.rotated >= 2 * self.window:
+                # the current filter's keys are older than the window too
+                self.current = self.__new_filter()
+            self.previous = self.current
+            self.current = self.__new_filter()
+            self.rotated = now
+
+    def __contains(self, positions):
+        # called with the lock held
+        if self.current.contains(positions) \
+                or self.previous.contains(positions):
+            self.duplicates += 1
+            return True
+        return False
+
+    def contains(self, key, now=None):
+        """Check whether a key was remembered in the window, without
+                remembering it.
+
+        Params:
+            key (str): Idempotency key, e.g. Hit.key.
+            now (float): (optional) Monotonic time.
+
+        Returns:
+            (bool): Whether the key is a duplicate. None keys never are.
+
+        """
+        if key is None:
+            return False
+        now = monotonic() if now is None else now
+        positions = self.current.positions(key)
+        with self.lock:
+            self.__rotate(now)
+            return self.__contains(positions)
+
+    def remember(self, key, now=None):
+        """Remember a key for the window, e.g. once its hit is sent.
+
+        Params:
+            key (str): Idempotency key, e.g. Hit.key.
+            now (float): (optional) Monotonic time.
+
+        """
+        if key is None:
+            return
+        now = monotonic() if now is None else now
+        positions = self.current.positions(key)
+        with self.lock:
+            self.__rotate(now)
+            self.current.add(positions)
+
+    def seen(self, key, now=None):
+        """Check whether a key was seen in the window, and remember it.
+
+        Params:
+            key (str): Idempotency key, e.g. Hit.key.
+            now (float): (optional) Monotonic time.
+
+        Returns:
+            (bool): Whether the key is a duplicate. None keys never are.
+
+        """
+        if key is None:
+            return False
+        now = monotonic() if now is None else now
+        # the filters have the same size, so positions are shared
+        positions = self.current.positions(key)
+
+        with self.lock:
+            self.__rotate(now)
+            if self.__contains(positions):
+                return True
+            self.current.add(positions)
+            return False
+
+    def after_fork_in_child(self):
+        """Use a new lock in a forked child. The keys are kept, because the
+                child may replay the parent's hits."""
+        self.lock = Lock()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Custom Dimensions and Metrics by name instead of by index.
+
+
+Example:
+    ```
+    definitions = DefinitionRegistry()
+    definitions.dimension('plan', 3, scope='user')
+    definitions.metric('basket_value', 1, metric_type='currency')
+
+    ga = GoogleAnalytics('UA-12345-6', definitions=definitions)
+    ga.set(custom_definitions={'plan': 'pro'}) # cd3=pro on every hit
+    ga.send_event('basket', 'add', custom_definitions={'basket_value': 9.5})
+    ```
+
+Keys such as 'cd3' are formatted and validators are picked once, when a
+definition is declared, so each hit only looks them up.
+
+
+"""
+
+SCOPES = ['hit', 'session', 'user', 'product']
+
+DIMENSION_MAX_BYTES = 150 # GA's limit for Custom Dimension values
+INDEX_MAX = 200
+
+def validate_string(name, value):
+    if not isinstance(value, str):
+        raise ValueError('"{}" custom_dimension {} should be a string.'.format(
+            value,
+            name,
+        ))
+    if len(value.encode('utf-8')) > DIMENSION_MAX_BYTES:
+        raise ValueError('"{}" custom_dimension {} is longer than {} bytes.'.format(
+            value,
+            name,
+            DIMENSION_MAX_BYTES,
+        ))
+
+def validate_integer(name, value):
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError('"{}" custom_metric {} should be an integer.'.format(
+            value,
+            name,
+        ))
+
+def validate_number(name, value):
+    if not isinstance(value, (float, int)) or isinstance(value, bool):
+        raise ValueError('"{}" custom_metric {} should be a number.'.format(
+            value,
+            name,
+        ))
+
+# metric type -> validator
+METRIC_TYPES = {
+    'integer': validate_integer,
+    'currency': validate_number,
+    'time': validate_integer,
+}
+
+class CustomDefinition(object):
+    """A named Custom Dimension or Metric with its key and validator."""
+
+    __slots__ = ['name', 'key', 'scope', 'validator']
+
+    def __init__(self, name, key, scope, validator):
+        self.name = name
+        self.key = key
+        self.scope = scope
+        self.validator = validator
+
+class DefinitionRegistry(object):
+    """Names of Custom Dimensions and Metrics, declared once per property."""
+
+    def __init__(self):
+        """Create a new, empty registry."""
+        self.definitions = {}
+
+    def __contains__(self, name):
+        return name in self.definitions
+
+    def __len__(self):
+        return len(self.definitions)
+
+    def __declare(self, name, key, scope, validator):
+        if scope not in SCOPES:
+            raise ValueError('Invalid scope: {}.'.format(scope))
+        if name in self.definitions:
+            raise ValueError('Custom definition {} is already declared.'.format(name))
+        for definition in self.definitions.values():
+            if definition.key == key:
+                raise ValueError('{} is already declared as {}.'.format(
+                    key,
+                    definition.name,
+                ))
+        self.definitions[name] = CustomDefinition(name, key, scope, validator)
+
+    def __check_index(self, index):
+        if not isinstance(index, int) or not 1 <= index <= INDEX_MAX:
+            raise ValueError(
+                'index should be an integer from 1 to {}.'.format(INDEX_MAX)
+            )
+
+    def dimension(self, name, index, scope='hit', validate=True):
+        """Declare a Custom Dimension.
+
+        Params:
+            name (str): Name to pass values by, e.g. 'plan'.
+            index (int): Index of the Custom Dimension, e.g. 3 for cd3.
+            scope (str): (optional) Scope of the Custom Dimension, as set up
+                    in GA. Refer to SCOPES. Default: 'hit'.
+            validate (bool): (optional) Whether to check that values are
+                    strings of at most 150 bytes. Default: True.
+
+        Raises:
+            ValueError if index is not an integer from 1 to 200.
+            ValueError if scope is not found in SCOPES.
+            ValueError if name or index is already declared.
+
+        """
+        self.__check_index(index)
+        self.__declare(
+            name,
+            'cd{}'.format(index),
+            scope,
+            validate_string if validate else None,
+        )
+
+    def metric(self, name, index, scope='hit', metric_type='integer'):
+        """Declare a Custom Metric.
+
+        Params:
+            name (str): Name to pass values by, e.g. 'basket_value'.
+            index (int): Index of the Custom Metric, e.g. 1 for cm1.
+            scope (str): (optional) Scope of the Custom Metric, as set up
+                    in GA. Refer to SCOPES. Default: 'hit'.
+            metric_type (str): (optional) Formatting type of the Custom
+                    Metric in GA. Refer to METRIC_TYPES. Default: 'integer'.
+
+        Raises:
+            ValueError if index is not an integer from 1 to 200.
+            ValueError if scope is not found in SCOPES.
+            ValueError if metric_type is not found in METRIC_TYPES.
+            ValueError if name or index is already declared.
+
+        """
+        self.__check_index(index)
+        if metric_type not in METRIC_TYPES:
+            raise ValueError('Invalid metric_type: {}.'.format(metric_type))
+        self.__declare(
+            name,
+            'cm{}'.format(index),
+            scope,
+            METRIC_TYPES[metric_type],
+        )
+
+    def resolve(self, values):
+        """Turn values by name into a payload.
+
+        Params:
+            values (dict): Values by name. None removes a tracker default.
+                    Example: { 'plan': 'pro', 'basket_value': 9.5 }
+
+        Returns:
+            (dict): Payload, e.g. { 'cd3': 'pro', 'cm1': 9.5 }.
+
+        Raises:
+            ValueError if a name is not declared.
+            ValueError if a value is not valid for its definition.
+
+        """
+        payload = {}
+        definitions = self.definitions
+        for name, value in values.items():
+            definition = definitions.get(name)
+            if definition is None:
+                raise ValueError('Unknown custom definition: {}.'.format(name))
+            if value is not None and definition.validator is not None:
+                definition.validator(name, value)
+            payload[definition.key] = value
+        return payload
+
+    def parameter_names(self):
+        """Get the names by key, e.g. for GA4Backend's parameter_names.
+
+        Returns:
+            (dict): Names by key, e.g. { 'cd3': 'plan' }.
+
+        """
+        return {
+            definition.key: name
+            for name, definition in self.definitions.items()
+        }
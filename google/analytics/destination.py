@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Properties that a tracker sends its hits to, with per-property filters.
+
+
+Example:
+    ```
+    ga = GoogleAnalytics([
+        'UA-12345-6',
+        Destination('UA-12345-7', sample_rate=0.1),
+        Destination('UA-12345-8', hit_types=['exception', 'timing']),
+    ])
+    ```
+
+Each hit is encoded once, and only the tid parameter differs between the
+copies for each property.
+
+
+"""
+
+from urllib.parse import quote
+from zlib import crc32
+
+SAMPLE_BUCKETS = 10000
+
+class Destination(object):
+    """A property to send hits to, and which hits it accepts."""
+
+    __slots__ = ['property_id', 'sample_rate', 'hit_types', 'prefix', 'threshold']
+
+    def __init__(self, property_id, sample_rate=1.0, hit_types=None):
+        """Create a new destination.
+
+        Params:
+            property_id (str): Tracking ID / web property ID.
+            sample_rate (float): (optional) Fraction of Client IDs whose hits
+                    are sent. The same Client IDs are always sampled.
+                    Default: 1.0.
+            hit_types (list): (optional) Types of hits to send. Refer to
+                    HIT_TYPES. Default: None, i.e. all types.
+
+        Raises:
+            ValueError if property_id is None.
+            ValueError if sample_rate is not between 0 and 1.
+
+        """
+        if not property_id:
+            raise ValueError('Missing property_id when creating destination.')
+        if not isinstance(sample_rate, (float, int)) \
+                or not 0 <= sample_rate <= 1:
+            raise ValueError('sample_rate should be between 0 and 1.')
+
+        self.property_id = property_id
+        self.sample_rate = sample_rate
+        self.hit_types = frozenset(hit_types) if hit_types is not None else None
+        # the only part of the encoded hit that differs between destinations
+        self.prefix = 'tid={}&'.format(quote(property_id, safe=''))
+        self.threshold = int(sample_rate * SAMPLE_BUCKETS)
+
+    def accepts(self, hit_type, client_id):
+        """Check whether a hit should be sent to this destination.
+
+        Params:
+            hit_type (str): Type of hit.
+            client_id (str): Client ID of the hit.
+
+        Returns:
+            (bool): Whether to send the hit.
+
+        """
+        if self.hit_types is not None and hit_type not in self.hit_types:
+            return False
+        if self.threshold >= SAMPLE_BUCKETS:
+            return True
+        bucket = crc32(str(client_id).encode('utf-8')) % SAMPLE_BUCKETS
+        return bucket < self.threshold
+
+def get_destinations(property_id):
+    """Get the destinations of a property ID, a Destination or a list of them.
+
+    Returns:
+        (list): Destinations.
+
+    Raises:
+        ValueError if there is no property ID.
+
+    """
+    property_ids = property_id if isinstance(property_id, (list, tuple)) \
+        else [property_id]
+    if not property_ids:
+        raise ValueError('Missing property_id.')
+
+    return [
+        destination if isinstance(destination, Destination)
+        else Destination(destination)
+        for destination in property_ids
+    ]
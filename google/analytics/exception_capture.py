@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""Send Exception hits for uncaught exceptions, without repeating them.
+
+
+Example:
+    ```
+    ga = GoogleAnalytics('UA-12345-6')
+    capture = ExceptionCapture(ga, window=60)
+    capture.install()
+    capture.install_asyncio(asyncio.get_event_loop())
+    ```
+
+The exception description is built from a normalised traceback, so the same
+crash gets the same description and fingerprint every time. The same
+fingerprint is sent at most once per window, and the number of repeats is
+sent with the next hit for it. Hits are sent from a background thread, so the
+crashing thread does not wait on the network.
+
+
+"""
+
+from collections import OrderedDict
+from hashlib import sha1
+from os.path import basename
+from threading import Lock
+from time import monotonic
+import re
+import sys
+import threading
+import traceback
+
+from . import lifecycle
+from .worker import BackgroundWorker
+
+EXD_MAX_LENGTH = 150 # bytes, GA's limit for the exd parameter
+
+NORMALISE_PATTERNS = [
+    (re.compile(r'0x[0-9a-fA-F]+'), '0x?'),
+    (re.compile(r'\'[^\']*\'|"[^"]*"'), '\'?\''),
+    (re.compile(r'\d+'), '?'),
+]
+
+def normalise_message(message):
+    """Replace the variable parts of an exception message, e.g. numbers,
+            addresses and quoted values."""
+    for pattern, replacement in NORMALISE_PATTERNS:
+        message = pattern.sub(replacement, message)
+    return message
+
+def fingerprint(exc_type, exc_value, exc_traceback):
+    """Get the fingerprint and description of an exception.
+
+    The fingerprint ignores line numbers and the variable parts of the
+    message, so it stays the same across repeats of the same crash.
+
+    Params:
+        exc_type (type): Type of the exception.
+        exc_value (BaseException): The exception.
+        exc_traceback (traceback): Traceback of the exception.
+
+    Returns:
+        (tuple): Fingerprint (str) and description (str) of at most
+                EXD_MAX_LENGTH bytes.
+
+    """
+    type_name = getattr(exc_type, '__qualname__', exc_type.__name__)
+    lines = str(exc_value).splitlines()
+    message = normalise_message(lines[0]) if lines else ''
+    frames = [
+        '{}:{}'.format(basename(frame.filename), frame.name)
+        for frame in traceback.extract_tb(exc_traceback)
+    ]
+
+    key = '|'.join([type_name, message] + frames)
+    digest = sha1(key.encode('utf-8')).hexdigest()[:8]
+
+    location = ' @{}'.format(frames[-1]) if frames else ''
+    suffix = '{} #{}'.format(location, digest)
+    head = '{}: {}'.format(type_name, message) if message else type_name
+    head = head.encode('utf-8')[:EXD_MAX_LENGTH - len(suffix.encode('utf-8'))]
+    description = head.decode('utf-8', 'ignore') + suffix
+
+    return digest, description
+
+class ExceptionCapture(object):
+    """Hooks for uncaught exceptions that send de-duplicated Exception hits."""
+
+    def __init__(
+            self,
+            tracker,
+            window=60,
+            max_fingerprints=1000,
+            count_metric=None,
+            worker=None,
+            fatal_timeout=2.0,
+        ):
+        """Create a new exception capture. Call install() to start it.
+
+        Params:
+            tracker (GoogleAnalytics): Tracker to send Exception hits with.
+            window (int): (optional) Seconds in which repeats of a fingerprint
+                    are not sent. Default: 60.
+            max_fingerprints (int): (optional) Most fingerprints to remember.
+                    The least recently seen one is forgotten first.
+                    Default: 1000.
+            count_metric (str): (optional) Custom Metric index to send the
+                    number of occurrences with. Without it, the number is
+                    added to the description when there are repeats.
+            worker (BackgroundWorker): (optional) Worker to send hits from.
+            fatal_timeout (float): (optional) Most seconds to wait for the
+                    hit of an exception that ends the program. Default: 2.0.
+
+        Raises:
+            ValueError if window is not a positive number.
+            ValueError if max_fingerprints is not a positive integer.
+
+        """
+        if not isinstance(window, (float, int)) or window <= 0:
+            raise ValueError('window should be a positive number.')
+        if not isinstance(max_fingerprints, int) or max_fingerprints <= 0:
+            raise ValueError('max_fingerprints should be a positive integer.')
+
+        self.tracker = tracker
+        self.window = window
+        self.max_fingerprints = max_fingerprints
+        self.count_metric = count_metric
+        self.worker = worker or BackgroundWorker(
+            max_queue=100,
+            name='google-analytics-exceptions',
+        )
+        self.fatal_timeout = fatal_timeout
+        # fingerprint -> [window start, repeats, description, fatal]
+        self.fingerprints = OrderedDict()
+        self.suppressed = 0
+        self.lock = Lock()
+
+        self.previous_excepthook = None
+        self.previous_threading_excepthook = None
+        self.previous_asyncio_handlers = {}
+        lifecycle.register(self)
+
+    def after_fork_in_child(self):
+        """Replace the lock, which another thread may have held at fork()."""
+        self.lock = Lock()
+
+    # Capturing
+
+    def capture(self, exc_type, exc_value, exc_traceback, fatal=False):
+        """Send an Exception hit unless its fingerprint was sent within the
+                window.
+
+        Params:
+            exc_type (type): Type of the exception.
+            exc_value (BaseException): The exception.
+            exc_traceback (traceback): Traceback of the exception.
+            fatal (bool): (optional) Whether the exception is fatal.
+                    Default: False.
+
+        Returns:
+            (bool): Whether a hit was queued.
+
+        """
+        key, description = fingerprint(exc_type, exc_value, exc_traceback)
+        now = monotonic()
+
+        with self.lock:
+            entry = self.fingerprints.get(key)
+            if entry is not None:
+                self.fingerprints.move_to_end(key)
+                if now - entry[0] < self.window:
+                    entry[1] += 1
+                    self.suppressed += 1
+                    return False
+            repeats = entry[1] if entry is not None else 0
+            self.fingerprints[key] = [now, 0, description, fatal]
+            if len(self.fingerprints) > self.max_fingerprints:
+                self.fingerprints.popitem(last=False)
+
+        return self.__send(description, fatal, repeats + 1)
+
+    def __send(self, description, fatal, count):
+        custom_metrics = None
+        if self.count_metric is not None:
+            custom_metrics = {self.count_metric: count}
+        elif count > 1:
+            description = '{} (x{})'.format(
+                description[:EXD_MAX_LENGTH - 8],
+                min(count, 99999),
+            )
+
+        return self.worker.submit(
+            self.tracker.send_exception,
+            description,
+            fatal,
+            custom_metrics=custom_metrics,
+        )
+
+    def flush(self, timeout=None):
+        """Send the repeats that have not been sent yet, and wait for the
+                queued hits.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait.
+
+        Returns:
+            (bool): Whether the queued hits were sent in time.
+
+        """
+        with self.lock:
+            pending = []
+            for entry in self.fingerprints.values():
+                if entry[1]:
+                    pending.append((entry[2], entry[3], entry[1]))
+                    entry[1] = 0
+
+        for description, fatal, count in pending:
+            self.__send(description, fatal, count)
+        return self.worker.flush(timeout)
+
+    # Hooks
+
+    def __excepthook(self, exc_type, exc_value, exc_traceback):
+        if not issubclass(exc_type, KeyboardInterrupt):
+            try:
+                self.capture(exc_type, exc_value, exc_traceback, fatal=True)
+                # the program is ending, so give the hit a moment to leave
+                self.worker.flush(self.fatal_timeout)
+            except Exception:
+                pass
+        self.previous_excepthook(exc_type, exc_value, exc_traceback)
+
+    def __threading_excepthook(self, args):
+        if args.exc_type is not SystemExit:
+            try:
+                self.capture(args.exc_type, args.exc_value, args.exc_traceback)
+            except Exception:
+                pass
+        self.previous_threading_excepthook(args)
+
+    def __asyncio_handler(self, loop, context):
+        exception = context.get('exception')
+        if exception is not None:
+            try:
+                self.capture(
+                    type(exception),
+                    exception,
+                    exception.__traceback__,
+                )
+            except Exception:
+                pass
+
+        previous_handler = self.previous_asyncio_handlers.get(id(loop))
+        if previous_handler is not None:
+            previous_handler(loop, context)
+        else:
+            loop.default_exception_handler(context)
+
+    def install(self):
+        """Capture uncaught exceptions from sys.excepthook and
+                threading.excepthook. The previous hooks are still called."""
+        if self.previous_excepthook is None:
+            self.previous_excepthook = sys.excepthook
+            sys.excepthook = self.__excepthook
+        if self.previous_threading_excepthook is None \
+                and hasattr(threading, 'excepthook'):
+            self.previous_threading_excepthook = threading.excepthook
+            threading.excepthook = self.__threading_excepthook
+
+    def install_asyncio(self, loop):
+        """Capture exceptions that reach the exception handler of an asyncio
+                event loop. The previous handler is still called.
+
+        Params:
+            loop (asyncio.AbstractEventLoop): Event loop to capture from.
+
+        """
+        self.previous_asyncio_handlers[id(loop)] = loop.get_exception_handler()
+        loop.set_exception_handler(self.__asyncio_handler)
+
+    def uninstall(self, loop=None):
+        """Restore the previous hooks.
+
+        Params:
+            loop (asyncio.AbstractEventLoop): (optional) Event loop whose
+                    previous exception handler to restore as well.
+
+        """
+        if self.previous_excepthook is not None:
+            sys.excepthook = self.previous_excepthook
+            self.previous_excepthook = None
+        if self.previous_threading_excepthook is not None:
+            threading.excepthook = self.previous_threading_excepthook
+            self.previous_threading_excepthook = None
+        if loop is not None and id(loop) in self.previous_asyncio_handlers:
+            loop.set_exception_handler(
+                self.previous_asyncio_handlers.pop(id(loop))
+            )
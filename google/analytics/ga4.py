@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""Send the hits of a tracker to GA4 through its Measurement Protocol.
+
+
+Example:
+    ```
+    backend = GA4Backend('api-secret', measurement_id='G-ABCDE12345')
+    ga = GoogleAnalytics('G-ABCDE12345', backend=backend)
+    ga.send_pageview('/page', 'domain.com') # page_view event
+    ga.send_event('menu', 'click', 'about') # click event
+    ```
+
+Each send_*() call becomes one GA4 event. Events are serialised to JSON as
+soon as they are sent, and up to 25 events of the same client are packed
+into one request to /mp/collect by string concatenation.
+
+.. _GA4 Measurement Protocol guide:
+   https://developers.google.com/analytics/devguides/collection/protocol/ga4
+
+
+"""
+
+from threading import Event, Lock, Thread
+from time import monotonic
+from urllib.parse import urlencode
+import json
+import logging
+import re
+
+from . import lifecycle
+from .transport import JSON_CONTENT_TYPE, RequestsTransport
+from .worker import BackgroundWorker
+
+GA4_ENDPOINT = 'https://www.google-analytics.com/mp/collect'
+GA4_DEBUG_ENDPOINT = 'https://www.google-analytics.com/debug/mp/collect'
+
+GA4_BATCH_MAX_EVENTS = 25
+GA4_NAME_MAX_LENGTH = 40
+GA4_VALUE_MAX_LENGTH = 100
+# GA4 drops events whose timestamp_micros is older than this
+GA4_MAX_EVENT_AGE = 72 * 3600 # seconds
+
+# UA parameters -> GA4 event parameters, per hit type
+EVENT_PARAMETERS = {
+    'pageview': {'dt': 'page_title', 'dr': 'page_referrer'},
+    'screenview': {'cd': 'screen_name'},
+    'event': {'ec': 'event_category', 'el': 'event_label', 'ev': 'value'},
+    'exception': {'exd': 'description'},
+    'social': {'sn': 'method', 'sa': 'content_type', 'st': 'item_id'},
+    'timing': {
+        'utc': 'event_category',
+        'utv': 'name',
+        'utt': 'value',
+        'utl': 'event_label',
+    },
+}
+
+CUSTOM_DEFINITION_KEY = re.compile(r'^c[dm]\d+$')
+INVALID_NAME_CHARACTERS = re.compile(r'[^0-9A-Za-z_]+')
+
+def event_name(name):
+    """Turn any string into a valid GA4 event name, e.g. 'Add to Cart' into
+            'add_to_cart'."""
+    name = INVALID_NAME_CHARACTERS.sub('_', name).strip('_').lower()
+    if not name or not name[0].isalpha():
+        name = 'event_{}'.format(name)
+    return name[:GA4_NAME_MAX_LENGTH]
+
+class GA4Backend(object):
+    """Maps hits onto GA4 events and sends them in JSON batches per client."""
+
+    def __init__(
+            self,
+            api_secret,
+            measurement_id=None,
+            max_delay=1.0,
+            parameter_names=None,
+            transport=None,
+            worker=None,
+            debug=False,
+            logger=None,
+        ):
+        """Create a new GA4 backend.
+
+        Params:
+            api_secret (str): API secret of the data stream.
+            measurement_id (str): (optional) Measurement ID of the data
+                    stream. Default: the property_id of the tracker.
+            max_delay (float): (optional) Most seconds that an event waits
+                    for its batch to fill. Default: 1.0.
+            parameter_names (dict): (optional) GA4 parameter names of Custom
+                    Dimensions and Metrics, e.g. { 'cd1': 'plan' }. Others
+                    keep their UA names, e.g. 'cd2'.
+            transport (RequestsTransport): (optional) Transport to post with.
+            worker (BackgroundWorker): (optional) Worker to post from.
+            debug (bool): (optional) Whether to send events to the validation
+                    server and log its messages. Default: False.
+            logger (logging.Logger): (optional) Logger for debug messages.
+
+        Raises:
+            ValueError if api_secret is None.
+            ValueError if debug is not a boolean.
+
+        """
+        if not api_secret:
+            raise ValueError('Missing api_secret when creating GA4 backend.')
+        if not isinstance(debug, bool):
+            raise ValueError('debug should be a boolean.')
+
+        self.api_secret = api_secret
+        self.measurement_id = measurement_id
+        self.max_delay = max_delay
+        self.parameter_names = parameter_names or {}
+        self.transport = transport or RequestsTransport()
+        self.worker = worker or BackgroundWorker(name='google-analytics-ga4')
+        self.debug = debug
+        self.logger = logger or logging.getLogger(__name__)
+        self.endpoint = GA4_DEBUG_ENDPOINT if debug else GA4_ENDPOINT
+        self.urls = {}
+        self.__reset()
+        lifecycle.register(self)
+
+    def __reset(self):
+        # (measurement ID, client ID, user ID) -> [first event time, events]
+        self.pending = {}
+        self.lock = Lock()
+        self.ticker = None
+        self.stopped = Event()
+
+    def after_fork_in_child(self):
+        """Drop the parent's pending events and ticker in a forked child.
+                The parent still sends them."""
+        if hasattr(self.transport, 'after_fork_in_child'):
+            self.transport.after_fork_in_child()
+        self.__reset()
+
+    # Mapping
+
+    def event(self, hit_type, data):
+        """Map a hit onto a GA4 event.
+
+        Params:
+            hit_type (str): Type of hit. Refer to HIT_TYPES.
+            data (dict): Payload of the hit without None values.
+
+        Returns:
+            (dict): Event with 'name' and 'params'.
+
+        """
+        if hit_type == 'pageview':
+            name = 'page_view'
+        elif hit_type == 'screenview':
+            name = 'screen_view'
+        elif hit_type == 'event':
+            name = event_name(data['ea'])
+        elif hit_type == 'exception':
+            name = 'exception'
+        elif hit_type == 'social':
+            name = 'share'
+        elif hit_type == 'timing':
+            name = 'timing_complete'
+        else:
+            name = event_name(hit_type)
+
+        params = {}
+        if hit_type == 'pageview' and 'dh' in data:
+            params['page_location'] = 'https://{}{}'.format(
+                data['dh'],
+                data.get('dp', ''),
+            )
+        if hit_type == 'exception':
+            params['fatal'] = bool(data.get('exf'))
+        if data.get('ni'):
+            params['non_interaction'] = True
+
+        for key, parameter in EVENT_PARAMETERS.get(hit_type, {}).items():
+            if key in data:
+                params[parameter] = data[key]
+        for key, value in data.items():
+            if CUSTOM_DEFINITION_KEY.match(key):
+                params[self.parameter_names.get(key, key)] = value
+
+        for parameter, value in params.items():
+            if isinstance(value, str) and len(value) > GA4_VALUE_MAX_LENGTH:
+                params[parameter] = value[:GA4_VALUE_MAX_LENGTH]
+
+        return {'name': name, 'params': params}
+
+    # Sending
+
+    def send(self, hit_type, data, timestamp=None):
+        """Queue a hit as a GA4 event. The tracker calls this for each hit.
+
+        Params:
+            hit_type (str): Type of hit. Refer to HIT_TYPES.
+            data (dict): Payload of the hit without None values.
+            timestamp (float): (optional) UNIX time at which the hit really
+                    happened, sent as the event's timestamp_micros. The
+                    tracker drops hits older than GA4_MAX_EVENT_AGE.
+
+        """
+        event = self.event(hit_type, data)
+        if timestamp is not None:
+            event['timestamp_micros'] = int(timestamp * 1000000)
+        # serialise now, so that the batch is a join of ready-made strings
+        event = json.dumps(event, separators=(',', ':'))
+        key = (
+            self.measurement_id or data.get('tid'),
+            data.get('cid'),
+            data.get('uid'),
+        )
+        now = monotonic()
+
+        with self.lock:
+            pending = self.pending.get(key)
+            if pending is None:
+                pending = self.pending[key] = [now, []]
+            pending[1].append(event)
+            full = len(pending[1]) >= GA4_BATCH_MAX_EVENTS
+            if full:
+                del self.pending[key]
+
+        if full:
+            self.__submit(key, pending[1])
+        elif self.ticker is None:
+            self.__start_ticker()
+
+    def __start_ticker(self):
+        with self.lock:
+            if self.ticker is not None:
+                return
+            self.ticker = Thread(target=self.__tick, name='google-analytics-ga4-ticker')
+            self.ticker.daemon = True
+            self.ticker.start()
+
+    def __tick(self):
+        while not self.stopped.wait(self.max_delay / 2.0):
+            self.__submit_due(monotonic() - self.max_delay)
+
+    def __submit_due(self, before=None):
+        """Submit the batches whose first event came before a time."""
+        with self.lock:
+            due = [
+                key for key, pending in self.pending.items()
+                if before is None or pending[0] <= before
+            ]
+            batches = [(key, self.pending.pop(key)[1]) for key in due]
+        for key, events in batches:
+            self.__submit(key, events)
+
+    def __submit(self, key, events):
+        measurement_id, client_id, user_id = key
+        body = '{{"client_id":{}{},"events":[{}]}}'.format(
+            json.dumps(client_id),
+            ',"user_id":{}'.format(json.dumps(user_id)) if user_id else '',
+            ','.join(events),
+        )
+        self.worker.submit(self.__post, self.__url(measurement_id), body)
+
+    def __url(self, measurement_id):
+        url = self.urls.get(measurement_id)
+        if url is None:
+            url = self.urls[measurement_id] = '{}?{}'.format(
+                self.endpoint,
+                urlencode({
+                    'measurement_id': measurement_id,
+                    'api_secret': self.api_secret,
+                }),
+            )
+        return url
+
+    def __post(self, url, body):
+        if not self.debug:
+            self.transport.post(url, body, content_type=JSON_CONTENT_TYPE)
+            return
+
+        response = self.transport.request(url, body, content_type=JSON_CONTENT_TYPE)
+        messages = response.json().get('validationMessages', [])
+        log_message = ['{} events: {}'.format(
+            'Invalid' if messages else 'Valid',
+            body,
+        )]
+        for message in messages:
+            log_message.append('- {}: {}'.format(
+                message.get('validationCode'),
+                message.get('description'),
+            ))
+        self.logger.debug('\n'.join(log_message))
+
+    def flush(self, timeout=None):
+        """Send the pending events now.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait.
+
+        Returns:
+            (bool): Whether the events were sent in time.
+
+        """
+        self.__submit_due()
+        return self.worker.flush(timeout)
+
+    def close(self, timeout=None):
+        """Send the pending events and stop the ticker."""
+        self.stopped.set()
+        return self.flush(timeout)
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""Queue hits and send them in batches from green threads.
+
+
+Example:
+    ```
+    sender = GreenSender('gevent', workers=10, linger=0.1)
+    ga = GoogleAnalytics('UA-12345-6', sender=sender)
+
+    def handle(request):
+        ga.send_pageview(request.path, request.host) # never yields
+    ```
+
+For services that run on gevent or eventlet. Hits are queued in the
+library's cooperative queue and batched by worker greenlets, so no OS
+thread or lock competes with the hub.
+
+If the socket module is monkey-patched, workers post on green sockets.
+Otherwise a blocking transport, e.g. requests, would stall the hub, so
+workers post in the library's thread pool and wait for it cooperatively.
+
+flush() called from another OS thread, e.g. by lifecycle.flush_all() at
+exit, cannot wait for the workers: their hub does not run while the
+thread that owns it waits. It takes the queued hits and posts them itself
+instead.
+
+
+"""
+
+from collections import namedtuple
+from threading import get_ident
+from time import monotonic, time
+import logging
+
+try:
+    import gevent # optional, for GreenSender('gevent')
+    import gevent.monkey
+    import gevent.queue
+except ImportError:
+    gevent = None
+
+try:
+    import eventlet # optional, for GreenSender('eventlet')
+    import eventlet.patcher
+    import eventlet.queue
+    import eventlet.tpool
+except ImportError:
+    eventlet = None
+
+from . import lifecycle
+from .measurement_protocol import GA_BATCH_ENDPOINT, GA_ENDPOINT
+from .sender import BATCH_MAX_BYTES, BATCH_MAX_HITS, HIT_MAX_BYTES
+from .transport import RequestsTransport
+
+logger = logging.getLogger(__name__)
+
+GREEN_LIBRARIES = ['gevent', 'eventlet']
+GREEN_POLICIES = ['drop-newest', 'drop-oldest']
+
+# what GreenSender needs from a green thread library
+GreenLibrary = namedtuple('GreenLibrary', [
+    'spawn',
+    'sleep',
+    'queue',
+    'empty',
+    'run_in_thread',
+    'socket_patched',
+])
+
+def get_library(name):
+    """Get the functions of a green thread library.
+
+    Params:
+        name (str): Name of the library. Refer to GREEN_LIBRARIES.
+
+    Returns:
+        (GreenLibrary): Functions of the library.
+
+    Raises:
+        ValueError if name is not found in GREEN_LIBRARIES.
+        ImportError if the library is not installed.
+
+    """
+    if name not in GREEN_LIBRARIES:
+        raise ValueError('Invalid library: {}.'.format(name))
+
+    if name == 'gevent':
+        if gevent is None:
+            raise ImportError('GreenSender needs gevent: pip install gevent')
+        return GreenLibrary(
+            gevent.spawn,
+            gevent.sleep,
+            gevent.queue.Queue,
+            gevent.queue.Empty,
+            lambda function, *args: gevent.get_hub().threadpool.apply(function, args),
+            lambda: gevent.monkey.is_module_patched('socket'),
+        )
+
+    if eventlet is None:
+        raise ImportError('GreenSender needs eventlet: pip install eventlet')
+    return GreenLibrary(
+        eventlet.spawn,
+        eventlet.sleep,
+        eventlet.queue.LightQueue,
+        eventlet.queue.Empty,
+        eventlet.tpool.execute,
+        lambda: eventlet.patcher.is_monkey_patched('socket'),
+    )
+
+class GreenSender(object):
+    """Sends queued hits in batches from worker greenlets."""
+
+    def __init__(
+            self,
+            library='gevent',
+            max_bytes=1024 * 1024,
+            policy='drop-newest',
+            transport=None,
+            recorder=None,
+            linger=0.0,
+            workers=10,
+            dedup=None,
+        ):
+        """Create a new sender. Its workers start with the first hit.
+
+        Params:
+            library (str): (optional) Green thread library of the service.
+                    Refer to GREEN_LIBRARIES. Default: 'gevent'.
+            max_bytes (int): (optional) Most bytes of encoded hits to queue.
+                    Default: 1 MiB.
+            policy (str): (optional) What to do when max_bytes is reached.
+                    Refer to GREEN_POLICIES. Default: 'drop-newest'.
+            transport (RequestsTransport): (optional) Transport to post
+                    batches with. Default: a new RequestsTransport.
+            recorder (HitRecorder): (optional) Recorder to archive every
+                    sent hit with its status.
+            linger (float): (optional) Most seconds to wait for a batch to
+                    fill before posting it. Default: 0.0.
+            workers (int): (optional) Number of greenlets posting batches at
+                    the same time. Default: 10.
+            dedup (DedupFilter): (optional) Filter to drop hits whose
+                    idempotency key was already sent. Keys are remembered
+                    once GA accepts their batch.
+
+        Raises:
+            ValueError if library is not found in GREEN_LIBRARIES.
+            ImportError if the library is not installed.
+            ValueError if max_bytes is not a positive integer.
+            ValueError if policy is not found in GREEN_POLICIES.
+            ValueError if workers is not a positive integer.
+
+        """
+        self.library = get_library(library)
+        if not isinstance(max_bytes, int) or max_bytes <= 0:
+            raise ValueError('max_bytes should be a positive integer.')
+        if policy not in GREEN_POLICIES:
+            raise ValueError('Invalid policy: {}.'.format(policy))
+        if not isinstance(workers, int) or workers <= 0:
+            raise ValueError('workers should be a positive integer.')
+
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.transport = transport or RequestsTransport()
+        self.recorder = recorder
+        self.linger = linger
+        self.worker_count = workers
+        self.dedup = dedup
+        self.__reset()
+        lifecycle.register(self)
+
+    def __reset(self):
+        self.queue = self.library.queue()
+        self.bytes = 0
+        # hits taken from the queue that are not sent yet
+        self.in_flight = 0
+        self.counters = {
+            'sent': 0,
+            'failed': 0,
+            'oversized': 0,
+            'duplicates': 0,
+            'expired': 0,
+            'dropped_newest': 0,
+            'dropped_oldest': 0,
+        }
+        self.workers = []
+        # OS thread whose hub runs the workers
+        self.owner = None
+
+    def after_fork_in_child(self):
+        """Start over with an empty queue, new connections and no worker in
+                a forked child. The parent still sends the hits it queued."""
+        if hasattr(self.transport, 'after_fork_in_child'):
+            self.transport.after_fork_in_child()
+        if self.dedup is not None:
+            self.dedup.after_fork_in_child()
+        self.__reset()
+
+    def send(self, hit):
+        """Queue a hit. Never yields to other greenlets.
+
+        Params:
+            hit (Hit): Encoded hit.
+
+        Returns:
+            (bool): Whether the hit was queued.
+
+        """
+        size = len(hit)
+        if size > HIT_MAX_BYTES:
+            self.counters['oversized'] += 1
+            return False
+        if self.dedup is not None and self.dedup.contains(hit.key):
+            self.counters['duplicates'] += 1
+            return False
+
+        if self.bytes + size > self.max_bytes:
+            if self.policy == 'drop-newest' or size > self.max_bytes:
+                self.counters['dropped_newest'] += 1
+                return False
+            while self.bytes + size > self.max_bytes:
+                try:
+                    oldest = self.queue.get_nowait()
+                except self.library.empty:
+                    break
+                self.bytes -= len(oldest)
+                self.counters['dropped_oldest'] += 1
+
+        if not self.workers:
+            self.owner = get_ident()
+            self.workers = [
+                self.library.spawn(self.__run)
+                for _ in range(self.worker_count)
+            ]
+        self.queue.put_nowait(hit)
+        self.bytes += size
+        return True
+
+    def __take(self, timeout):
+        """Take a hit from the queue, waiting cooperatively.
+
+        Returns:
+            (Hit): Hit, or None if none came in time.
+
+        """
+        try:
+            if timeout <= 0:
+                hit = self.queue.get_nowait()
+            else:
+                hit = self.queue.get(timeout=timeout)
+        except self.library.empty:
+            return None
+        self.bytes -= len(hit)
+        self.in_flight += 1
+        return hit
+
+    def __run(self):
+        # a hit that did not fit into the last batch starts the next one
+        carried = None
+        while True:
+            hit = carried if carried is not None else self.__take(1.0)
+            carried = None
+            if hit is None:
+                continue
+
+            batch = [hit]
+            batch_bytes = len(hit) + 1
+            deadline = monotonic() + self.linger
+            while len(batch) < BATCH_MAX_HITS:
+                hit = self.__take(deadline - monotonic())
+                if hit is None:
+                    break
+                if batch_bytes + len(hit) + 1 > BATCH_MAX_BYTES:
+                    carried = hit
+                    break
+                batch.append(hit)
+                batch_bytes += len(hit) + 1
+
+            self.__send_batch(batch)
+            self.in_flight -= len(batch)
+
+    def __send_batch(self, batch, in_hub=True):
+        now = time()
+        kept = [hit for hit in batch if not hit.expired(now)]
+        self.counters['expired'] += len(batch) - len(kept)
+        if not kept:
+            return
+        if not in_hub or self.library.socket_patched():
+            status = self.post_batch(kept)
+        else:
+            # a blocking post would stall the hub
+            status = self.library.run_in_thread(self.post_batch, kept)
+        if self.dedup is not None and status is not None \
+                and 200 <= status < 300:
+            for hit in kept:
+                self.dedup.remember(hit.key)
+        if self.recorder is not None:
+            self.recorder.record(kept, status)
+        self.counters['failed' if status is None else 'sent'] += len(kept)
+
+    def __drain(self, deadline):
+        """Take the queued hits and post them from this OS thread, which
+                does not run the workers' hub.
+
+        Returns:
+            (bool): Whether all queued hits were sent in time.
+
+        """
+        carried = None
+        while deadline is None or monotonic() < deadline:
+            batch = [] if carried is None else [carried]
+            batch_bytes = sum(len(hit) + 1 for hit in batch)
+            carried = None
+            while len(batch) < BATCH_MAX_HITS:
+                try:
+                    hit = self.queue.get_nowait()
+                except (self.library.empty, IndexError):
+                    break
+                self.bytes -= len(hit)
+                if batch and batch_bytes + len(hit) + 1 > BATCH_MAX_BYTES:
+                    carried = hit
+                    break
+                batch.append(hit)
+                batch_bytes += len(hit) + 1
+            if not batch:
+                break
+            self.__send_batch(batch, in_hub=False)
+        if carried is not None:
+            # out of time, so put it back for the workers
+            self.queue.put_nowait(carried)
+            self.bytes += len(carried)
+        # hits that the workers took stay with their hub
+        return not self.queue.qsize() and not self.in_flight
+
+    def post_batch(self, batch):
+        """Post a batch of hits, to the batch endpoint if there are several.
+                Refer to QueuedSender.post_batch().
+
+        Returns:
+            (int): HTTP status, or None if the request failed.
+
+        """
+        now = time()
+        try:
+            if len(batch) == 1:
+                return self.transport.post(GA_ENDPOINT, batch[0].encode(now))
+            return self.transport.post(
+                GA_BATCH_ENDPOINT,
+                '\n'.join(hit.encode(now) for hit in batch),
+            )
+        except Exception:
+            logger.debug('Sending %d hits failed.', len(batch), exc_info=True)
+            return None
+
+    def stats(self):
+        """Get the counters of the sender.
+
+        Returns:
+            (dict): Counts of queued, sent, failed and dropped hits.
+
+        """
+        stats = {
+            'queued_hits': self.queue.qsize(),
+            'queued_bytes': self.bytes,
+        }
+        stats.update(self.counters)
+        return stats
+
+    def flush(self, timeout=None):
+        """Wait cooperatively for the queued hits to be sent. From another
+                OS thread, post them from that thread instead.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait.
+
+        Returns:
+            (bool): Whether all queued hits were sent in time.
+
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        if self.owner is not None and get_ident() != self.owner:
+            return self.__drain(deadline)
+        while self.queue.qsize() or self.in_flight:
+            if deadline is not None and monotonic() >= deadline:
+                return False
+            self.library.sleep(0.01)
+        return True
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""Logging handlers that send log records as GA hits.
+
+
+Example:
+    ```
+    ga = GoogleAnalytics('UA-12345-6')
+    logging.getLogger().addHandler(ExceptionHandler(ga))
+    logging.getLogger('payments').addHandler(
+        EventHandler(ga, level=logging.WARNING, event_category='payments')
+    )
+    ```
+
+Records are queued on a background thread, so `logger.error(...)` never
+waits on the network. Records are rate-limited per logger name and message
+template, so an incident that logs the same error in a loop sends only a
+trickle of hits.
+
+
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+import logging
+
+from . import lifecycle
+from .exception_capture import EXD_MAX_LENGTH, fingerprint, normalise_message
+from .worker import BackgroundWorker
+
+IGNORED_LOGGER_PREFIX = 'google.analytics' # never report on ourselves
+
+class RateLimiter(object):
+    """Token buckets per key, with the least recently used keys forgotten."""
+
+    def __init__(self, rate=1.0, burst=10, max_keys=1000):
+        """Create a new rate limiter.
+
+        Params:
+            rate (float): (optional) Tokens added per second per key.
+                    Default: 1.0.
+            burst (int): (optional) Most tokens a key can save up.
+                    Default: 10.
+            max_keys (int): (optional) Most keys to remember. Default: 1000.
+
+        Raises:
+            ValueError if rate is not a positive number.
+            ValueError if burst is not a positive integer.
+
+        """
+        if not isinstance(rate, (float, int)) or rate <= 0:
+            raise ValueError('rate should be a positive number.')
+        if not isinstance(burst, int) or burst <= 0:
+            raise ValueError('burst should be a positive integer.')
+
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [tokens, monotonic time of the last refill]
+        self.buckets = OrderedDict()
+        self.limited = 0
+        self.lock = Lock()
+        lifecycle.register(self)
+
+    def after_fork_in_child(self):
+        """Replace the lock, which another thread may have held at fork()."""
+        self.lock = Lock()
+
+    def allow(self, key, now=None):
+        """Take a token for a key.
+
+        Returns:
+            (bool): Whether the key had a token.
+
+        """
+        now = monotonic() if now is None else now
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now]
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(
+                    self.burst,
+                    bucket[0] + (now - bucket[1]) * self.rate,
+                )
+                bucket[1] = now
+
+            if bucket[0] < 1:
+                self.limited += 1
+                return False
+            bucket[0] -= 1
+            return True
+
+class GoogleAnalyticsHandler(logging.Handler):
+    """Base handler that queues records to be sent by send_record()."""
+
+    def __init__(
+            self,
+            tracker,
+            level=logging.ERROR,
+            rate=1.0,
+            burst=10,
+            worker=None,
+        ):
+        """Create a new handler.
+
+        Params:
+            tracker (GoogleAnalytics): Tracker to send hits with.
+            level (int): (optional) Lowest level of records to send.
+                    Default: logging.ERROR.
+            rate (float): (optional) Hits per second allowed for each logger
+                    name and message template. Default: 1.0.
+            burst (int): (optional) Hits allowed at once for each logger
+                    name and message template. Default: 10.
+            worker (BackgroundWorker): (optional) Worker to send hits from.
+
+        """
+        logging.Handler.__init__(self, level)
+        self.tracker = tracker
+        self.rate_limiter = RateLimiter(rate, burst)
+        self.worker = worker or BackgroundWorker(
+            name='google-analytics-logging',
+        )
+
+    @property
+    def dropped(self):
+        """Number of records that were rate-limited or found a full queue."""
+        return self.rate_limiter.limited + self.worker.dropped
+
+    def emit(self, record):
+        if record.name.startswith(IGNORED_LOGGER_PREFIX):
+            return
+        try:
+            # the template, not the formatted message, so that
+            # 'user %s failed' is one key for all users
+            key = (record.name, str(record.msg))
+            if self.rate_limiter.allow(key):
+                self.worker.submit(self.__send, record)
+        except Exception:
+            self.handleError(record)
+
+    def __send(self, record):
+        try:
+            self.send_record(record)
+        except Exception:
+            self.handleError(record)
+
+    def send_record(self, record):
+        """Send a hit for a record. Runs on the worker thread."""
+        raise NotImplementedError
+
+    def flush(self, timeout=5.0):
+        """Wait for the queued records to be sent.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait, also when
+                    logging flushes the handler at exit. Default: 5.0.
+
+        Returns:
+            (bool): Whether the queued records were sent in time.
+
+        """
+        return self.worker.flush(timeout)
+
+    def close(self):
+        self.worker.close(timeout=0)
+        logging.Handler.close(self)
+
+class ExceptionHandler(GoogleAnalyticsHandler):
+    """Sends records as Exception hits. CRITICAL records are fatal."""
+
+    def __init__(
+            self,
+            tracker,
+            level=logging.ERROR,
+            fatal_level=logging.CRITICAL,
+            **kwargs
+        ):
+        """Create a new exception handler.
+
+        Params:
+            tracker (GoogleAnalytics): Tracker to send hits with.
+            level (int): (optional) Lowest level of records to send.
+                    Default: logging.ERROR.
+            fatal_level (int): (optional) Lowest level of fatal records.
+                    Default: logging.CRITICAL.
+
+        Other parameters are the same as GoogleAnalyticsHandler's.
+
+        """
+        GoogleAnalyticsHandler.__init__(self, tracker, level, **kwargs)
+        self.fatal_level = fatal_level
+
+    def describe(self, record):
+        """Get the exception description of a record."""
+        if record.exc_info and record.exc_info[0] is not None:
+            _, description = fingerprint(*record.exc_info)
+            return description
+
+        description = '{}: {}'.format(
+            record.name,
+            normalise_message(str(record.msg)),
+        )
+        return description.encode('utf-8')[:EXD_MAX_LENGTH].decode('utf-8', 'ignore')
+
+    def send_record(self, record):
+        self.tracker.send_exception(
+            self.describe(record),
+            record.levelno >= self.fatal_level,
+        )
+
+class EventHandler(GoogleAnalyticsHandler):
+    """Sends records as Event hits.
+
+    By default, the category is the logger name, the action is the level
+    name and the label is the message template. Each of them can be a fixed
+    string or a callable that takes the record.
+
+    """
+
+    def __init__(
+            self,
+            tracker,
+            level=logging.ERROR,
+            event_category=None,
+            event_action=None,
+            event_label=None,
+            non_interaction=True,
+            **kwargs
+        ):
+        """Create a new event handler.
+
+        Params:
+            tracker (GoogleAnalytics): Tracker to send hits with.
+            level (int): (optional) Lowest level of records to send.
+                    Default: logging.ERROR.
+            event_category (str or callable): (optional) Category of the
+                    event. Default: the logger name.
+            event_action (str or callable): (optional) Action of the event.
+                    Default: the level name.
+            event_label (str or callable): (optional) Label of the event.
+                    Default: the message template.
+            non_interaction (bool): (optional) Whether the events are
+                    non-interactive. Default: True.
+
+        Other parameters are the same as GoogleAnalyticsHandler's.
+
+        """
+        GoogleAnalyticsHandler.__init__(self, tracker, level, **kwargs)
+        self.event_category = event_category
+        self.event_action = event_action
+        self.event_label = event_label
+        self.non_interaction = non_interaction
+
+    def __field(self, mapping, record, default):
+        if mapping is None:
+            return default
+        if callable(mapping):
+            return mapping(record)
+        return mapping
+
+    def send_record(self, record):
+        self.tracker.send_event(
+            self.__field(self.event_category, record, record.name),
+            self.__field(self.event_action, record, record.levelname),
+            self.__field(self.event_label, record, str(record.msg)),
+            non_interaction=self.non_interaction,
+        )
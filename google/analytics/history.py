@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Import historical hits with their queue time, closest to expiry first.
+
+
+Example:
+    ```
+    sender = QueuedSender(buffer=DeadlineBuffer(), linger=0.5, connections=4)
+    ga = GoogleAnalytics('UA-12345-6', sender=sender)
+
+    for event in delayed_events:
+        ga.send_event('app', event.action, timestamp=event.time)
+    ga.flush()
+    sender.stats() # e.g. {'sent': 9990, 'expired': 10, ...}
+    ```
+
+A hit with a timestamp is sent with its queue time (qt), which is worked
+out when its batch is posted, not when it is queued. GA may not process
+hits that are older than 4 hours, so QueuedSender drops them and counts
+them as expired.
+
+DeadlineBuffer hands out the oldest hits first, because they are the
+closest to expiry, and drops expired hits before they take up a batch.
+
+
+"""
+
+from heapq import heappop, heappush
+from itertools import count
+from threading import Condition, Lock
+from time import monotonic, time
+
+from .sender import BATCH_MAX_BYTES, BATCH_MAX_HITS
+
+DEADLINE_POLICIES = ['block', 'drop-newest']
+
+class DeadlineBuffer(object):
+    """Hit buffer ordered by timestamp. Can be used as QueuedSender's
+            buffer."""
+
+    def __init__(
+            self,
+            max_bytes=16 * 1024 * 1024,
+            policy='block',
+            block_timeout=10.0,
+        ):
+        """Create a new deadline buffer.
+
+        Params:
+            max_bytes (int): (optional) Most bytes of encoded hits to hold.
+                    Default: 16 MiB.
+            policy (str): (optional) What to do when max_bytes is reached.
+                    Refer to DEADLINE_POLICIES. Default: 'block', so that an
+                    import goes as fast as hits are sent.
+            block_timeout (float): (optional) Most seconds that put() waits
+                    for room with the 'block' policy. Default: 10.0.
+
+        Raises:
+            ValueError if max_bytes is not a positive integer.
+            ValueError if policy is not found in DEADLINE_POLICIES.
+
+        """
+        if not isinstance(max_bytes, int) or max_bytes <= 0:
+            raise ValueError('max_bytes should be a positive integer.')
+        if policy not in DEADLINE_POLICIES:
+            raise ValueError('Invalid policy: {}.'.format(policy))
+
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.__reset()
+
+    def __reset(self):
+        # (timestamp, sequence, hit); the sequence keeps equal timestamps
+        # in order and stops hits from being compared
+        self.heap = []
+        self.sequence = count()
+        self.bytes = 0
+        self.counters = {
+            'dropped_newest': 0,
+            'block_timeouts': 0,
+            'expired': 0,
+        }
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+
+    def after_fork_in_child(self):
+        """Start empty in a forked child. The parent still sends the hits
+                it holds."""
+        self.__reset()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def put(self, hit):
+        """Add a hit by its timestamp. Hits without one count as happening
+                now.
+
+        Returns:
+            (bool): Whether the hit was kept.
+
+        """
+        size = len(hit)
+        timestamp = time() if hit.timestamp is None else hit.timestamp
+        with self.lock:
+            if self.bytes + size > self.max_bytes:
+                if self.policy == 'drop-newest' or size > self.max_bytes:
+                    self.counters['dropped_newest'] += 1
+                    return False
+                deadline = monotonic() + self.block_timeout
+                while self.bytes + size > self.max_bytes:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.counters['block_timeouts'] += 1
+                        return False
+                    self.not_full.wait(remaining)
+
+            heappush(self.heap, (timestamp, next(self.sequence), hit))
+            self.bytes += size
+            self.not_empty.notify()
+            return True
+
+    def get_batch(
+            self,
+            max_hits=BATCH_MAX_HITS,
+            max_bytes=BATCH_MAX_BYTES,
+            timeout=None,
+            linger=0.0,
+        ):
+        """Take the oldest hits that fit into one batch, dropping expired
+                ones.
+
+        Params:
+            Refer to HitBuffer.get_batch().
+
+        Returns:
+            (list): Hits, or an empty list if none came in time.
+
+        """
+        with self.lock:
+            if not self.heap:
+                self.not_empty.wait(timeout)
+
+            if linger > 0 and self.heap:
+                deadline = monotonic() + linger
+                while len(self.heap) < max_hits \
+                        and self.bytes + len(self.heap) < max_bytes:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.not_empty.wait(remaining)
+
+            now = time()
+            batch = []
+            batch_bytes = 0
+            while self.heap and len(batch) < max_hits:
+                hit = self.heap[0][2]
+                if hit.expired(now):
+                    heappop(self.heap)
+                    self.bytes -= len(hit)
+                    self.counters['expired'] += 1
+                    continue
+                size = len(hit) + 1
+                if batch and batch_bytes + size > max_bytes:
+                    break
+                heappop(self.heap)
+                self.bytes -= len(hit)
+                batch_bytes += size
+                batch.append(hit)
+
+            self.not_full.notify_all()
+            return batch
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Encoded hits as they travel through the sending pipeline."""
+
+from time import monotonic, time
+import re
+
+MAX_QUEUE_TIME = 4 * 3600 # seconds; GA may not process older hits
+
+KEY_PARAMETERS = re.compile(r'(?:^|&)(tid|z)=([^&]*)')
+
+def idempotency_key(body):
+    """Get the idempotency key of an encoded hit: its property ID and cache
+            buster, which is random per built hit.
+
+    Returns:
+        (str): Key, or None if the hit has no cache buster.
+
+    """
+    parameters = dict(KEY_PARAMETERS.findall(body))
+    if 'z' not in parameters:
+        return None
+    return '{}:{}'.format(parameters.get('tid', ''), parameters['z'])
+
+def queue_time(timestamp, now=None):
+    """Get the queue time (qt) of a hit: whole milliseconds since it
+            happened, and never negative."""
+    now = time() if now is None else now
+    return max(0, int((now - timestamp) * 1000))
+
+class Hit(object):
+    """An encoded hit and what the sending pipeline needs to know about it."""
+
+    __slots__ = ['body', 'hit_type', 'client_id', 'created', 'timestamp', '_key']
+
+    def __init__(
+            self,
+            body,
+            hit_type=None,
+            client_id=None,
+            created=None,
+            timestamp=None,
+        ):
+        """Create a new hit.
+
+        Params:
+            body (str): URL-encoded payload, without qt.
+            hit_type (str): (optional) Type of hit. Refer to HIT_TYPES.
+            client_id (str): (optional) Client ID of the hit.
+            created (float): (optional) Monotonic time of the hit.
+            timestamp (float): (optional) UNIX time at which the hit really
+                    happened, to send its queue time (qt) from.
+
+        """
+        self.body = body
+        self.hit_type = hit_type
+        self.client_id = client_id
+        self.created = monotonic() if created is None else created
+        self.timestamp = timestamp
+        self._key = None
+
+    @property
+    def key(self):
+        """Idempotency key of the hit. Copies of a hit, e.g. retried, spilled
+                or replayed from an archive, share it."""
+        if self._key is None:
+            self._key = idempotency_key(self.body)
+        return self._key
+
+    def expired(self, now=None):
+        """Check whether the hit is too old for GA. Hits without timestamp
+                never are."""
+        if self.timestamp is None:
+            return False
+        return (time() if now is None else now) - self.timestamp > MAX_QUEUE_TIME
+
+    def encode(self, now=None):
+        """Get the body to send now, with the queue time if the hit has a
+                timestamp."""
+        if self.timestamp is None:
+            return self.body
+        return '{}&qt={}'.format(self.body, queue_time(self.timestamp, now))
+
+    def __len__(self):
+        # hits are URL-encoded, so characters are bytes
+        return len(self.body)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""Queue hits in priority lanes by hit type, for QueuedSender.
+
+
+Example:
+    ```
+    buffer = LaneBuffer(DEFAULT_LANES, max_bytes=2 * 1024 * 1024)
+    sender = QueuedSender(buffer=buffer)
+    ga = GoogleAnalytics('UA-12345-6', sender=sender)
+    ...
+    sender.stats()['lanes']['high'] # e.g. {'wait_p99_ms': 12, ...}
+    ```
+
+Each lane holds the hits of some hit types, capped at its own max_bytes.
+Batches are filled from the lanes by smooth weighted round robin, so a lane
+with weight 4 gets 4 hits for each hit of a lane with weight 1, and an
+empty lane gives its share to the others.
+
+When the whole buffer reaches max_bytes, the oldest hits of the lanes after
+the new hit's lane are shed, lowest priority first, before the new hit is
+dropped. The time that hits wait in each lane is kept in a histogram.
+
+
+"""
+
+from collections import deque
+from threading import Condition, Lock
+from time import monotonic
+import re
+
+from .sender import BATCH_MAX_BYTES, BATCH_MAX_HITS
+from .timing import Histogram
+
+LANE_POLICIES = ['drop-newest', 'drop-oldest']
+
+HIT_TYPE_PARAMETER = re.compile(r'(?:^|&)t=([^&]*)')
+
+class Lane(object):
+    """A priority lane: which hit types it holds, its weight and its cap."""
+
+    def __init__(
+            self,
+            name,
+            hit_types=None,
+            weight=1,
+            max_bytes=256 * 1024,
+            policy='drop-oldest',
+        ):
+        """Create a new lane.
+
+        Params:
+            name (str): Name of the lane in stats.
+            hit_types (list): (optional) Types of hits in the lane. Refer to
+                    HIT_TYPES. Default: None, i.e. the hits that no other
+                    lane holds.
+            weight (int): (optional) Share of each batch. Default: 1.
+            max_bytes (int): (optional) Most bytes of encoded hits in the
+                    lane. Default: 256 KiB.
+            policy (str): (optional) What to do when max_bytes is reached.
+                    Refer to LANE_POLICIES. Default: 'drop-oldest'.
+
+        Raises:
+            ValueError if weight is not a positive integer.
+            ValueError if max_bytes is not a positive integer.
+            ValueError if policy is not found in LANE_POLICIES.
+
+        """
+        if not isinstance(weight, int) or weight <= 0:
+            raise ValueError('weight should be a positive integer.')
+        if not isinstance(max_bytes, int) or max_bytes <= 0:
+            raise ValueError('max_bytes should be a positive integer.')
+        if policy not in LANE_POLICIES:
+            raise ValueError('Invalid policy: {}.'.format(policy))
+
+        self.name = name
+        self.hit_types = frozenset(hit_types) if hit_types is not None else None
+        self.weight = weight
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.reset()
+
+    def reset(self):
+        self.hits = deque()
+        self.bytes = 0
+        self.current_weight = 0
+        self.wait = Histogram()
+        self.counters = {
+            'queued': 0,
+            'dropped_newest': 0,
+            'dropped_oldest': 0,
+            'shed': 0,
+        }
+
+    def popleft(self):
+        hit = self.hits.popleft()
+        self.bytes -= len(hit)
+        return hit
+
+    def stats(self):
+        """Get the counters of the lane and the wait of its hits.
+
+        Returns:
+            (dict): Counters, queued hits and bytes, and percentiles of the
+                    milliseconds that sent hits waited.
+
+        """
+        stats = {
+            'queued_hits': len(self.hits),
+            'queued_bytes': self.bytes,
+            'wait_p50_ms': self.wait.percentile(50),
+            'wait_p99_ms': self.wait.percentile(99),
+            'wait_max_ms': self.wait.max,
+        }
+        stats.update(self.counters)
+        return stats
+
+DEFAULT_LANES = [
+    Lane('high', ['exception', 'transaction', 'item'], weight=4),
+    Lane('normal', ['event', 'social', 'timing'], weight=2),
+    Lane('low', None, weight=1), # pageviews and screenviews
+]
+
+class LaneBuffer(object):
+    """Hit buffer with priority lanes. Can be used as QueuedSender's buffer."""
+
+    def __init__(self, lanes=None, max_bytes=None):
+        """Create a new lane buffer.
+
+        Params:
+            lanes (list): (optional) Lanes, highest priority first.
+                    Default: DEFAULT_LANES.
+            max_bytes (int): (optional) Most bytes of encoded hits in all
+                    lanes together. Default: None, i.e. only the lanes' caps.
+
+        Raises:
+            ValueError if lanes is empty or has duplicate names.
+
+        """
+        lanes = DEFAULT_LANES if lanes is None else lanes
+        if not lanes:
+            raise ValueError('Missing lanes.')
+        if len(set(lane.name for lane in lanes)) < len(lanes):
+            raise ValueError('Lane names should be unique.')
+
+        # the defaults are shared, so give each buffer its own lanes
+        self.lanes = [
+            Lane(lane.name, lane.hit_types, lane.weight, lane.max_bytes, lane.policy)
+            for lane in lanes
+        ]
+        self.max_bytes = max_bytes
+        self.lanes_by_type = {}
+        self.default_lane = self.lanes[-1]
+        for lane in self.lanes:
+            if lane.hit_types is None:
+                self.default_lane = lane
+            else:
+                for hit_type in lane.hit_types:
+                    self.lanes_by_type.setdefault(hit_type, lane)
+        self.__reset()
+
+    def __reset(self):
+        self.bytes = 0
+        for lane in self.lanes:
+            lane.reset()
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+
+    def after_fork_in_child(self):
+        """Start empty in a forked child. The parent still sends the hits
+                it holds."""
+        self.__reset()
+
+    def __len__(self):
+        return sum(len(lane.hits) for lane in self.lanes)
+
+    @property
+    def counters(self):
+        """Counters of all lanes together."""
+        counters = {}
+        for lane in self.lanes:
+            for name, value in lane.counters.items():
+                counters[name] = counters.get(name, 0) + value
+        return counters
+
+    def lane_stats(self):
+        """Get the stats of each lane by name. Refer to Lane.stats()."""
+        with self.lock:
+            return {lane.name: lane.stats() for lane in self.lanes}
+
+    def lane_of(self, hit):
+        """Get the lane of a hit by its type."""
+        hit_type = hit.hit_type
+        if hit_type is None:
+            # e.g. replayed from an archive
+            match = HIT_TYPE_PARAMETER.search(hit.body)
+            hit_type = match.group(1) if match else None
+        return self.lanes_by_type.get(hit_type, self.default_lane)
+
+    def put(self, hit):
+        """Add a hit to its lane, applying the lane's policy if the lane is
+                full, and shedding lower lanes if the buffer is full.
+
+        Returns:
+            (bool): Whether the hit was kept.
+
+        """
+        lane = self.lane_of(hit)
+        size = len(hit)
+        with self.lock:
+            if lane.bytes + size > lane.max_bytes:
+                if lane.policy == 'drop-newest' or size > lane.max_bytes:
+                    lane.counters['dropped_newest'] += 1
+                    return False
+                while lane.bytes + size > lane.max_bytes:
+                    self.bytes -= len(lane.popleft())
+                    lane.counters['dropped_oldest'] += 1
+
+            if self.max_bytes is not None and self.bytes + size > self.max_bytes:
+                lower_lanes = self.lanes[self.lanes.index(lane) + 1:]
+                for lower_lane in reversed(lower_lanes):
+                    while lower_lane.hits and self.bytes + size > self.max_bytes:
+                        self.bytes -= len(lower_lane.popleft())
+                        lower_lane.counters['shed'] += 1
+                if self.bytes + size > self.max_bytes:
+                    lane.counters['dropped_newest'] += 1
+                    return False
+
+            lane.hits.append(hit)
+            lane.bytes += size
+            self.bytes += size
+            lane.counters['queued'] += 1
+            self.not_empty.notify()
+            return True
+
+    def __next_lane(self):
+        """Pick a lane by smooth weighted round robin. The lock must be
+                held."""
+        best = None
+        total_weight = 0
+        for lane in self.lanes:
+            if lane.hits:
+                lane.current_weight += lane.weight
+                total_weight += lane.weight
+                if best is None or lane.current_weight > best.current_weight:
+                    best = lane
+        if best is not None:
+            best.current_weight -= total_weight
+        return best
+
+    def get_batch(
+            self,
+            max_hits=BATCH_MAX_HITS,
+            max_bytes=BATCH_MAX_BYTES,
+            timeout=None,
+            linger=0.0,
+        ):
+        """Take hits from the lanes by weight that fit into one batch.
+
+        Params:
+            Refer to HitBuffer.get_batch().
+
+        Returns:
+            (list): Hits, or an empty list if none came in time.
+
+        """
+        with self.lock:
+            if not len(self):
+                self.not_empty.wait(timeout)
+
+            if linger > 0 and len(self):
+                deadline = monotonic() + linger
+                while len(self) < max_hits \
+                        and self.bytes + len(self) < max_bytes:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.not_empty.wait(remaining)
+
+            now = monotonic()
+            batch = []
+            batch_bytes = 0
+            while len(batch) < max_hits:
+                lane = self.__next_lane()
+                if lane is None:
+                    break
+                size = len(lane.hits[0]) + 1
+                if batch and batch_bytes + size > max_bytes:
+                    break
+                hit = lane.popleft()
+                self.bytes -= len(hit)
+                lane.wait.record(max(0, int((now - hit.created) * 1000)))
+                batch_bytes += size
+                batch.append(hit)
+            return batch
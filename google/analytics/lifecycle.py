@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Keep trackers and their background queues safe across fork() and exit.
+
+
+Objects that hold threads, locks, queues or buffered hits register here.
+Each of them has either or both of these methods:
+
+    after_fork_in_child(): Reset threads, locks and queues in a forked child.
+            Anything buffered belongs to the parent, which still sends it.
+    flush(timeout=None): Send buffered hits within timeout seconds, and
+            return False if they could not all be sent in time.
+
+At interpreter exit, every registered object is flushed within one hard
+deadline, so that shutdown neither loses buffered hits nor hangs on the
+network.
+
+
+Example:
+    ```
+    from google.analytics import lifecycle
+    lifecycle.set_exit_timeout(2.0)
+    ```
+
+
+"""
+
+from threading import Thread
+from time import monotonic
+from weakref import WeakSet
+import atexit
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+EXIT_TIMEOUT = 5.0 # seconds
+
+_registry = WeakSet()
+_exit_timeout = EXIT_TIMEOUT
+
+def register(obj):
+    """Register an object for fork and exit handling. Only a weak reference
+            is kept, so registering does not keep the object alive."""
+    _registry.add(obj)
+
+def unregister(obj):
+    """Stop handling fork and exit for an object."""
+    _registry.discard(obj)
+
+def set_exit_timeout(timeout):
+    """Set the most seconds to spend flushing at interpreter exit.
+
+    Params:
+        timeout (float): Seconds. 0 skips flushing at exit.
+
+    Raises:
+        ValueError if timeout is not a non-negative number.
+
+    """
+    global _exit_timeout
+    if not isinstance(timeout, (float, int)) or timeout < 0:
+        raise ValueError('timeout should be a non-negative number.')
+    _exit_timeout = timeout
+
+def _flush_objects(objects, deadline, results):
+    for obj in objects:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            results.append(False)
+            return
+        try:
+            results.append(obj.flush(timeout=remaining) is not False)
+        except Exception:
+            results.append(False)
+            logger.debug('Flushing %r failed.', obj, exc_info=True)
+
+def flush_all(timeout=None):
+    """Flush every registered object within one deadline.
+            The flushes run on a daemon thread, so a hung request cannot
+            hold up the caller for longer than timeout.
+
+    Params:
+        timeout (float): (optional) Most seconds to wait.
+                Default: the exit timeout.
+
+    Returns:
+        (bool): Whether every object was flushed in time, i.e. none of
+                them raised or returned False.
+
+    """
+    timeout = _exit_timeout if timeout is None else timeout
+    objects = [obj for obj in list(_registry) if hasattr(obj, 'flush')]
+    if not objects or timeout <= 0:
+        return not objects
+
+    deadline = monotonic() + timeout
+    # filled in by the thread, one result per object
+    results = []
+    thread = Thread(
+        target=_flush_objects,
+        args=(objects, deadline, results),
+        name='google-analytics-flush',
+    )
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive() and len(results) == len(objects) and all(results)
+
+def _after_fork_in_child():
+    for obj in list(_registry):
+        if not hasattr(obj, 'after_fork_in_child'):
+            continue
+        try:
+            obj.after_fork_in_child()
+        except Exception:
+            pass
+
+atexit.register(flush_all)
+
+if hasattr(os, 'register_at_fork'):
+    # the parent keeps its threads and queues, so it needs no hook
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -24,13 +24,29 @@ __author__ = 'Yu Hui'
 __version__ = '1.0a2'
 __license__ = 'License :: OSI Approved :: MIT License'
 
-from random import random  as random_random # to generate the cache buster
+from collections import deque, namedtuple
+from random import getrandbits as random_getrandbits # to generate the cache buster
+from random import random  as random_random # to generate the client ID
 from sys import version as sys_version # to generate the user agent
+from threading import Lock, local
+from time import monotonic # to flush within a timeout
+from time import time # to work out the queue time of historical hits
+from types import MappingProxyType # to share config read-only
+from urllib.parse import urlencode # to encode hits for queued sending
 import logging
 import requests # to send hits to GA's collection endpoint
 
+from . import lifecycle
+from .aggregation import EventAggregator
+from .destination import get_destinations
+from .ga4 import GA4_MAX_EVENT_AGE
+from .hit import MAX_QUEUE_TIME, Hit, queue_time
+from .timing import Timer, TimingAggregator
+from .transport import DEFAULT_TIMEOUT
+
 GA_ENDPOINT = "https://www.google-analytics.com/collect"
 GA_DEBUG_ENDPOINT = "https://www.google-analytics.com/debug/collect"
+GA_BATCH_ENDPOINT = "https://www.google-analytics.com/batch"
 
 HIT_TYPES = [
     'pageview',     # Pageview
@@ -43,27 +59,45 @@ HIT_TYPES = [
     'timing',       # User timing
 ]
 
+# read-only view of a tracker's configuration that hits are built from.
+# set() replaces it as a whole, so a hit never sees half of a change.
+TrackerConfig = namedtuple('TrackerConfig', [
+    'tracker_type',
+    'base_payload',
+    'custom_dimensions',
+    'custom_metrics',
+])
+
 class GoogleAnalytics(object):
     """GA tracker object for preparing and sending data to GA's endpoint."""
 
     tracker_type = 'web' # app or web
+    aggregate_events = False
     debug = False
+    destinations = None
+    events = None
+    expired_hits = 0
     logger = None
+    shadow = None
 
     app_name = None
     app_id = None
     app_version = None
     app_installer_id = None
+    backend = None
     client_id = None
-    custom_dimensions = {}
-    custom_metrics = {}
+    custom_dimensions = None
+    custom_metrics = None
     data_source = 'python'
+    definitions = None
     document_encoding = None
-    hostname = None
     ip_address = None
-    page = None
     property_id = None
-    screen_name = None
+    sender = None
+    session_manager = None
+    timings = None
+    timeout = DEFAULT_TIMEOUT
+    transport = None
     user_agent = sys_version.replace('\n', '')
     user_id = None
     user_language = None
@@ -81,11 +115,24 @@ class GoogleAnalytics(object):
             user_language=None,
             debug=False,
             logger=None,
+            session_manager=None,
+            timing_window=60,
+            timing_metrics=None,
+            sender=None,
+            backend=None,
+            transport=None,
+            definitions=None,
+            aggregate_events=False,
+            event_window=60,
+            timeout=DEFAULT_TIMEOUT,
+            shadow=None,
         ):
         """Create a new tracker object with base properties.
 
         Params:
-            property_id (str): Tracking ID / web property ID.
+            property_id (str): Tracking ID / web property ID. Can be a list of
+                    property IDs or Destinations to send each hit to all of
+                    them. property_id is then set to the first one.
             client_id (str): (optional) Anonymous ID of a user,
                     device, or browser instance.
             user_id (str): Known ID of the user.
@@ -95,17 +142,69 @@ class GoogleAnalytics(object):
             user_language (str): (optional) ISO 639-1 language of the user.
             debug (bool): (optional) Whether to send debugging hits.
                     Default: False.
+            logger (logging.Logger): (optional) Logger for debugging messages.
+            session_manager (SessionManager): (optional) Session state to
+                    start sessions automatically. Can be shared by trackers.
+            timing_window (int): (optional) Seconds over which timer()
+                    measurements are summarised into one hit. Default: 60.
+            timing_metrics (dict): (optional) Custom Metric indices to send
+                    timer() summaries with.
+                    Syntax: { field: index, field: index, ... }
+                    Example: { 'count': '1', 'p95': '2' }
+            sender (QueuedSender): (optional) Sender to queue hits on
+                    instead of sending them before returning. Not used when
+                    debug is True.
+            backend (GA4Backend): (optional) Backend to send hits to instead
+                    of the Universal Analytics endpoints, e.g. to GA4.
+            transport (RequestsTransport): (optional) Transport to send hits
+                    with when there is no sender, e.g. an HTTP2Transport to
+                    share one connection between threads.
+                    Default: None, i.e. requests.post().
+            definitions (DefinitionRegistry): (optional) Names of Custom
+                    Dimensions and Metrics, to pass custom_definitions by.
+            aggregate_events (bool): (optional) Whether send_event() merges
+                    matching events into one hit per event_window.
+                    Default: False.
+            event_window (int): (optional) Seconds over which merged events
+                    are summed into one hit. Default: 60.
+            timeout (float): (optional) Most seconds that sending a hit
+                    without a sender waits for GA. Default: DEFAULT_TIMEOUT.
+            shadow (ShadowValidator): (optional) Validator to mirror a
+                    sample of hits to the validation server with. Not used
+                    when debug is True.
 
         Raises:
             ValueError if debug is not a boolean.
+            ValueError if aggregate_events is not a boolean.
 
         """
-        self.property_id = property_id
+        # guards config changes and expired_hits
+        self.__config_lock = Lock()
+        self.__context = local() # page, hostname and screen name per thread
+        self.__session_controls = deque()
+        self.custom_dimensions = {}
+        self.custom_metrics = {}
+        self.destinations = get_destinations(property_id)
+        self.property_id = self.destinations[0].property_id
         self.user_id = user_id
         self.client_id = self.__client_id(client_id)
         self.document_encoding = document_encoding
         self.ip_address = ip_address
         self.user_language = user_language
+        self.session_manager = session_manager
+        self.sender = sender
+        self.backend = backend
+        self.transport = transport
+        self.timeout = timeout
+        self.shadow = shadow
+        self.definitions = definitions
+        self.timings = TimingAggregator(self, timing_window, timing_metrics)
+        if not isinstance(aggregate_events, bool):
+            raise ValueError('aggregate_events should be a boolean.')
+        self.aggregate_events = aggregate_events
+        self.events = EventAggregator(self, event_window)
+        self.__update_config()
+        lifecycle.register(self)
 
         if debug is not None and not isinstance(debug, bool):
             raise ValueError('debug should be a boolean.')
@@ -140,7 +239,8 @@ class GoogleAnalytics(object):
     # Utilities
 
     def __cache_buster(self):
-        return self.__random()
+        # 64 random bits, so that it doubles as the hit's idempotency key
+        return '{:016x}'.format(random_getrandbits(64))
 
     def __is_number(self, value):
         return isinstance(value, (float, int))
@@ -201,10 +301,11 @@ class GoogleAnalytics(object):
                 'Expected custom_{} as a dict.'.format(def_type)
             )
 
+        # copy, so that the dict in the current config stays unchanged
         if def_type == 'dimensions':
-            custom_definitions = self.custom_dimensions
+            custom_definitions = dict(self.custom_dimensions)
         elif def_type == 'metrics':
-            custom_definitions = self.custom_metrics
+            custom_definitions = dict(self.custom_metrics)
 
         for index, value in dictionary.items():
             if def_type == 'metrics' and not self.__is_number(value):
@@ -224,7 +325,10 @@ class GoogleAnalytics(object):
             else:
                 custom_definitions[key] = value
 
-        return
+        if def_type == 'dimensions':
+            self.custom_dimensions = custom_definitions
+        elif def_type == 'metrics':
+            self.custom_metrics = custom_definitions
 
     def __set_custom_dimensions(
             self,
@@ -260,6 +364,27 @@ class GoogleAnalytics(object):
             custom_metrics
         )
 
+    def __set_named_definitions(self, custom_definitions):
+        """Set base Custom Dimensions and Metrics by name.
+
+        Params:
+            custom_definitions (dict): Values by name.
+
+        """
+        if custom_definitions is None:
+            return
+
+        custom_dimensions = dict(self.custom_dimensions)
+        custom_metrics = dict(self.custom_metrics)
+        for key, value in self.__get_named_definitions(custom_definitions).items():
+            target = custom_dimensions if key.startswith('cd') else custom_metrics
+            if value is None:
+                target.pop(key, None)
+            else:
+                target[key] = value
+        self.custom_dimensions = custom_dimensions
+        self.custom_metrics = custom_metrics
+
     def __set_user_id(
             self,
             user_id=None,
@@ -276,6 +401,7 @@ class GoogleAnalytics(object):
             app_id=None,
             app_version=None,
             app_installer_id=None,
+            custom_definitions=None,
         ):
         """Set the base properties for all hits.
                 All parameters are optional.
@@ -292,25 +418,30 @@ class GoogleAnalytics(object):
             app_id (str): ID of the application.
             app_version (str): Version of the application.
             app_installer_id (str): Installer ID of the application.
+            custom_definitions (dict): Custom Dimension and Metric values by
+                    name in the tracker's definitions.
+                    Example: { 'plan': 'pro', 'basket_value': 9.5 }
 
-        """
-        self.__set_custom_dimensions(custom_dimensions)
-        self.__set_custom_metrics(custom_metrics)
-        self.__set_user_id(user_id)
-        self.__set_app_parameters(
-            app_name,
-            app_id,
-            app_version,
-            app_installer_id
-        )
+        Changes take effect together, so hits that are sent from other threads
+        meanwhile get either all of them or none.
 
-    # Sending hits
-
-    def __get_base_payload(self):
-        """Get the base payload for all hits."""
-        cache_buster = self.__cache_buster()
+        """
+        with self.__config_lock:
+            self.__set_custom_dimensions(custom_dimensions)
+            self.__set_custom_metrics(custom_metrics)
+            self.__set_named_definitions(custom_definitions)
+            self.__set_user_id(user_id)
+            self.__set_app_parameters(
+                app_name,
+                app_id,
+                app_version,
+                app_installer_id
+            )
+            self.__update_config()
 
-        payload = {
+    def __update_config(self):
+        """Replace the config that hits are built from with a new one."""
+        base_payload = {
             'cid': self.client_id,
             'de': self.document_encoding,
             'ds': self.data_source,
@@ -320,17 +451,67 @@ class GoogleAnalytics(object):
             'uip': self.ip_address,
             'ul': self.user_language,
             'v': self.version,
-            'z': cache_buster,
         }
+        if self.tracker_type == 'app':
+            base_payload['an'] = self.app_name
+            base_payload['aid'] = self.app_id
+            base_payload['av'] = self.app_version
+            base_payload['aiid'] = self.app_installer_id
+
+        self.__config = TrackerConfig(
+            self.tracker_type,
+            MappingProxyType(base_payload),
+            MappingProxyType(dict(self.custom_dimensions)),
+            MappingProxyType(dict(self.custom_metrics)),
+        )
+
+    # Per-thread state
+
+    @property
+    def hostname(self):
+        """Hostname of the last pageview sent from the current thread."""
+        return getattr(self.__context, 'hostname', None)
+
+    @hostname.setter
+    def hostname(self, hostname):
+        self.__context.hostname = hostname
+
+    @property
+    def page(self):
+        """Page of the last pageview sent from the current thread."""
+        return getattr(self.__context, 'page', None)
+
+    @page.setter
+    def page(self, page):
+        self.__context.page = page
+
+    @property
+    def screen_name(self):
+        """Screen name of the last screenview sent from the current thread."""
+        return getattr(self.__context, 'screen_name', None)
+
+    @screen_name.setter
+    def screen_name(self, screen_name):
+        self.__context.screen_name = screen_name
+
+    # Sending hits
+
+    def __get_base_payload(self, config):
+        """Get the base payload for all hits.
+
+        Params:
+            config (TrackerConfig): Config to build the payload from.
+
+        """
+        cache_buster = self.__cache_buster()
+
+        payload = dict(config.base_payload)
+        payload['z'] = cache_buster
 
-        if self.tracker_type == 'web':
+        if config.tracker_type == 'web':
             payload['dh'] = self.hostname
             payload['dp'] = self.page
-        elif self.tracker_type == 'app':
-            payload['an'] = self.app_name
-            payload['aid'] = self.app_id
-            payload['av'] = self.app_version
-            payload['aiid'] = self.app_installer_id
+        elif config.tracker_type == 'app':
             payload['cd'] = self.screen_name
 
         return payload
@@ -365,7 +546,7 @@ class GoogleAnalytics(object):
 
         return payload
 
-    def __get_custom_definitions(self, def_type, dictionary):
+    def __get_custom_definitions(self, def_type, dictionary, config):
         """Get the payload for Custom Definitions (Dimensions or Metrics).
         Merges the values of dictionary with the base custom_dimensions or
         custom_metrics dictionaries.
@@ -375,6 +556,7 @@ class GoogleAnalytics(object):
             dictionary (dict): Indices and values.
                     Refer to the specification for custom_dimensions and
                     custom_metrics.
+            config (TrackerConfig): Config with the base dictionaries.
 
         Returns:
             (dict): Payload with Custom Definition properties.
@@ -392,9 +574,9 @@ class GoogleAnalytics(object):
 
         payload = {}
         if def_type == 'dimensions':
-            payload.update(self.custom_dimensions)
+            payload.update(config.custom_dimensions)
         elif def_type == 'metrics':
-            payload.update(self.custom_metrics)
+            payload.update(config.custom_metrics)
 
         if dictionary is not None:
             if not isinstance(dictionary, dict):
@@ -422,13 +604,14 @@ class GoogleAnalytics(object):
 
         return payload
 
-    def __get_custom_dimensions(self, custom_dimensions):
+    def __get_custom_dimensions(self, custom_dimensions, config):
         """Get the payload for Custom Dimensions.
 
         Params:
             custom_dimensions (dict): Custom Dimension indices and values.
                     Syntax: { index: value, index: value, ... }
                     Example: { '1': 'foo', '3': 'bar' }
+            config (TrackerConfig): Config with the base Custom Dimensions.
 
         Returns:
             (dict): Payload with Custom Dimension properties.
@@ -437,16 +620,18 @@ class GoogleAnalytics(object):
         payload = self.__get_custom_definitions(
             'dimensions',
             custom_dimensions,
+            config,
         )
         return payload
 
-    def __get_custom_metrics(self, custom_metrics):
+    def __get_custom_metrics(self, custom_metrics, config):
         """Get the payload for Custom Metrics.
 
         Params:
             custom_metrics (dict): Custom Metric indices and values.
                     Syntax: { index: value, index: value, ... }
                     Example: { '1': 10, '4': 5.6 }
+            config (TrackerConfig): Config with the base Custom Metrics.
 
         Returns:
             (dict): Payload with Custom Metric properties.
@@ -455,9 +640,67 @@ class GoogleAnalytics(object):
         payload = self.__get_custom_definitions(
             'metrics',
             custom_metrics,
+            config,
         )
         return payload
 
+    def __get_named_definitions(self, custom_definitions):
+        """Get the payload for Custom Dimensions and Metrics by name.
+
+        Params:
+            custom_definitions (dict): Values by name.
+
+        Returns:
+            (dict): Payload with Custom Definition properties. None values
+                    remove base properties.
+
+        Raises:
+            ValueError if the tracker has no definitions.
+
+        """
+        if self.definitions is None:
+            raise ValueError('Missing definitions for custom_definitions.')
+        return self.definitions.resolve(custom_definitions)
+
+    def __get_session_control(self):
+        """Get the Session Control of the next hit, without applying it.
+
+        Returns:
+            (str): 'end', 'start' or None.
+
+        """
+        try:
+            # popleft() is atomic, so only one hit ends the session
+            return self.__session_controls.popleft()
+        except IndexError:
+            pass
+
+        if self.session_manager is not None \
+                and self.session_manager.starts(self.client_id):
+            return 'start'
+        return None
+
+    def __apply_session_control(self, session_control, accepted):
+        """Apply the Session Control of a hit once it is accepted, or put a
+                pending session end back for the next hit if it was dropped.
+
+        Params:
+            session_control (str): Session Control of the hit, or None.
+            accepted (bool): Whether the hit was sent or queued.
+
+        """
+        if not accepted:
+            if session_control == 'end':
+                self.__session_controls.appendleft('end')
+            return
+
+        if self.session_manager is None:
+            return
+        if session_control == 'end':
+            self.session_manager.end(self.client_id)
+        else:
+            self.session_manager.touch(self.client_id)
+
     def __get_user_id(self):
         """Get the payload for User ID."""
         payload = {
@@ -472,6 +715,8 @@ class GoogleAnalytics(object):
             custom_dimensions=None,
             custom_metrics=None,
             content_groups=None,
+            custom_definitions=None,
+            timestamp=None,
         ):
         """Send a hit to the GA collection or validation server.
 
@@ -487,45 +732,265 @@ class GoogleAnalytics(object):
             content_groups (list): Content groups.
                     Syntax: [ group, group, ... ]
                     Example: [ 'foo', 'bar' ]
+            custom_definitions (dict): (optional) Custom Dimension and Metric
+                    values by name in the tracker's definitions.
+            timestamp (float): (optional) UNIX time at which the hit really
+                    happened. Refer to history.py.
 
         Raises:
             ValueError if hit_type is not found in HIT_TYPES.
+            ValueError if timestamp is not a number.
 
         """
         if hit_type not in HIT_TYPES:
             raise ValueError('Invalid hit_type: {}.'.format(hit_type))
+        if timestamp is not None and not self.__is_number(timestamp):
+            raise ValueError('timestamp should be a number.')
 
-        payload = self.__get_base_payload()
+        # read the config once, so that the hit is built from one version
+        config = self.__config
+
+        payload = self.__get_base_payload(config)
         payload['t'] = hit_type
         payload.update(hit_payload)
 
         custom_dimensions_payload = self.__get_custom_dimensions(
-            custom_dimensions
+            custom_dimensions,
+            config,
         )
         payload.update(custom_dimensions_payload)
 
         custom_metrics_payload = self.__get_custom_metrics(
-            custom_metrics
+            custom_metrics,
+            config,
         )
         payload.update(custom_metrics_payload)
 
+        if custom_definitions:
+            # keys are precompiled, so this is one lookup per name
+            payload.update(self.__get_named_definitions(custom_definitions))
+
         if hit_type in ['pageview', 'screenview']:
             content_groups_payload = self.__get_content_groups(
                 content_groups
             )
             payload.update(content_groups_payload)
 
+        session_control = self.__get_session_control()
+        if session_control is not None:
+            payload['sc'] = session_control
+
         # rebuild payload without None values
         data = {}
         for key, value in payload.items():
             if value is not None:
                 data[key] = value
 
+        # the session only changes with a hit that is not dropped
+        accepted = False
+        try:
+            accepted = self.__deliver_hit(hit_type, data, timestamp)
+        finally:
+            self.__apply_session_control(session_control, accepted)
+
+    def __deliver_hit(self, hit_type, data, timestamp):
+        """Send a built hit with the backend, sender or transport.
+
+        Returns:
+            (bool): Whether the hit was sent or queued, rather than dropped
+                    because of its age, sampling or a full sender.
+
+        """
+        if self.backend is not None:
+            if timestamp is not None and time() - timestamp > GA4_MAX_EVENT_AGE:
+                with self.__config_lock:
+                    self.expired_hits += 1
+                return False
+            self.backend.send(hit_type, data, timestamp)
+            return True
+
+        if timestamp is not None and (self.sender is None or self.debug):
+            # a sender works out the queue time when the hit is sent
+            now = time()
+            if now - timestamp > MAX_QUEUE_TIME:
+                with self.__config_lock:
+                    self.expired_hits += 1
+                return False
+            data['qt'] = queue_time(timestamp, now)
+
+        if self.shadow is not None and not self.debug:
+            self.shadow.offer(hit_type, data)
+
+        if not self.debug and (
+                    self.sender is not None
+                    or self.transport is not None
+                    or len(self.destinations) > 1
+                ):
+            hits = self.__encode_hits(hit_type, data, timestamp)
+            if self.sender is not None:
+                accepted = False
+                for hit in hits:
+                    accepted = self.sender.send(hit) or accepted
+                return accepted
+            elif len(hits) == 1:
+                self.__post(GA_ENDPOINT, hits[0].body)
+            elif hits:
+                # the copies for every property share one batch
+                self.__post(
+                    GA_BATCH_ENDPOINT,
+                    '\n'.join(hit.body for hit in hits),
+                )
+            return bool(hits)
+        if not self.debug \
+                and not self.destinations[0].accepts(hit_type, self.client_id):
+            return False
+
+        # with several properties, only the first one's copy is validated,
+        # because the copies differ in tid only
         endpoint = GA_DEBUG_ENDPOINT if self.debug else GA_ENDPOINT
-        req = requests.post(endpoint, data=data)
+        if self.transport is not None:
+            req = self.transport.request(
+                endpoint,
+                urlencode(data),
+                timeout=self.timeout,
+            )
+        else:
+            req = requests.post(endpoint, data=data, timeout=self.timeout)
         if self.debug:
             response = req.json()
             self.__handle_debug_response(response['hitParsingResult'][0])
+        return True
+
+    def __post(self, endpoint, body):
+        """Post encoded hits with the transport, or requests.post()."""
+        if self.transport is not None:
+            self.transport.post(endpoint, body, timeout=self.timeout)
+        else:
+            requests.post(endpoint, data=body, timeout=self.timeout)
+
+    def send_columns(self, columns, mapping, hit_type='event'):
+        """Send one hit per row of columnar data, encoded a column at a
+                time. Refer to bulk.py.
+
+        Params:
+            columns: pandas DataFrame, or dict of NumPy arrays, Arrow
+                    arrays, pandas Series or lists by name.
+            mapping (dict): Parameter, name in the tracker's definitions, or
+                    'timestamp' by column.
+                    Example: { 'category': 'ec', 'action': 'ea', 'user': 'cid' }
+            hit_type (str): (optional) Type of the hits. Default: 'event'.
+
+        Returns:
+            (dict): Count of hits sent, or queued with a sender, and counts
+                    of rows that were skipped because of a missing required
+                    value, an oversized hit or an expired timestamp.
+
+        Raises:
+            ValueError if the tracker has a backend or is in debug mode.
+            ValueError if a column or a required parameter is missing.
+            ValueError if a column is not of its parameter's type.
+
+        """
+        if self.backend is not None or self.debug:
+            raise ValueError(
+                'send_columns() cannot be used with a backend or in debug mode.'
+            )
+
+        # bulk.py uses the sender's limits, and sender.py imports this module
+        from .bulk import encode_columns, pack_batches
+
+        config = self.__config
+        payload = dict(config.base_payload)
+        payload.update(config.custom_dimensions)
+        payload.update(config.custom_metrics)
+        payload = {
+            key: value for key, value in payload.items() if value is not None
+        }
+
+        counters = {'hits': 0}
+        hits = encode_columns(
+            payload,
+            columns,
+            mapping,
+            hit_type,
+            self.destinations,
+            self.definitions,
+            counters,
+        )
+        if self.sender is not None:
+            for hit in hits:
+                if self.sender.send(hit):
+                    counters['hits'] += 1
+        else:
+            for body in pack_batches(hits):
+                self.__post(GA_BATCH_ENDPOINT, body)
+                counters['hits'] += body.count('\n') + 1
+        return counters
+
+    def end_session(self):
+        """End the current session with the next hit."""
+        if not self.__session_controls:
+            self.__session_controls.append('end')
+
+    def flush(self, timeout=None):
+        """Send the hits that are held back, e.g. summarised timings.
+                Trackers are also flushed at interpreter exit.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait.
+
+        Returns:
+            (bool): Whether the hits were sent in time.
+
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        self.timings.flush(timeout)
+        self.events.flush(
+            None if deadline is None else max(0, deadline - monotonic())
+        )
+
+        flushed = True
+        for pipeline in [self.backend, self.sender, self.shadow]:
+            if pipeline is not None:
+                remaining = None if deadline is None \
+                    else max(0, deadline - monotonic())
+                flushed = pipeline.flush(remaining) and flushed
+        return flushed
+
+    def after_fork_in_child(self):
+        """Reset what the tracker holds back in a forked child. The parent
+                still sends it."""
+        self.__config_lock = Lock()
+        self.timings.after_fork_in_child()
+        self.events.after_fork_in_child()
+        if hasattr(self.transport, 'after_fork_in_child'):
+            self.transport.after_fork_in_child()
+
+    def __encode_hits(self, hit_type, data, timestamp=None):
+        """Encode a hit once and copy it for each destination.
+
+        Params:
+            hit_type (str): Type of hit.
+            data (dict): Payload without None values.
+            timestamp (float): (optional) UNIX time of the hit.
+
+        Returns:
+            (list): Hits for the destinations that accept the hit.
+
+        """
+        body = urlencode({
+            key: value for key, value in data.items() if key != 'tid'
+        })
+        return [
+            Hit(
+                destination.prefix + body,
+                hit_type,
+                self.client_id,
+                timestamp=timestamp,
+            )
+            for destination in self.destinations
+            if destination.accepts(hit_type, self.client_id)
+        ]
 
     # Public methods for sending hits.
     # Each method corresponds to a hit type.
@@ -539,6 +1004,9 @@ class GoogleAnalytics(object):
             non_interaction=False,
             custom_dimensions=None,
             custom_metrics=None,
+            custom_definitions=None,
+            aggregate=None,
+            timestamp=None,
         ):
         """Send an Event hit.
 
@@ -555,6 +1023,16 @@ class GoogleAnalytics(object):
             custom_metrics (dict): (optional) Custom Metric indices and values.
                     Syntax: { index: value, index: value, ... }
                     Example: { '1': 10, '4': 5.6 }
+            custom_definitions (dict): (optional) Custom Dimension and Metric
+                    values by name in the tracker's definitions.
+                    Example: { 'plan': 'pro', 'basket_value': 9.5 }
+            aggregate (bool): (optional) Whether to add the event to the total
+                    of matching events instead of sending it now. Events
+                    with a timestamp are not. Refer to aggregation.py.
+                    Default: the tracker's aggregate_events.
+            timestamp (float): (optional) UNIX time at which the hit really
+                    happened, to import it with its queue time. Hits older
+                    than 4 hours are dropped. Refer to history.py.
 
         Raises:
             ValueError if event_category is None.
@@ -572,6 +1050,21 @@ class GoogleAnalytics(object):
         if non_interaction and not isinstance(non_interaction, bool):
             raise ValueError('non_interaction should be a boolean when sending event hit.')
 
+        if aggregate is None:
+            aggregate = self.aggregate_events
+        if aggregate and timestamp is None:
+            self.events.record(
+                event_category,
+                event_action,
+                event_label,
+                event_value,
+                non_interaction,
+                custom_dimensions,
+                custom_metrics,
+                custom_definitions,
+            )
+            return
+
         hit_payload = {
             'ec': event_category,
             'ea': event_action,
@@ -585,6 +1078,8 @@ class GoogleAnalytics(object):
             hit_payload,
             custom_dimensions,
             custom_metrics,
+            custom_definitions=custom_definitions,
+            timestamp=timestamp,
         )
 
     def send_exception(
@@ -593,6 +1088,8 @@ class GoogleAnalytics(object):
             ex_fatal=False,
             custom_dimensions=None,
             custom_metrics=None,
+            custom_definitions=None,
+            timestamp=None,
         ):
         """Send an Exception hit.
 
@@ -606,6 +1103,12 @@ class GoogleAnalytics(object):
             custom_metrics (dict): (optional) Custom Metric indices and values.
                     Syntax: { index: value, index: value, ... }
                     Example: { '1': 10, '4': 5.6 }
+            custom_definitions (dict): (optional) Custom Dimension and Metric
+                    values by name in the tracker's definitions.
+                    Example: { 'plan': 'pro', 'basket_value': 9.5 }
+            timestamp (float): (optional) UNIX time at which the hit really
+                    happened, to import it with its queue time. Hits older
+                    than 4 hours are dropped. Refer to history.py.
 
         Raises:
             ValueError if ex_description is None.
@@ -627,6 +1130,8 @@ class GoogleAnalytics(object):
             hit_payload,
             custom_dimensions,
             custom_metrics,
+            custom_definitions=custom_definitions,
+            timestamp=timestamp,
         )
 
     def send_pageview(
@@ -637,6 +1142,8 @@ class GoogleAnalytics(object):
             custom_dimensions=None,
             custom_metrics=None,
             content_groups=None,
+            custom_definitions=None,
+            timestamp=None,
         ):
         """Send a Pageviw hit.
 
@@ -653,6 +1160,12 @@ class GoogleAnalytics(object):
             content_groups (list): Content groups.
                     Syntax: [ group, group, ... ]
                     Example: [ 'foo', 'bar' ]
+            custom_definitions (dict): (optional) Custom Dimension and Metric
+                    values by name in the tracker's definitions.
+                    Example: { 'plan': 'pro', 'basket_value': 9.5 }
+            timestamp (float): (optional) UNIX time at which the hit really
+                    happened, to import it with its queue time. Hits older
+                    than 4 hours are dropped. Refer to history.py.
 
         Raises:
             ValueError if page is None.
@@ -679,6 +1192,8 @@ class GoogleAnalytics(object):
             custom_dimensions,
             custom_metrics,
             content_groups,
+            custom_definitions=custom_definitions,
+            timestamp=timestamp,
         )
 
     def send_screenview(
@@ -687,6 +1202,8 @@ class GoogleAnalytics(object):
             custom_dimensions=None,
             custom_metrics=None,
             content_groups=None,
+            custom_definitions=None,
+            timestamp=None,
         ):
         """Send a Screenview hit.
 
@@ -701,6 +1218,12 @@ class GoogleAnalytics(object):
             content_groups (list): Content groups.
                     Syntax: [ group, group, ... ]
                     Example: [ 'foo', 'bar' ]
+            custom_definitions (dict): (optional) Custom Dimension and Metric
+                    values by name in the tracker's definitions.
+                    Example: { 'plan': 'pro', 'basket_value': 9.5 }
+            timestamp (float): (optional) UNIX time at which the hit really
+                    happened, to import it with its queue time. Hits older
+                    than 4 hours are dropped. Refer to history.py.
 
         Raises:
             ValueError if screen_name is None.
@@ -721,6 +1244,8 @@ class GoogleAnalytics(object):
             custom_dimensions,
             custom_metrics,
             content_groups,
+            custom_definitions=custom_definitions,
+            timestamp=timestamp,
         )
 
     def send_social(
@@ -730,6 +1255,8 @@ class GoogleAnalytics(object):
             social_target,
             custom_dimensions=None,
             custom_metrics=None,
+            custom_definitions=None,
+            timestamp=None,
         ):
         """Send a Social hit.
 
@@ -743,6 +1270,12 @@ class GoogleAnalytics(object):
             custom_metrics (dict): (optional) Custom Metric indices and values.
                     Syntax: { index: value, index: value, ... }
                     Example: { '1': 10, '4': 5.6 }
+            custom_definitions (dict): (optional) Custom Dimension and Metric
+                    values by name in the tracker's definitions.
+                    Example: { 'plan': 'pro', 'basket_value': 9.5 }
+            timestamp (float): (optional) UNIX time at which the hit really
+                    happened, to import it with its queue time. Hits older
+                    than 4 hours are dropped. Refer to history.py.
 
         Raises:
             ValueError if social_network is None.
@@ -768,6 +1301,8 @@ class GoogleAnalytics(object):
             hit_payload,
             custom_dimensions,
             custom_metrics,
+            custom_definitions=custom_definitions,
+            timestamp=timestamp,
         )
 
     def send_timing(
@@ -778,6 +1313,8 @@ class GoogleAnalytics(object):
             timing_label=None,
             custom_dimensions=None,
             custom_metrics=None,
+            custom_definitions=None,
+            timestamp=None,
         ):
         """Send a Timing hit.
 
@@ -792,6 +1329,12 @@ class GoogleAnalytics(object):
             custom_metrics (dict): (optional) Custom Metric indices and values.
                     Syntax: { index: value, index: value, ... }
                     Example: { '1': 10, '4': 5.6 }
+            custom_definitions (dict): (optional) Custom Dimension and Metric
+                    values by name in the tracker's definitions.
+                    Example: { 'plan': 'pro', 'basket_value': 9.5 }
+            timestamp (float): (optional) UNIX time at which the hit really
+                    happened, to import it with its queue time. Hits older
+                    than 4 hours are dropped. Refer to history.py.
 
         Raises:
             ValueError if timing_category is None.
@@ -821,6 +1364,36 @@ class GoogleAnalytics(object):
             hit_payload,
             custom_dimensions,
             custom_metrics,
+            custom_definitions=custom_definitions,
+            timestamp=timestamp,
+        )
+
+    def timer(
+            self,
+            timing_category,
+            timing_var,
+            timing_label=None,
+            sample_rate=1.0,
+        ):
+        """Time a block of code or a function for summarised Timing hits.
+
+        Params:
+            timing_category (str): Category of the user timing.
+            timing_var (str): Variable of the user timing.
+            timing_label (str): (optional) Label of the user timing.
+            sample_rate (float): (optional) Fraction of calls to time.
+                    Default: 1.0.
+
+        Returns:
+            (Timer): Context manager and decorator.
+
+        """
+        return Timer(
+            self.timings,
+            timing_category,
+            timing_var,
+            timing_label,
+            sample_rate,
         )
 
     # Debug
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""Send a pageview for every request of a WSGI or ASGI app.
+
+
+Example:
+    ```
+    ga = GoogleAnalytics('UA-12345-6', sender=QueuedSender())
+
+    app = WSGIMiddleware(app, ga, exclude_paths=['/static/', '/health'])
+    # or, for an ASGI app
+    app = ASGIMiddleware(app, ga)
+    ```
+
+The page (dp), hostname (dh), IP address (uip), user agent (ua) and
+language (ul) of each pageview come from the request, and its Client ID
+(cid) from the _ga cookie that analytics.js sets. Requests without the
+cookie get a random Client ID, like trackers without one.
+
+After the response is sent, the middleware keeps the raw request values
+and nothing else. A background thread turns them into pageviews with
+GoogleAnalytics.send_columns() once per flush_interval, or as soon as
+max_rows requests are waiting, so the request pays for one tuple and one
+append.
+
+
+"""
+
+from collections import deque
+from random import random as random_random
+from threading import Event, Lock, Thread
+from time import monotonic, time
+import logging
+import re
+
+from . import lifecycle
+
+logger = logging.getLogger(__name__)
+
+# e.g. _ga=GA1.2.1234567890.1500000000 -> 1234567890.1500000000
+GA_COOKIE = re.compile(r'(?:^|[;,]\s*)_ga=GA\d+\.\d+\.([^;,\s]+)')
+
+MAPPING = {
+    'page': 'dp',
+    'hostname': 'dh',
+    'ip_address': 'uip',
+    'user_agent': 'ua',
+    'user_language': 'ul',
+    'client_id': 'cid',
+}
+
+def parse_client_id(cookie):
+    """Get the Client ID from a Cookie header.
+
+    Returns:
+        (str): Client ID, or None if there is no _ga cookie.
+
+    """
+    if not cookie or '_ga=' not in cookie:
+        return None
+    match = GA_COOKIE.search(cookie)
+    return match.group(1) if match else None
+
+def parse_language(accept_language):
+    """Get the preferred language from an Accept-Language header, e.g.
+            'en-us' from 'en-US,en;q=0.9'."""
+    if not accept_language:
+        return None
+    language = accept_language.split(',', 1)[0].split(';', 1)[0].strip()
+    return language.lower() if language and language != '*' else None
+
+def parse_hostname(host):
+    """Get the hostname from a Host header, without its port."""
+    if not host:
+        return None
+    if host.startswith('['):
+        # IPv6 address, e.g. [::1]:8000
+        return host[:host.find(']') + 1]
+    return host.rsplit(':', 1)[0] if ':' in host else host
+
+class PageviewCollector(object):
+    """Collects requests and sends them as pageviews in bulk from a
+            background thread."""
+
+    def __init__(
+            self,
+            tracker,
+            flush_interval=1.0,
+            max_rows=1000,
+            max_pending=100000,
+        ):
+        """Create a new collector. Its thread starts with the first request.
+
+        Params:
+            tracker (GoogleAnalytics): Tracker to send pageviews with,
+                    ideally with a sender so that sending never waits.
+            flush_interval (float): (optional) Most seconds that a request
+                    waits to be sent. Default: 1.0.
+            max_rows (int): (optional) Number of waiting requests that are
+                    sent without waiting for flush_interval. Default: 1000.
+            max_pending (int): (optional) Most waiting requests. Requests
+                    beyond it are dropped. Default: 100000.
+
+        Raises:
+            ValueError if the tracker has a backend or is in debug mode,
+                    where send_columns() cannot be used.
+            ValueError if flush_interval is not a positive number.
+
+        """
+        if getattr(tracker, 'backend', None) is not None \
+                or getattr(tracker, 'debug', False):
+            raise ValueError(
+                'PageviewCollector cannot be used with a tracker that has a '
+                'backend or is in debug mode.'
+            )
+        if not isinstance(flush_interval, (float, int)) or flush_interval <= 0:
+            raise ValueError('flush_interval should be a positive number.')
+
+        self.tracker = tracker
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.max_pending = max_pending
+        self.__reset()
+        lifecycle.register(self)
+
+    def __reset(self):
+        self.rows = deque()
+        self.wake = Event()
+        self.thread = None
+        self.lock = Lock()
+        # sending is serialised, so that flush() and the thread do not race
+        self.send_lock = Lock()
+        self.counters = {
+            'requests': 0,
+            'dropped': 0,
+            'sent': 0,
+            'skipped': 0,
+            'failed': 0,
+        }
+
+    def after_fork_in_child(self):
+        """Start over with no waiting request and no thread in a forked
+                child. The parent still sends its requests."""
+        self.__reset()
+
+    def __start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(
+                    target=self.__run,
+                    name='google-analytics-pageviews',
+                )
+                self.thread.daemon = True
+                self.thread.start()
+
+    def __run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.send()
+            except Exception:
+                logger.debug('Sending pageviews failed.', exc_info=True)
+
+    def add(self, page, host, ip_address, user_agent, accept_language, cookie):
+        """Queue the raw values of a request. Parsing is left to the
+                background thread.
+
+        Returns:
+            (bool): Whether the request was queued.
+
+        """
+        rows = self.rows
+        if len(rows) >= self.max_pending:
+            self.counters['dropped'] += 1
+            return False
+        rows.append((page, host, ip_address, user_agent, accept_language, cookie))
+        if self.thread is None:
+            self.__start()
+        if len(rows) >= self.max_rows:
+            self.wake.set()
+        return True
+
+    def send(self):
+        """Send the waiting requests as pageviews now.
+
+        Returns:
+            (int): Number of pageviews sent or queued.
+
+        """
+        with self.send_lock:
+            rows = []
+            popleft = self.rows.popleft
+            try:
+                while True:
+                    rows.append(popleft())
+            except IndexError:
+                pass
+            if not rows:
+                return 0
+
+            columns = {name: [] for name in MAPPING}
+            for page, host, ip_address, user_agent, accept_language, cookie in rows:
+                client_id = parse_client_id(cookie)
+                if client_id is None:
+                    client_id = '{}.{}'.format(int(random_random() * 10**8), int(time()))
+                columns['page'].append(page)
+                columns['hostname'].append(parse_hostname(host))
+                columns['ip_address'].append(ip_address)
+                columns['user_agent'].append(user_agent)
+                columns['user_language'].append(parse_language(accept_language))
+                columns['client_id'].append(client_id)
+
+            self.counters['requests'] += len(rows)
+            try:
+                counters = self.tracker.send_columns(columns, MAPPING, 'pageview')
+            except Exception:
+                self.counters['failed'] += len(rows)
+                logger.debug('Sending %d pageviews failed.', len(rows), exc_info=True)
+                return 0
+            self.counters['sent'] += counters['hits']
+            self.counters['skipped'] += len(rows) - counters['hits']
+            return counters['hits']
+
+    def stats(self):
+        """Get the counts of sent, skipped, failed and dropped requests."""
+        stats = dict(self.counters)
+        stats['waiting'] = len(self.rows)
+        return stats
+
+    def flush(self, timeout=None):
+        """Send the waiting requests, and wait for the tracker to send them.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait.
+
+        Returns:
+            (bool): Whether the pageviews were sent in time.
+
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        self.send()
+        remaining = None if deadline is None else max(0, deadline - monotonic())
+        return self.tracker.flush(remaining)
+
+class WSGIMiddleware(object):
+    """WSGI middleware that sends a pageview for each successful request."""
+
+    def __init__(
+            self,
+            app,
+            tracker=None,
+            collector=None,
+            exclude_paths=None,
+            trust_forwarded=False,
+        ):
+        """Wrap a WSGI app.
+
+        Params:
+            app (callable): WSGI app.
+            tracker (GoogleAnalytics): (optional) Tracker to send pageviews
+                    with. Needed without a collector.
+            collector (PageviewCollector): (optional) Collector to queue
+                    requests on. Default: a new PageviewCollector.
+            exclude_paths (list): (optional) Path prefixes that are not
+                    pageviews, e.g. ['/static/', '/health'].
+            trust_forwarded (bool): (optional) Whether to take the IP
+                    address from X-Forwarded-For, e.g. behind a proxy.
+                    Default: False.
+
+        Raises:
+            ValueError if neither tracker nor collector is given.
+
+        """
+        if collector is None:
+            if tracker is None:
+                raise ValueError('Missing tracker or collector.')
+            collector = PageviewCollector(tracker)
+        self.app = app
+        self.collector = collector
+        self.exclude_paths = tuple(exclude_paths or ())
+        self.trust_forwarded = trust_forwarded
+
+    def __call__(self, environ, start_response):
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        if self.exclude_paths and path.startswith(self.exclude_paths):
+            return self.app(environ, start_response)
+
+        statuses = []
+
+        def tracking_start_response(status, headers, exc_info=None):
+            statuses.append(status)
+            return start_response(status, headers, exc_info)
+
+        def track():
+            # e.g. '200 OK'
+            if not statuses or statuses[-1][0] not in '123':
+                return
+            query = environ.get('QUERY_STRING')
+            ip_address = environ.get('REMOTE_ADDR')
+            if self.trust_forwarded:
+                forwarded = environ.get('HTTP_X_FORWARDED_FOR')
+                if forwarded:
+                    ip_address = forwarded.split(',', 1)[0].strip()
+            self.collector.add(
+                path + '?' + query if query else path,
+                environ.get('HTTP_HOST') or environ.get('SERVER_NAME'),
+                ip_address,
+                environ.get('HTTP_USER_AGENT'),
+                environ.get('HTTP_ACCEPT_LANGUAGE'),
+                environ.get('HTTP_COOKIE'),
+            )
+
+        return ClosingIterator(
+            self.app(environ, tracking_start_response),
+            track,
+        )
+
+class ClosingIterator(object):
+    """Response body that calls back once the server has sent it."""
+
+    __slots__ = ['iterable', 'callback']
+
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.callback()
+
+class ASGIMiddleware(object):
+    """ASGI middleware that sends a pageview for each successful HTTP
+            request."""
+
+    def __init__(
+            self,
+            app,
+            tracker=None,
+            collector=None,
+            exclude_paths=None,
+            trust_forwarded=False,
+        ):
+        """Wrap an ASGI app. Refer to WSGIMiddleware."""
+        if collector is None:
+            if tracker is None:
+                raise ValueError('Missing tracker or collector.')
+            collector = PageviewCollector(tracker)
+        self.app = app
+        self.collector = collector
+        self.exclude_paths = tuple(exclude_paths or ())
+        self.trust_forwarded = trust_forwarded
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        path = scope.get('root_path', '') + scope['path']
+        if self.exclude_paths and path.startswith(self.exclude_paths):
+            return await self.app(scope, receive, send)
+
+        statuses = []
+
+        async def tracking_send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            await send(message)
+
+        await self.app(scope, receive, tracking_send)
+
+        # the response is sent by now
+        if not statuses or statuses[-1] >= 400:
+            return
+        headers = {}
+        for name, value in scope.get('headers', ()):
+            if name in ASGI_HEADERS:
+                headers[name] = value.decode('latin-1')
+        client = scope.get('client')
+        ip_address = client[0] if client else None
+        if self.trust_forwarded and b'x-forwarded-for' in headers:
+            ip_address = headers[b'x-forwarded-for'].split(',', 1)[0].strip()
+        query = scope.get('query_string')
+        self.collector.add(
+            path + '?' + query.decode('latin-1') if query else path,
+            headers.get(b'host'),
+            ip_address,
+            headers.get(b'user-agent'),
+            headers.get(b'accept-language'),
+            headers.get(b'cookie'),
+        )
+
+ASGI_HEADERS = frozenset([
+    b'host',
+    b'user-agent',
+    b'accept-language',
+    b'cookie',
+    b'x-forwarded-for',
+])
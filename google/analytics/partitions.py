@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Send each client's hits in order while posting over several connections.
+
+
+Example:
+    ```
+    buffer = PartitionedBuffer(partitions=32)
+    sender = QueuedSender(connections=8, buffer=buffer)
+    ga = GoogleAnalytics('UA-12345-6', sender=sender)
+    ```
+
+With several connections, QueuedSender posts batches at the same time, so
+a client's events can reach GA before the pageview that came first, which
+breaks sessions and funnels.
+
+PartitionedBuffer hashes each hit's Client ID to one of its partitions,
+and each batch holds the hits of one partition in the order they were
+queued. A partition has at most one batch in flight: its next batch is
+only handed out once the sender has posted the last one. So the hits of a
+client are posted in order, and different partitions, i.e. different
+clients, are still posted in parallel.
+
+Up to min(partitions, connections) batches are in flight. More partitions
+than connections keep the connections busy when a few clients send most
+hits; fewer partitions give fuller batches.
+
+
+"""
+
+from collections import deque
+from threading import Condition, Lock
+from time import monotonic
+from zlib import crc32
+
+from .sender import BATCH_MAX_BYTES, BATCH_MAX_HITS
+
+PARTITION_POLICIES = ['drop-newest', 'block']
+
+class PartitionedBuffer(object):
+    """Hit buffer with a FIFO per partition of Client IDs, that keeps one
+            batch per partition in flight. Can be used as QueuedSender's
+            buffer."""
+
+    def __init__(
+            self,
+            partitions=16,
+            max_bytes=1024 * 1024,
+            policy='drop-newest',
+            block_timeout=1.0,
+        ):
+        """Create a new partitioned buffer.
+
+        Params:
+            partitions (int): (optional) Number of partitions. Default: 16.
+            max_bytes (int): (optional) Most bytes of encoded hits of all
+                    partitions together. Default: 1 MiB.
+            policy (str): (optional) What to do when max_bytes is reached.
+                    Refer to PARTITION_POLICIES. Dropping older hits is not
+                    offered. Default: 'drop-newest'.
+            block_timeout (float): (optional) Most seconds that put() waits
+                    for room with the 'block' policy. Default: 1.0.
+
+        Raises:
+            ValueError if partitions is not a positive integer.
+            ValueError if max_bytes is not a positive integer.
+            ValueError if policy is not found in PARTITION_POLICIES.
+
+        """
+        if not isinstance(partitions, int) or partitions <= 0:
+            raise ValueError('partitions should be a positive integer.')
+        if not isinstance(max_bytes, int) or max_bytes <= 0:
+            raise ValueError('max_bytes should be a positive integer.')
+        if policy not in PARTITION_POLICIES:
+            raise ValueError('Invalid policy: {}.'.format(policy))
+
+        self.partition_count = partitions
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.__reset()
+
+    def __reset(self):
+        self.partitions = [deque() for _ in range(self.partition_count)]
+        # partitions with hits and no batch in flight, in turn order
+        self.ready = deque()
+        self.in_flight = set()
+        self.bytes = 0
+        self.hit_count = 0
+        self.counters = {
+            'dropped_newest': 0,
+            'block_timeouts': 0,
+            'partition_waits': 0,
+        }
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+
+    def after_fork_in_child(self):
+        """Start empty in a forked child. The parent still sends the hits
+                it holds."""
+        self.__reset()
+
+    def __len__(self):
+        return self.hit_count
+
+    def partition_of(self, hit):
+        """Get the index of a hit's partition, by its Client ID."""
+        client_id = hit.client_id or ''
+        return crc32(str(client_id).encode('utf-8')) % self.partition_count
+
+    def partition_stats(self):
+        """Get the number of queued hits of each partition, and the
+                partitions that have a batch in flight."""
+        with self.lock:
+            return {
+                'queued_hits': [len(hits) for hits in self.partitions],
+                'in_flight': sorted(self.in_flight),
+            }
+
+    def put(self, hit):
+        """Add a hit to its partition, applying the policy if the buffer is
+                full.
+
+        Returns:
+            (bool): Whether the hit was kept.
+
+        """
+        size = len(hit)
+        index = self.partition_of(hit)
+        with self.lock:
+            if self.bytes + size > self.max_bytes:
+                if self.policy == 'drop-newest' or size > self.max_bytes:
+                    self.counters['dropped_newest'] += 1
+                    return False
+                deadline = monotonic() + self.block_timeout
+                while self.bytes + size > self.max_bytes:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.counters['block_timeouts'] += 1
+                        return False
+                    self.not_full.wait(remaining)
+
+            hits = self.partitions[index]
+            if not hits and index not in self.in_flight:
+                self.ready.append(index)
+            hits.append(hit)
+            self.bytes += size
+            self.hit_count += 1
+            self.not_empty.notify()
+            return True
+
+    def get_batch(
+            self,
+            max_hits=BATCH_MAX_HITS,
+            max_bytes=BATCH_MAX_BYTES,
+            timeout=None,
+            linger=0.0,
+        ):
+        """Take the oldest hits of the next partition without a batch in
+                flight. The partition gets no other batch until release()
+                is called with this one.
+
+        Params:
+            Refer to HitBuffer.get_batch().
+
+        Returns:
+            (list): Hits, or an empty list if none came in time.
+
+        """
+        with self.lock:
+            deadline = None if timeout is None else monotonic() + timeout
+            if not self.ready and self.hit_count:
+                # every partition with hits has a batch in flight
+                self.counters['partition_waits'] += 1
+            while not self.ready:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return []
+                self.not_empty.wait(remaining)
+
+            if linger > 0:
+                linger_deadline = monotonic() + linger
+                while self.hit_count < max_hits \
+                        and self.bytes + self.hit_count < max_bytes:
+                    remaining = linger_deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.not_empty.wait(remaining)
+                if not self.ready:
+                    return []
+
+            index = self.ready.popleft()
+            hits = self.partitions[index]
+            batch = []
+            batch_bytes = 0
+            while hits and len(batch) < max_hits:
+                size = len(hits[0]) + 1
+                if batch and batch_bytes + size > max_bytes:
+                    break
+                hit = hits.popleft()
+                self.bytes -= len(hit)
+                self.hit_count -= 1
+                batch_bytes += size
+                batch.append(hit)
+
+            self.in_flight.add(index)
+            self.not_full.notify_all()
+            return batch
+
+    def release(self, batch):
+        """Let the partition of a batch hand out its next batch, once the
+                batch is posted or dropped.
+
+        Params:
+            batch (list): Hits, as returned by get_batch().
+
+        """
+        if not batch:
+            return
+        index = self.partition_of(batch[0])
+        with self.lock:
+            if index not in self.in_flight:
+                return
+            self.in_flight.discard(index)
+            if self.partitions[index]:
+                self.ready.append(index)
+                self.not_empty.notify()
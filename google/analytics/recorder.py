@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""Archive every sent hit to rotating, compressed JSON Lines files.
+
+
+Example:
+    ```
+    recorder = HitRecorder('/var/log/ga', max_bytes=64 * 1024 * 1024)
+    sender = QueuedSender(recorder=recorder)
+    ga = GoogleAnalytics('UA-12345-6', sender=sender)
+    ...
+    # later, send the archived hits again
+    resend(sorted(glob('/var/log/ga/hits-*.jsonl.gz')), QueuedSender())
+    ```
+
+Each line of an archive is a JSON object with the time the hit was sent,
+the HTTP status of its request (None if the request failed) and the encoded
+hit:
+
+    {"time": 1500000000.123, "status": 200, "hit": "v=1&t=event&..."}
+
+Hits with a timestamp, i.e. sent in import mode, also have a "timestamp",
+so that their queue time is right when they are sent again.
+
+Lines are buffered and written by a background thread, so recording costs
+the sending thread one queue put per batch. Each write appends a complete
+gzip member, so an archive is readable up to its last write even if the
+process dies.
+
+
+"""
+
+from glob import glob
+from time import monotonic, strftime, time
+import gzip
+import json
+import os
+
+from . import lifecycle
+from .hit import Hit
+from .worker import BackgroundWorker
+
+class HitRecorder(object):
+    """Tee sink that archives hits with their send time and status."""
+
+    def __init__(
+            self,
+            directory,
+            prefix='hits',
+            max_bytes=64 * 1024 * 1024,
+            max_files=None,
+            compress=True,
+            buffer_bytes=256 * 1024,
+            flush_interval=1.0,
+            worker=None,
+        ):
+        """Create a new recorder.
+
+        Params:
+            directory (str): Directory to write archives to.
+            prefix (str): (optional) Prefix of the archive file names.
+                    Default: 'hits'.
+            max_bytes (int): (optional) Uncompressed size after which a new
+                    archive is started. Default: 64 MiB.
+            max_files (int): (optional) Most archives to keep per process.
+                    The oldest ones are removed. Default: None, i.e. keep
+                    all.
+            compress (bool): (optional) Whether to gzip the archives.
+                    Default: True.
+            buffer_bytes (int): (optional) Bytes of lines to buffer before
+                    writing. Default: 256 KiB.
+            flush_interval (float): (optional) Most seconds to keep lines
+                    buffered while hits keep coming. Default: 1.0.
+            worker (BackgroundWorker): (optional) Worker to write from.
+
+        Raises:
+            ValueError if directory does not exist.
+
+        """
+        if not os.path.isdir(directory):
+            raise ValueError('{} is not a directory.'.format(directory))
+
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.compress = compress
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval = flush_interval
+        self.worker = worker or BackgroundWorker(
+            max_queue=10000,
+            name='google-analytics-recorder',
+        )
+        self.__reset()
+        lifecycle.register(self)
+
+    def __reset(self):
+        self.lines = []
+        self.lines_bytes = 0
+        self.last_write = monotonic()
+        self.file = None
+        self.file_bytes = 0
+        self.sequence = 0
+
+    def after_fork_in_child(self):
+        """Drop the parent's buffered lines and file in a forked child. The
+                child writes archives of its own."""
+        self.__reset()
+
+    @property
+    def dropped(self):
+        """Number of batches that found the recorder's queue full."""
+        return self.worker.dropped
+
+    def record(self, hits, status, sent_at=None):
+        """Queue hits to be archived.
+
+        Params:
+            hits (list): Hits that were sent in one request.
+            status (int): HTTP status of the request, or None if it failed.
+            sent_at (float): (optional) UNIX time of the request.
+
+        Returns:
+            (bool): Whether the hits were queued.
+
+        """
+        return self.worker.submit(
+            self.__write,
+            [(hit.body, hit.timestamp) for hit in hits],
+            status,
+            time() if sent_at is None else sent_at,
+        )
+
+    def __write(self, hits, status, sent_at):
+        for body, timestamp in hits:
+            record = {
+                'time': sent_at,
+                'status': status,
+                'hit': body,
+            }
+            if timestamp is not None:
+                record['timestamp'] = timestamp
+            line = json.dumps(record, separators=(',', ':')) + '\n'
+            line = line.encode('utf-8')
+            self.lines.append(line)
+            self.lines_bytes += len(line)
+
+        if self.lines_bytes >= self.buffer_bytes \
+                or monotonic() - self.last_write >= self.flush_interval:
+            self.__write_lines()
+
+    def __write_lines(self):
+        self.last_write = monotonic()
+        if not self.lines:
+            return
+
+        if self.file is None or self.file_bytes >= self.max_bytes:
+            self.__rotate()
+
+        data = b''.join(self.lines)
+        self.file.write(gzip.compress(data) if self.compress else data)
+        self.file_bytes += len(data)
+        self.lines = []
+        self.lines_bytes = 0
+
+    def __rotate(self):
+        if self.file is not None:
+            self.file.close()
+
+        self.sequence += 1
+        name = '{}-{}-{}-{:04d}.jsonl{}'.format(
+            self.prefix,
+            strftime('%Y%m%d%H%M%S'),
+            os.getpid(),
+            self.sequence,
+            '.gz' if self.compress else '',
+        )
+        # unbuffered, because lines are buffered before each write
+        self.file = open(os.path.join(self.directory, name), 'ab', buffering=0)
+        self.file_bytes = 0
+
+        if self.max_files is not None:
+            # only this process's archives, so that processes sharing the
+            # directory do not remove each other's
+            archives = sorted(glob(os.path.join(
+                self.directory,
+                '{}-*-{}-*.jsonl*'.format(self.prefix, os.getpid()),
+            )), key=lambda path: (os.path.getmtime(path), path))
+            for path in archives[:-self.max_files]:
+                os.remove(path)
+
+    def flush(self, timeout=None):
+        """Write the buffered lines.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait.
+
+        Returns:
+            (bool): Whether everything was written in time.
+
+        """
+        self.worker.submit(self.__write_lines)
+        return self.worker.flush(timeout)
+
+    def close(self, timeout=None):
+        """Write the buffered lines and close the archive."""
+        flushed = self.flush(timeout)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        return flushed
+
+def read_archive(paths):
+    """Read the records of archives, in order.
+
+    Params:
+        paths (list): Paths of archives, compressed or not.
+
+    Yields:
+        (dict): Records with 'time', 'status', 'hit' and, for hits with a
+                timestamp, 'timestamp'.
+
+    """
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                if line.strip():
+                    yield json.loads(line)
+
+def resend(paths, sender, statuses=None):
+    """Queue archived hits to be sent again.
+
+    Params:
+        paths (list): Paths of archives.
+        sender (QueuedSender): Sender to queue the hits on.
+        statuses (list): (optional) Only resend hits whose requests had
+                these statuses, e.g. [None] for failed requests.
+                Default: None, i.e. all hits.
+
+    Returns:
+        (int): Number of hits queued.
+
+    """
+    queued = 0
+    for record in read_archive(paths):
+        if statuses is not None and record['status'] not in statuses:
+            continue
+        if sender.send(Hit(record['hit'], timestamp=record.get('timestamp'))):
+            queued += 1
+    return queued
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""Relay hits from many processes through one local daemon.
+
+
+Example:
+    ```
+    # once per host
+    $ ga-relay --socket /run/ga-relay.sock
+
+    # in each worker process
+    ga = GoogleAnalytics('UA-12345-6', sender=RelayClient('/run/ga-relay.sock'))
+    ga.send_pageview('/page', 'domain.com') # one sendto(), no waiting
+    ```
+
+Clients send each encoded hit as one datagram, to a Unix domain socket or
+to a UDP port on localhost, like a statsd client. They never wait for the
+relay: if it is not running or its socket buffer is full, the hit is
+dropped and counted.
+
+The relay queues the hits in a QueuedSender that waits for batches to fill
+and posts them over a few pooled connections. Datagrams that are not UTF-8
+Measurement Protocol hits are dropped and counted as malformed.
+
+
+"""
+
+from threading import Event
+import argparse
+import logging
+import os
+import re
+import signal
+import socket
+
+from . import lifecycle
+from .hit import Hit
+from .sender import HIT_MAX_BYTES, POLICIES, QueuedSender
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/ga-relay.sock'
+DATAGRAM_MAX_BYTES = 64 * 1024
+
+# every Measurement Protocol hit has a version and a hit type
+HIT_PARAMETERS = [
+    re.compile(r'(?:^|&)v=[^&]'),
+    re.compile(r'(?:^|&)t=[^&]'),
+]
+
+def parse_address(address):
+    """Get the socket family and address of a relay.
+
+    Params:
+        address (str): Path of a Unix domain socket, or 'host:port' of a UDP
+                port. Can also be a (host, port) tuple.
+
+    Returns:
+        (tuple): Socket family and address.
+
+    Raises:
+        ValueError if a UDP port is not a number.
+
+    """
+    if isinstance(address, tuple):
+        return socket.AF_INET, address
+    if '/' in address or ':' not in address:
+        return socket.AF_UNIX, address
+
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        raise ValueError('Invalid relay address: {}.'.format(address))
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+class RelayClient(object):
+    """Sender that hands each hit to a local relay in one datagram."""
+
+    def __init__(self, address=DEFAULT_SOCKET):
+        """Create a new relay client.
+
+        Params:
+            address (str): (optional) Path of the relay's Unix domain socket,
+                    or 'host:port' of its UDP port.
+                    Default: DEFAULT_SOCKET.
+
+        """
+        self.family, self.address = parse_address(address)
+        self.__reset()
+        lifecycle.register(self)
+
+    def __reset(self):
+        self.socket = socket.socket(self.family, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.counters = {
+            'sent': 0,
+            'dropped': 0,
+            'oversized': 0,
+        }
+
+    def after_fork_in_child(self):
+        """Open a socket of its own in a forked child."""
+        self.socket.close()
+        self.__reset()
+
+    def send(self, hit):
+        """Send a hit to the relay without waiting.
+
+        Params:
+            hit (Hit): Encoded hit.
+
+        Returns:
+            (bool): Whether the relay's socket took the hit.
+
+        """
+        if len(hit) > HIT_MAX_BYTES:
+            self.counters['oversized'] += 1
+            return False
+        try:
+            # the queue time is worked out now; the relay adds its own wait
+            self.socket.sendto(hit.encode().encode('utf-8'), self.address)
+        except OSError:
+            # relay not running, or its buffer is full
+            self.counters['dropped'] += 1
+            return False
+        self.counters['sent'] += 1
+        return True
+
+    def stats(self):
+        """Get the counts of sent, dropped and oversized hits."""
+        return dict(self.counters)
+
+    def flush(self, timeout=None):
+        """Nothing to flush, because hits are never held. Returns True."""
+        return True
+
+    def close(self):
+        self.socket.close()
+
+class RelayServer(object):
+    """Receives hits from relay clients and queues them to be sent."""
+
+    def __init__(
+            self,
+            address=DEFAULT_SOCKET,
+            sender=None,
+            receive_buffer_bytes=4 * 1024 * 1024,
+        ):
+        """Create a new relay and bind its socket.
+
+        Params:
+            address (str): (optional) Path of the Unix domain socket, or
+                    'host:port' of the UDP port, to listen on.
+                    Default: DEFAULT_SOCKET.
+            sender (QueuedSender): (optional) Sender to queue the hits on.
+                    Default: a QueuedSender that waits up to 0.5 seconds
+                    for batches to fill and posts over 4 connections.
+            receive_buffer_bytes (int): (optional) Size of the socket's
+                    receive buffer, which holds hits while the relay is
+                    busy. Default: 4 MiB.
+
+        """
+        self.family, address = parse_address(address)
+        self.sender = sender or QueuedSender(
+            max_bytes=16 * 1024 * 1024,
+            linger=0.5,
+            connections=4,
+        )
+        self.stopped = Event()
+        self.finished = Event()
+        self.serving = False
+        self.received = 0
+        self.malformed = 0
+
+        if self.family == socket.AF_UNIX and os.path.exists(address):
+            # left over from a relay that did not exit cleanly
+            os.remove(address)
+        self.socket = socket.socket(self.family, socket.SOCK_DGRAM)
+        self.socket.setsockopt(
+            socket.SOL_SOCKET,
+            socket.SO_RCVBUF,
+            receive_buffer_bytes,
+        )
+        self.socket.bind(address)
+        self.socket.settimeout(0.5)
+        self.address = self.socket.getsockname()
+
+    def serve_forever(self):
+        """Queue the hits that arrive, until stop() is called."""
+        self.serving = True
+        try:
+            while not self.stopped.is_set():
+                try:
+                    data = self.socket.recv(DATAGRAM_MAX_BYTES)
+                except socket.timeout:
+                    continue
+                self.__relay(data)
+
+            # queue the hits that arrived before stopping
+            self.socket.setblocking(False)
+            while True:
+                try:
+                    data = self.socket.recv(DATAGRAM_MAX_BYTES)
+                except OSError:
+                    break
+                self.__relay(data)
+        finally:
+            self.finished.set()
+
+    def __relay(self, data):
+        self.received += 1
+        try:
+            body = data.decode('utf-8')
+        except UnicodeDecodeError:
+            body = None
+        if body is None or not all(parameter.search(body) for parameter in HIT_PARAMETERS):
+            self.malformed += 1
+            logger.debug('Dropping a malformed datagram of %d bytes.', len(data))
+            return
+        try:
+            self.sender.send(Hit(body))
+        except Exception:
+            # one hit must not stop the relay
+            self.malformed += 1
+            logger.debug('Queueing a relayed hit failed.', exc_info=True)
+
+    def stop(self):
+        """Stop serving once the hits that already arrived are queued."""
+        self.stopped.set()
+
+    def close(self, timeout=None):
+        """Stop serving, send the queued hits and remove the socket.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait for the queued
+                    hits to be sent.
+
+        Returns:
+            (bool): Whether the queued hits were sent in time.
+
+        """
+        self.stop()
+        if self.serving:
+            self.finished.wait(timeout)
+        self.socket.close()
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.remove(self.address)
+        return self.sender.flush(timeout)
+
+def main(argv=None):
+    """Run a relay. Installed as the ga-relay console script."""
+    parser = argparse.ArgumentParser(
+        prog='ga-relay',
+        description='Relay hits from local processes to Google Analytics '
+            'in batches.',
+    )
+    parser.add_argument(
+        '--socket',
+        default=DEFAULT_SOCKET,
+        help='Unix domain socket to listen on. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--udp',
+        metavar='HOST:PORT',
+        help='UDP port to listen on instead of a Unix domain socket.',
+    )
+    parser.add_argument(
+        '--max-bytes',
+        type=int,
+        default=16 * 1024 * 1024,
+        help='Most bytes of hits to queue. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--policy',
+        choices=POLICIES,
+        default='drop-oldest',
+        help='What to do when the queue is full. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--linger',
+        type=float,
+        default=0.5,
+        help='Most seconds to wait for a batch to fill. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--connections',
+        type=int,
+        default=4,
+        help='Number of connections to post over. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Log failed requests.',
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    sender = QueuedSender(
+        max_bytes=args.max_bytes,
+        policy=args.policy,
+        linger=args.linger,
+        connections=args.connections,
+    )
+    server = RelayServer(args.udp or args.socket, sender)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+
+    logger.info('Relaying hits from %s.', server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.close(lifecycle.EXIT_TIMEOUT)
+    logger.info(
+        'Stopped after relaying %d hits, %d of them malformed: %s',
+        server.received,
+        server.malformed,
+        sender.stats(),
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,626 @@
+# -*- coding: utf-8 -*-
+"""Share one sender between prefork worker processes through shared memory.
+
+
+Example:
+    ```
+    # once per host, or from the master's on_starting hook
+    $ ga-ring-drain --path /dev/shm/ga-ring --lanes 32
+
+    # in each worker process
+    ga = GoogleAnalytics('UA-12345-6', sender=RingClient('/dev/shm/ga-ring'))
+    ga.send_pageview('/page', 'domain.com') # a few memory writes, no syscall
+    ```
+
+With gunicorn or uWSGI, each worker process would otherwise have its own
+sender, with its own connections and half-filled batches. Instead, workers
+write their encoded hits into a ring buffer in a memory-mapped file, and
+one drain process reads them all and sends them in full batches.
+
+The ring has one lane per producer process. A process claims a free lane
+with its first hit, under a file lock, and is then its lane's only writer,
+so that writing a hit needs no lock shared between processes: the hit is
+copied into the lane and the lane's head is moved past it. Nothing is
+pickled and no syscall is made. Lanes of processes that died are claimed
+again, with the hits that they still hold.
+
+Each record holds its own position in the lane and a CRC of its bytes, so
+the drain never reads a record that is not completely written yet. When a
+lane is full, the new hit is dropped and counted in the lane.
+
+A drain that is started with another number or size of lanes builds a new
+ring and moves it over the old one, so processes that still map the old
+file are not cut short. The old ring is marked as retired: its clients
+open the new ring with their next hit, and the drain reads what is left in
+the old one.
+
+
+"""
+
+from threading import Event, Lock
+from time import monotonic
+from zlib import crc32
+import argparse
+import fcntl
+import logging
+import mmap
+import os
+import signal
+import struct
+import tempfile
+
+from . import lifecycle
+from .hit import Hit
+from .sender import HIT_MAX_BYTES, POLICIES, QueuedSender
+
+logger = logging.getLogger(__name__)
+
+if os.path.isdir('/dev/shm'):
+    DEFAULT_PATH = '/dev/shm/ga-ring'
+else:
+    DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'ga-ring')
+
+MAGIC = b'GARING01'
+
+# magic, number of lanes, bytes of each lane, then whether the ring was
+# replaced by another
+HEADER = struct.Struct('<8sII')
+RETIRED_OFFSET = 16
+HEADER_BYTES = 64
+
+# head (written by the producer), owner's pid, dropped hits, then the tail
+# (written by the drain) on a cache line of its own
+U64 = struct.Struct('<Q')
+OWNER_OFFSET = 8
+DROPPED_OFFSET = 16
+TAIL_OFFSET = 64
+CONTROL_BYTES = 128
+
+# length, CRC, timestamp (0 if none), position in the lane
+RECORD = struct.Struct('<IIdQ')
+WRAP = 0xFFFFFFFF
+
+def record_bytes(length):
+    """Get the bytes that a record of length bytes of hit takes, aligned on
+            8 bytes."""
+    return (RECORD.size + length + 7) & ~7
+
+class HitRing(object):
+    """Lanes of hits in a memory-mapped file, each written by one process
+            and read by the drain."""
+
+    retired = None
+
+    def __init__(self, path=DEFAULT_PATH, lanes=None, lane_bytes=None):
+        """Open a ring, creating it if lanes and lane_bytes are given and the
+                file is missing or has another size. A ring of the same size
+                is reused with the hits it holds. A ring of another size is
+                retired and kept as self.retired.
+
+        Params:
+            path (str): (optional) Path of the file, ideally in /dev/shm.
+                    Default: DEFAULT_PATH.
+            lanes (int): (optional) Number of lanes, i.e. most producer
+                    processes at the same time.
+            lane_bytes (int): (optional) Bytes of each lane, a multiple of 8.
+
+        Raises:
+            ValueError if lanes is not a positive integer.
+            ValueError if lane_bytes is not a multiple of 8 that can hold
+                    two of the largest hits.
+            FileNotFoundError if the ring does not exist and lanes is not
+                    given.
+            ValueError if the file is not a ring.
+
+        """
+        if lanes is not None:
+            if not isinstance(lanes, int) or lanes <= 0:
+                raise ValueError('lanes should be a positive integer.')
+            if not isinstance(lane_bytes, int) or lane_bytes % 8 \
+                    or lane_bytes < 2 * record_bytes(HIT_MAX_BYTES):
+                raise ValueError(
+                    'lane_bytes should be a multiple of 8 of at least {}.'.format(
+                        2 * record_bytes(HIT_MAX_BYTES),
+                    )
+                )
+            header = self.__read_header(path)
+            if header != (lanes, lane_bytes):
+                if header is not None:
+                    self.retired = HitRing(path)
+                self.__create(path, lanes, lane_bytes)
+                if self.retired is not None:
+                    self.retired.retire()
+
+        header = self.__read_header(path)
+        if header is None:
+            if not os.path.exists(path):
+                raise FileNotFoundError('Missing ring: {}.'.format(path))
+            raise ValueError('Invalid ring: {}.'.format(path))
+
+        self.path = path
+        self.lanes, self.lane_bytes = header
+        with open(path, 'r+b') as ring_file:
+            self.mmap = mmap.mmap(ring_file.fileno(), self.size(*header))
+        self.buffer = memoryview(self.mmap)
+        self.controls = [
+            HEADER_BYTES + lane * CONTROL_BYTES
+            for lane in range(self.lanes)
+        ]
+        self.starts = [
+            HEADER_BYTES + self.lanes * CONTROL_BYTES + lane * self.lane_bytes
+            for lane in range(self.lanes)
+        ]
+
+    @staticmethod
+    def size(lanes, lane_bytes):
+        """Get the bytes of a ring's file."""
+        return HEADER_BYTES + lanes * (CONTROL_BYTES + lane_bytes)
+
+    @staticmethod
+    def __read_header(path):
+        """Get the number of lanes and bytes per lane of a ring file.
+
+        Returns:
+            (tuple): Lanes and lane bytes, or None if the file is missing or
+                    not a ring.
+
+        """
+        try:
+            with open(path, 'rb') as ring_file:
+                data = ring_file.read(HEADER.size)
+                ring_file.seek(0, os.SEEK_END)
+                file_bytes = ring_file.tell()
+        except FileNotFoundError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        magic, lanes, lane_bytes = HEADER.unpack(data)
+        if magic != MAGIC or file_bytes != HitRing.size(lanes, lane_bytes):
+            return None
+        return lanes, lane_bytes
+
+    @staticmethod
+    def __create(path, lanes, lane_bytes):
+        # built aside and moved into place, so processes that map the old
+        # file keep it whole
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(temporary_path, 'w+b') as ring_file:
+                ring_file.truncate(HitRing.size(lanes, lane_bytes))
+                ring_file.write(HEADER.pack(MAGIC, lanes, lane_bytes))
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    def retire(self):
+        """Mark the ring as replaced, so that its clients open the new
+                one."""
+        U64.pack_into(self.buffer, RETIRED_OFFSET, 1)
+
+    def is_retired(self):
+        """Check whether the ring was replaced by another."""
+        return U64.unpack_from(self.buffer, RETIRED_OFFSET)[0] != 0
+
+    def claim(self):
+        """Claim a lane for this process: a free one, or one whose process
+                died.
+
+        Returns:
+            (int): Index of the lane, or None if every lane is taken.
+
+        """
+        pid = os.getpid()
+        # a lock of this call's own, as forked processes share descriptors
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            for lane, control in enumerate(self.controls):
+                owner, = U64.unpack_from(self.buffer, control + OWNER_OFFSET)
+                if owner and process_alive(owner):
+                    continue
+                U64.pack_into(self.buffer, control + OWNER_OFFSET, pid)
+                return lane
+            return None
+        finally:
+            os.close(fd)
+
+    def release(self, lane):
+        """Free a lane. Hits that it still holds are read by the drain."""
+        U64.pack_into(self.buffer, self.controls[lane] + OWNER_OFFSET, 0)
+
+    def write(self, lane, data, timestamp=None):
+        """Copy a hit into a lane. Only the lane's owner may call it.
+
+        Params:
+            lane (int): Index of the lane.
+            data (bytes): Encoded hit.
+            timestamp (float): (optional) UNIX time at which the hit
+                    happened.
+
+        Returns:
+            (bool): Whether the lane had room for the hit.
+
+        """
+        buffer = self.buffer
+        control = self.controls[lane]
+        lane_bytes = self.lane_bytes
+        head, = U64.unpack_from(buffer, control)
+        tail, = U64.unpack_from(buffer, control + TAIL_OFFSET)
+
+        length = len(data)
+        size = record_bytes(length)
+        position = head % lane_bytes
+        contiguous = lane_bytes - position
+        # records do not wrap; the rest of the lane is skipped instead
+        skip = contiguous if size > contiguous else 0
+        if head + skip + size - tail > lane_bytes:
+            dropped, = U64.unpack_from(buffer, control + DROPPED_OFFSET)
+            U64.pack_into(buffer, control + DROPPED_OFFSET, dropped + 1)
+            return False
+
+        start = self.starts[lane]
+        if skip:
+            if contiguous >= RECORD.size:
+                RECORD.pack_into(buffer, start + position, WRAP, 0, 0.0, head)
+            head += skip
+            position = 0
+        offset = start + position
+        buffer[offset + RECORD.size:offset + RECORD.size + length] = data
+        RECORD.pack_into(
+            buffer,
+            offset,
+            length,
+            crc32(data),
+            timestamp or 0.0,
+            head,
+        )
+        # publish the record
+        U64.pack_into(buffer, control, head + size)
+        return True
+
+    def read(self, lane, max_records=None):
+        """Take the hits of a lane that are completely written.
+
+        Params:
+            lane (int): Index of the lane.
+            max_records (int): (optional) Most hits to take.
+
+        Returns:
+            (list): (bytes, timestamp) of each hit, oldest first. The
+                    timestamp is None for hits without one.
+
+        """
+        buffer = self.buffer
+        control = self.controls[lane]
+        start = self.starts[lane]
+        lane_bytes = self.lane_bytes
+        head, = U64.unpack_from(buffer, control)
+        tail, = U64.unpack_from(buffer, control + TAIL_OFFSET)
+
+        records = []
+        while tail < head:
+            if max_records is not None and len(records) >= max_records:
+                break
+            position = tail % lane_bytes
+            contiguous = lane_bytes - position
+            if contiguous < RECORD.size:
+                tail += contiguous
+                continue
+            offset = start + position
+            length, checksum, timestamp, record_position = RECORD.unpack_from(
+                buffer,
+                offset,
+            )
+            if record_position != tail:
+                # written, but not visible to this process yet
+                break
+            if length == WRAP:
+                tail += contiguous
+                continue
+            if length > contiguous - RECORD.size:
+                break
+            data = bytes(buffer[offset + RECORD.size:offset + RECORD.size + length])
+            if crc32(data) != checksum:
+                break
+            records.append((data, timestamp or None))
+            tail += record_bytes(length)
+
+        U64.pack_into(buffer, control + TAIL_OFFSET, tail)
+        return records
+
+    def lane_stats(self):
+        """Get the owner's pid, and the queued bytes and dropped hits of each
+                lane."""
+        stats = []
+        for control in self.controls:
+            head, owner, dropped = struct.unpack_from('<QQQ', self.buffer, control)
+            tail, = U64.unpack_from(self.buffer, control + TAIL_OFFSET)
+            stats.append({
+                'owner': owner,
+                'queued_bytes': head - tail,
+                'dropped': dropped,
+            })
+        return stats
+
+    def close(self):
+        self.buffer.release()
+        self.mmap.close()
+
+def process_alive(pid):
+    """Check whether a process exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # another user's
+        return True
+    return True
+
+class RingClient(object):
+    """Sender that writes each hit into its process's lane of a HitRing."""
+
+    def __init__(self, path=DEFAULT_PATH, ring=None):
+        """Create a new ring client. It opens the ring and claims a lane with
+                its first hit.
+
+        Params:
+            path (str): (optional) Path of the ring. Default: DEFAULT_PATH.
+            ring (HitRing): (optional) Ring that is already open, e.g. in a
+                    master process before it forks.
+
+        """
+        self.path = path if ring is None else ring.path
+        self.ring = ring
+        self.__reset()
+        lifecycle.register(self)
+
+    def __reset(self):
+        self.lane = None
+        self.retry_at = 0.0
+        self.lock = Lock()
+        self.counters = {
+            'sent': 0,
+            'dropped': 0,
+            'oversized': 0,
+            'unavailable': 0,
+        }
+
+    def after_fork_in_child(self):
+        """Claim a lane of its own in a forked child. The parent keeps its
+                lane."""
+        self.__reset()
+
+    def __claim(self):
+        """Open the ring and claim a lane, at most once a second if either
+                fails. The lock must be held."""
+        if monotonic() < self.retry_at:
+            return False
+        try:
+            if self.ring is None:
+                self.ring = HitRing(self.path)
+            self.lane = self.ring.claim()
+        except (OSError, ValueError):
+            logger.debug('Opening ring %s failed.', self.path, exc_info=True)
+        if self.lane is None:
+            self.retry_at = monotonic() + 1.0
+            return False
+        return True
+
+    def send(self, hit):
+        """Write a hit into the ring without waiting.
+
+        Params:
+            hit (Hit): Encoded hit.
+
+        Returns:
+            (bool): Whether the ring took the hit.
+
+        """
+        with self.lock:
+            if len(hit) > HIT_MAX_BYTES:
+                self.counters['oversized'] += 1
+                return False
+            if self.lane is not None and self.ring.is_retired():
+                # the drain built a new ring; its old lane is left to drain
+                self.ring = None
+                self.lane = None
+            if self.lane is None and not self.__claim():
+                self.counters['unavailable'] += 1
+                return False
+            if not self.ring.write(self.lane, hit.body.encode('utf-8'), hit.timestamp):
+                self.counters['dropped'] += 1
+                return False
+            self.counters['sent'] += 1
+            return True
+
+    def stats(self):
+        """Get the counts of sent, dropped, oversized and unavailable hits,
+                i.e. hits sent when no lane could be claimed."""
+        return dict(self.counters)
+
+    def flush(self, timeout=None):
+        """Nothing to flush, because hits are in the ring as soon as they
+                are sent. Returns True."""
+        return True
+
+    def close(self):
+        """Free the lane of this process."""
+        with self.lock:
+            if self.lane is not None:
+                self.ring.release(self.lane)
+                self.lane = None
+
+class RingDrain(object):
+    """Reads the hits of every lane of a ring and queues them to be sent."""
+
+    def __init__(
+            self,
+            ring,
+            sender=None,
+            poll_interval=0.01,
+        ):
+        """Create a new drain.
+
+        Params:
+            ring (HitRing): Ring to read.
+            sender (QueuedSender): (optional) Sender to queue the hits on.
+                    Default: a QueuedSender that waits up to 0.5 seconds
+                    for batches to fill and posts over 4 connections.
+            poll_interval (float): (optional) Seconds to wait when the ring
+                    is empty. Default: 0.01.
+
+        """
+        self.ring = ring
+        self.sender = sender or QueuedSender(
+            max_bytes=16 * 1024 * 1024,
+            linger=0.5,
+            connections=4,
+        )
+        self.poll_interval = poll_interval
+        self.stopped = Event()
+        self.finished = Event()
+        self.serving = False
+        self.received = 0
+
+    def drain(self):
+        """Queue the hits that are in the ring now.
+
+        Returns:
+            (int): Number of hits read.
+
+        """
+        count = 0
+        # what is left in a ring that this one replaced, then this one
+        for ring in [self.ring.retired, self.ring]:
+            if ring is None:
+                continue
+            for lane in range(ring.lanes):
+                for data, timestamp in ring.read(lane):
+                    self.sender.send(Hit(data.decode('utf-8'), timestamp=timestamp))
+                    count += 1
+        self.received += count
+        return count
+
+    def serve_forever(self):
+        """Queue the hits that are written, until stop() is called."""
+        self.serving = True
+        try:
+            while not self.stopped.is_set():
+                if not self.drain():
+                    self.stopped.wait(self.poll_interval)
+            # queue the hits that were written before stopping
+            self.drain()
+        finally:
+            self.finished.set()
+
+    def stats(self):
+        """Get the number of hits read, the lanes' hits dropped because
+                they were full, and the sender's stats."""
+        stats = {
+            'received': self.received,
+            'dropped': sum(lane['dropped'] for lane in self.ring.lane_stats()),
+        }
+        stats['sender'] = self.sender.stats()
+        return stats
+
+    def stop(self):
+        """Stop serving once the hits that are in the ring are queued."""
+        self.stopped.set()
+
+    def close(self, timeout=None):
+        """Stop serving and send the queued hits. The ring is kept, so that
+                a new drain takes over its hits.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait for the queued
+                    hits to be sent.
+
+        Returns:
+            (bool): Whether the queued hits were sent in time.
+
+        """
+        self.stop()
+        if self.serving:
+            self.finished.wait(timeout)
+        return self.sender.flush(timeout)
+
+def main(argv=None):
+    """Run a drain. Installed as the ga-ring-drain console script."""
+    parser = argparse.ArgumentParser(
+        prog='ga-ring-drain',
+        description='Send hits that local processes write into a shared '
+            'memory ring to Google Analytics in batches.',
+    )
+    parser.add_argument(
+        '--path',
+        default=DEFAULT_PATH,
+        help='Path of the ring. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--lanes',
+        type=int,
+        default=64,
+        help='Most producer processes. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--lane-bytes',
+        type=int,
+        default=256 * 1024,
+        help='Bytes of hits that each process can have in the ring. '
+            'Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--max-bytes',
+        type=int,
+        default=16 * 1024 * 1024,
+        help='Most bytes of hits to queue. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--policy',
+        choices=POLICIES,
+        default='drop-oldest',
+        help='What to do when the queue is full. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--linger',
+        type=float,
+        default=0.5,
+        help='Most seconds to wait for a batch to fill. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--connections',
+        type=int,
+        default=4,
+        help='Number of connections to post over. Default: %(default)s.',
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Log failed requests.',
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    ring = HitRing(args.path, args.lanes, args.lane_bytes)
+    sender = QueuedSender(
+        max_bytes=args.max_bytes,
+        policy=args.policy,
+        linger=args.linger,
+        connections=args.connections,
+    )
+    drain = RingDrain(ring, sender)
+    signal.signal(signal.SIGTERM, lambda signum, frame: drain.stop())
+
+    logger.info('Draining hits from %s.', ring.path)
+    try:
+        drain.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    drain.close(lifecycle.EXIT_TIMEOUT)
+    logger.info('Stopped after draining %d hits: %s', drain.received, drain.stats())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,535 @@
+# -*- coding: utf-8 -*-
+"""Queue encoded hits and send them in batches from a background thread.
+
+
+Example:
+    ```
+    sender = QueuedSender(max_bytes=4 * 1024 * 1024, policy='drop-oldest')
+    ga = GoogleAnalytics('UA-12345-6', sender=sender)
+    ga.send_pageview('/page', 'domain.com') # returns without waiting
+    sender.stats() # e.g. {'queued_hits': 1, 'dropped_oldest': 0, ...}
+    ```
+
+The queue is capped in bytes of encoded hits, not in number of hits. When
+the cap is reached, the policy decides what happens:
+
+    drop-newest: The new hit is dropped.
+    drop-oldest: The oldest hits are dropped to make room.
+    block: The caller waits up to block_timeout seconds for room, then the
+            new hit is dropped.
+    spill: Hits go to an append-only file on disk until the queue drains.
+
+
+"""
+
+from collections import deque
+from threading import Condition, Lock, Thread
+from time import monotonic, time
+import json
+import logging
+import os
+
+from . import lifecycle
+from .hit import Hit
+from .measurement_protocol import GA_BATCH_ENDPOINT, GA_ENDPOINT
+from .transport import RequestsTransport
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ['drop-newest', 'drop-oldest', 'block', 'spill']
+
+BATCH_MAX_HITS = 20 # GA's limits for the batch endpoint
+BATCH_MAX_BYTES = 16 * 1024
+HIT_MAX_BYTES = 8 * 1024
+
+class DiskSpill(object):
+    """Append-only file of encoded hits, read back in order.
+
+    Each line is a JSON object with the encoded hit and, if known, its type,
+    Client ID and timestamp, so that spilled historical hits keep their
+    queue time and still expire:
+
+        {"hit": "v=1&t=event&...", "type": "event", "cid": "555", "timestamp": 1500000000.0}
+
+    """
+
+    def __init__(self, path, max_bytes=None):
+        """Create a new spill file, replacing any file at path.
+
+        Params:
+            path (str): Path of the spill file.
+            max_bytes (int): (optional) Largest size of the file.
+                    Default: None, i.e. unlimited.
+
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.writer = open(path, 'wb')
+        self.reader = open(path, 'rb')
+        self.size = 0
+        self.unread = 0
+
+    def __len__(self):
+        return self.unread
+
+    def write(self, hit):
+        """Append a hit.
+
+        Returns:
+            (bool): Whether there was room for it.
+
+        """
+        record = {'hit': hit.body}
+        if hit.hit_type is not None:
+            record['type'] = hit.hit_type
+        if hit.client_id is not None:
+            record['cid'] = hit.client_id
+        if hit.timestamp is not None:
+            record['timestamp'] = hit.timestamp
+        line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+        if self.max_bytes is not None and self.size + len(line) > self.max_bytes:
+            return False
+        self.writer.write(line)
+        self.size += len(line)
+        self.unread += 1
+        return True
+
+    def read(self, max_bytes):
+        """Read the oldest hits, up to about max_bytes.
+
+        Returns:
+            (list): Hits in the order they were written.
+
+        """
+        self.writer.flush()
+        hits = []
+        total = 0
+        while self.unread and total < max_bytes:
+            record = json.loads(self.reader.readline().decode('utf-8'))
+            self.unread -= 1
+            total += len(record['hit'])
+            hits.append(Hit(
+                record['hit'],
+                record.get('type'),
+                record.get('cid'),
+                timestamp=record.get('timestamp'),
+            ))
+
+        if not self.unread:
+            # everything was read back, so start the file over
+            self.writer.seek(0)
+            self.writer.truncate()
+            self.reader.seek(0)
+            self.size = 0
+        return hits
+
+    def close(self, remove=True):
+        self.writer.close()
+        self.reader.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+class HitBuffer(object):
+    """FIFO of hits capped in bytes, with a backpressure policy."""
+
+    def __init__(
+            self,
+            max_bytes=1024 * 1024,
+            policy='drop-newest',
+            block_timeout=1.0,
+            spill_path=None,
+            spill_max_bytes=None,
+        ):
+        """Create a new hit buffer.
+
+        Params:
+            max_bytes (int): (optional) Most bytes of encoded hits to hold in
+                    memory. Default: 1 MiB.
+            policy (str): (optional) What to do when max_bytes is reached.
+                    Refer to POLICIES. Default: 'drop-newest'.
+            block_timeout (float): (optional) Most seconds that put() waits
+                    for room with the 'block' policy. Default: 1.0.
+            spill_path (str): (optional) Path of the spill file for the
+                    'spill' policy.
+            spill_max_bytes (int): (optional) Largest size of the spill file.
+                    Hits beyond it are dropped. Default: None, i.e. unlimited.
+
+        Raises:
+            ValueError if max_bytes is not a positive integer.
+            ValueError if policy is not found in POLICIES.
+            ValueError if policy is 'spill' without spill_path.
+
+        """
+        if not isinstance(max_bytes, int) or max_bytes <= 0:
+            raise ValueError('max_bytes should be a positive integer.')
+        if policy not in POLICIES:
+            raise ValueError('Invalid policy: {}.'.format(policy))
+        if policy == 'spill' and not spill_path:
+            raise ValueError('Missing spill_path for the spill policy.')
+
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+        self.__reset()
+
+    def __reset(self):
+        self.hits = deque()
+        self.bytes = 0
+        self.spill = None
+        if self.policy == 'spill':
+            self.spill = DiskSpill(self.spill_path, self.spill_max_bytes)
+        self.counters = {
+            'dropped_newest': 0,
+            'dropped_oldest': 0,
+            'block_timeouts': 0,
+            'spilled': 0,
+        }
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+
+    def after_fork_in_child(self):
+        """Start empty in a forked child, with a spill file of its own. The
+                parent still sends the hits it holds."""
+        if self.spill_path:
+            self.spill_path = '{}.{}'.format(self.spill_path, os.getpid())
+        self.__reset()
+
+    def __len__(self):
+        return len(self.hits) + (len(self.spill) if self.spill else 0)
+
+    def put(self, hit):
+        """Add a hit, applying the policy if the buffer is full.
+
+        Returns:
+            (bool): Whether the hit was kept.
+
+        """
+        size = len(hit)
+        with self.lock:
+            if self.spill is not None and len(self.spill):
+                # keep the order: once hits spill, new ones follow them
+                return self.__spill(hit)
+
+            if self.bytes + size > self.max_bytes:
+                if self.policy == 'drop-newest' or size > self.max_bytes:
+                    self.counters['dropped_newest'] += 1
+                    return False
+                elif self.policy == 'drop-oldest':
+                    while self.bytes + size > self.max_bytes:
+                        self.bytes -= len(self.hits.popleft())
+                        self.counters['dropped_oldest'] += 1
+                elif self.policy == 'block':
+                    deadline = monotonic() + self.block_timeout
+                    while self.bytes + size > self.max_bytes:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            self.counters['block_timeouts'] += 1
+                            return False
+                        self.not_full.wait(remaining)
+                elif self.policy == 'spill':
+                    return self.__spill(hit)
+
+            self.hits.append(hit)
+            self.bytes += size
+            self.not_empty.notify()
+            return True
+
+    def __spill(self, hit):
+        """Write a hit to the spill file. The lock must be held."""
+        if not self.spill.write(hit):
+            self.counters['dropped_newest'] += 1
+            return False
+        self.counters['spilled'] += 1
+        self.not_empty.notify()
+        return True
+
+    def get_batch(
+            self,
+            max_hits=BATCH_MAX_HITS,
+            max_bytes=BATCH_MAX_BYTES,
+            timeout=None,
+            linger=0.0,
+        ):
+        """Take the oldest hits that fit into one batch.
+
+        Params:
+            max_hits (int): (optional) Most hits in the batch.
+            max_bytes (int): (optional) Most bytes in the batch, including
+                    the newlines between hits.
+            timeout (float): (optional) Most seconds to wait for a hit.
+            linger (float): (optional) Most seconds to wait after the first
+                    hit for max_hits hits to fill the batch. Default: 0.0.
+
+        Returns:
+            (list): Hits, or an empty list if none came in time.
+
+        """
+        with self.lock:
+            if not len(self):
+                self.not_empty.wait(timeout)
+
+            if linger > 0 and len(self):
+                deadline = monotonic() + linger
+                while len(self) < max_hits \
+                        and self.bytes + len(self.hits) < max_bytes:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.not_empty.wait(remaining)
+
+            if not self.hits and self.spill is not None and len(self.spill):
+                for hit in self.spill.read(self.max_bytes // 2):
+                    self.hits.append(hit)
+                    self.bytes += len(hit)
+
+            batch = []
+            batch_bytes = 0
+            while self.hits and len(batch) < max_hits:
+                size = len(self.hits[0]) + 1
+                if batch and batch_bytes + size > max_bytes:
+                    break
+                hit = self.hits.popleft()
+                self.bytes -= len(hit)
+                batch_bytes += size
+                batch.append(hit)
+
+            if batch:
+                self.not_full.notify_all()
+            return batch
+
+class QueuedSender(object):
+    """Sends queued hits in batches from a background thread."""
+
+    def __init__(
+            self,
+            max_bytes=1024 * 1024,
+            policy='drop-newest',
+            block_timeout=1.0,
+            spill_path=None,
+            spill_max_bytes=None,
+            transport=None,
+            recorder=None,
+            linger=0.0,
+            connections=1,
+            dedup=None,
+            buffer=None,
+        ):
+        """Create a new sender. Its threads start with the first hit.
+
+        Params:
+            max_bytes (int): (optional) Most bytes of encoded hits to queue
+                    in memory. Default: 1 MiB.
+            policy (str): (optional) What to do when max_bytes is reached.
+                    Refer to POLICIES. Default: 'drop-newest'.
+            block_timeout (float): (optional) Most seconds that send() waits
+                    for room with the 'block' policy. Default: 1.0.
+            spill_path (str): (optional) Path of the spill file for the
+                    'spill' policy.
+            spill_max_bytes (int): (optional) Largest size of the spill file.
+            transport (RequestsTransport): (optional) Transport to post
+                    batches with. Default: a new RequestsTransport.
+            recorder (HitRecorder): (optional) Recorder to archive every
+                    sent hit with its status.
+            linger (float): (optional) Most seconds to wait for a batch to
+                    fill before posting it. Default: 0.0, i.e. post what is
+                    queued right away.
+            connections (int): (optional) Number of threads posting batches
+                    at the same time, each over its own connection.
+                    Default: 1.
+            dedup (DedupFilter): (optional) Filter to drop hits whose
+                    idempotency key was already sent. Keys are remembered
+                    once GA accepts their batch.
+            buffer (LaneBuffer): (optional) Buffer to queue hits in instead
+                    of a HitBuffer, e.g. with priority lanes, or with
+                    PartitionedBuffer to keep each client's hits in order
+                    across connections. max_bytes,
+                    policy and the spill parameters are then not used.
+
+        Raises:
+            ValueError if connections is not a positive integer.
+
+        """
+        if not isinstance(connections, int) or connections <= 0:
+            raise ValueError('connections should be a positive integer.')
+
+        if buffer is None:
+            buffer = HitBuffer(
+                max_bytes,
+                policy,
+                block_timeout,
+                spill_path,
+                spill_max_bytes,
+            )
+        self.buffer = buffer
+        self.transport = transport or RequestsTransport()
+        self.recorder = recorder
+        self.linger = linger
+        self.connections = connections
+        self.dedup = dedup
+        self.__reset()
+        lifecycle.register(self)
+
+    def __reset(self):
+        self.counters = {
+            'sent': 0,
+            'failed': 0,
+            'oversized': 0,
+            'duplicates': 0,
+            'expired': 0,
+        }
+        self.in_flight = 0
+        self.threads = []
+        self.lock = Lock()
+        self.idle = Condition(self.lock)
+
+    def after_fork_in_child(self):
+        """Start over with an empty queue, new connections and no thread in
+                a forked child. The parent still sends the hits it queued."""
+        self.buffer.after_fork_in_child()
+        if hasattr(self.transport, 'after_fork_in_child'):
+            self.transport.after_fork_in_child()
+        if self.dedup is not None:
+            self.dedup.after_fork_in_child()
+        self.__reset()
+
+    def __start(self):
+        with self.lock:
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            while len(self.threads) < self.connections:
+                thread = Thread(
+                    target=self.__run,
+                    name='google-analytics-sender',
+                )
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def __run(self):
+        # buffers that keep an order, e.g. PartitionedBuffer, hold back
+        # hits until the batch before them is released
+        release = getattr(self.buffer, 'release', None)
+        while True:
+            batch = self.buffer.get_batch(timeout=1.0, linger=self.linger)
+            if not batch:
+                continue
+            try:
+                self.__send_batch(batch)
+            finally:
+                if release is not None:
+                    release(batch)
+
+    def __send_batch(self, batch):
+        batch = self.__drop_expired(batch)
+        if not batch:
+            return
+        with self.lock:
+            self.in_flight += len(batch)
+        status = self.post_batch(batch)
+        if self.dedup is not None and status is not None \
+                and 200 <= status < 300:
+            for hit in batch:
+                self.dedup.remember(hit.key)
+        if self.recorder is not None:
+            self.recorder.record(batch, status)
+        with self.lock:
+            self.counters['failed' if status is None else 'sent'] += len(batch)
+            self.in_flight -= len(batch)
+            self.idle.notify_all()
+
+    def __drop_expired(self, batch):
+        """Drop the hits that are too old for GA to process."""
+        now = time()
+        kept = [hit for hit in batch if not hit.expired(now)]
+        if len(kept) < len(batch):
+            with self.lock:
+                self.counters['expired'] += len(batch) - len(kept)
+        return kept
+
+    def post_batch(self, batch):
+        """Post a batch of hits, to the batch endpoint if there are several.
+                Hits with a timestamp get their queue time now.
+
+        Returns:
+            (int): HTTP status, or None if the request failed.
+
+        """
+        now = time()
+        try:
+            if len(batch) == 1:
+                return self.transport.post(GA_ENDPOINT, batch[0].encode(now))
+            return self.transport.post(
+                GA_BATCH_ENDPOINT,
+                '\n'.join(hit.encode(now) for hit in batch),
+            )
+        except Exception:
+            logger.debug('Sending %d hits failed.', len(batch), exc_info=True)
+            return None
+
+    def send(self, hit):
+        """Queue a hit without waiting on the network.
+
+        Params:
+            hit (Hit): Encoded hit.
+
+        Returns:
+            (bool): Whether the hit was queued.
+
+        """
+        if len(hit) > HIT_MAX_BYTES:
+            with self.lock:
+                self.counters['oversized'] += 1
+            return False
+        if self.dedup is not None and self.dedup.contains(hit.key):
+            with self.lock:
+                self.counters['duplicates'] += 1
+            return False
+        if not self.threads:
+            self.__start()
+        return self.buffer.put(hit)
+
+    def stats(self):
+        """Get the counters of the sender and its buffer.
+
+        Returns:
+            (dict): Counts of queued, sent, failed and dropped hits, and the
+                    stats of each lane or partition if the buffer has them.
+
+        """
+        stats = {
+            'queued_hits': len(self.buffer),
+            'queued_bytes': self.buffer.bytes,
+        }
+        stats.update(self.counters)
+        for name, value in self.buffer.counters.items():
+            stats[name] = stats.get(name, 0) + value
+        if hasattr(self.buffer, 'lane_stats'):
+            stats['lanes'] = self.buffer.lane_stats()
+        if hasattr(self.buffer, 'partition_stats'):
+            stats['partitions'] = self.buffer.partition_stats()
+        return stats
+
+    def flush(self, timeout=None):
+        """Wait for the queued hits to be sent.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait.
+
+        Returns:
+            (bool): Whether the queue was emptied in time.
+
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.lock:
+            while len(self.buffer) or self.in_flight:
+                if not self.threads:
+                    return False
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                # wake up now and then, because the buffer is not
+                # guarded by this lock
+                self.idle.wait(0.05 if remaining is None else min(remaining, 0.05))
+        return True
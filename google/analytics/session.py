@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""Track sessions per Client ID and expire idle ones without scanning.
+
+
+Example:
+    ```
+    sessions = SessionManager(timeout=1800)
+    ga = GoogleAnalytics('UA-12345-6', session_manager=sessions)
+    ga.send_pageview('/page', 'domain.com') # sent with sc=start
+    ga.send_event('menu', 'click') # same session, no sc
+    ga.end_session()
+    ga.send_event('menu', 'close') # sent with sc=end
+    ```
+
+One SessionManager can be shared by any number of trackers, so that the
+sessions of millions of Client IDs are kept in one hierarchical timer wheel.
+Scheduling, extending and ending a session are O(1), and idle sessions are
+found without scanning every Client ID.
+
+
+"""
+
+from threading import Lock
+from time import monotonic
+
+from . import lifecycle
+
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS # slots per level
+WHEEL_MASK = WHEEL_SIZE - 1
+WHEEL_LEVELS = 4 # 64**4 ticks, i.e. ~194 days at a 1-second resolution
+
+class TimerWheel(object):
+    """Hierarchical timer wheel of keys and their deadlines.
+
+    Each level has WHEEL_SIZE slots. Level 0 slots are one tick wide, and
+    each higher level is WHEEL_SIZE times wider than the one below it. Keys
+    in a higher level cascade down as the wheel turns, and they expire from
+    level 0.
+
+    """
+
+    def __init__(self, resolution=1.0, now=None):
+        """Create an empty timer wheel.
+
+        Params:
+            resolution (float): (optional) Width of a tick in seconds.
+                    Default: 1.0.
+            now (float): (optional) Current monotonic time in seconds.
+
+        Raises:
+            ValueError if resolution is not a positive number.
+
+        """
+        if not isinstance(resolution, (float, int)) or resolution <= 0:
+            raise ValueError('resolution should be a positive number.')
+
+        self.resolution = resolution
+        self.current_tick = self.tick(monotonic() if now is None else now)
+        self.levels = [
+            [{} for _ in range(WHEEL_SIZE)] for _ in range(WHEEL_LEVELS)
+        ]
+        # keys per level, so that empty stretches of the wheel are skipped
+        self.counts = [0] * WHEEL_LEVELS
+        # key -> (level, slot), so that keys can be cancelled without a search
+        self.locations = {}
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, key):
+        return key in self.locations
+
+    def tick(self, timestamp):
+        """Get the tick that a monotonic timestamp falls into."""
+        return int(timestamp / self.resolution)
+
+    def __place(self, key, deadline_tick):
+        """Put a key into the slot that matches its deadline."""
+        delta = deadline_tick - self.current_tick
+        if delta <= 0:
+            # overdue, so expire it on the next tick
+            level = 0
+            slot_tick = self.current_tick + 1
+        else:
+            level = 0
+            while level < WHEEL_LEVELS - 1 \
+                    and delta >= 1 << (WHEEL_BITS * (level + 1)):
+                level += 1
+            # deadlines beyond the top level wait in its furthest slot
+            max_delta = (1 << (WHEEL_BITS * WHEEL_LEVELS)) - 1
+            slot_tick = self.current_tick + min(delta, max_delta)
+
+        slot = self.levels[level][(slot_tick >> (WHEEL_BITS * level)) & WHEEL_MASK]
+        slot[key] = deadline_tick
+        self.counts[level] += 1
+        self.locations[key] = (level, slot)
+
+    def schedule(self, key, deadline):
+        """Schedule a key to expire at a monotonic deadline.
+                A key that is already scheduled is moved to the new deadline.
+
+        Params:
+            key (hashable): Key to schedule.
+            deadline (float): Monotonic time in seconds.
+
+        """
+        self.cancel(key)
+        self.__place(key, self.tick(deadline))
+
+    def cancel(self, key):
+        """Cancel a scheduled key.
+
+        Returns:
+            (bool): Whether the key was scheduled.
+
+        """
+        location = self.locations.pop(key, None)
+        if location is None:
+            return False
+        level, slot = location
+        del slot[key]
+        self.counts[level] -= 1
+        return True
+
+    def advance(self, now=None):
+        """Turn the wheel up to a monotonic time.
+
+        Params:
+            now (float): (optional) Current monotonic time in seconds.
+
+        Returns:
+            (list): Keys whose deadlines have passed, in deadline order.
+
+        """
+        target_tick = self.tick(monotonic() if now is None else now)
+        expired = []
+
+        while self.current_tick < target_tick:
+            if not self.locations:
+                # nothing is scheduled, so skip the empty ticks
+                self.current_tick = target_tick
+                break
+
+            # jump to just before the next cascade when the levels below it
+            # are empty, because no key can expire until then
+            level = 0
+            while level < WHEEL_LEVELS - 1 and not self.counts[level]:
+                level += 1
+            if level:
+                skip_to = self.current_tick | ((1 << (WHEEL_BITS * level)) - 1)
+                if skip_to >= target_tick:
+                    self.current_tick = target_tick
+                    break
+                self.current_tick = skip_to
+
+            self.current_tick += 1
+            tick = self.current_tick
+
+            # cascade the higher levels whose slots start at this tick
+            for level in range(1, WHEEL_LEVELS):
+                shift = WHEEL_BITS * level
+                if tick & ((1 << shift) - 1):
+                    break
+                slot = self.levels[level][(tick >> shift) & WHEEL_MASK]
+                if slot:
+                    entries = list(slot.items())
+                    slot.clear()
+                    self.counts[level] -= len(entries)
+                    for key, deadline_tick in entries:
+                        self.__place(key, deadline_tick)
+
+            slot = self.levels[0][tick & WHEEL_MASK]
+            if slot:
+                entries = list(slot.items())
+                slot.clear()
+                self.counts[0] -= len(entries)
+                for key, deadline_tick in entries:
+                    if deadline_tick > tick:
+                        self.__place(key, deadline_tick)
+                    else:
+                        del self.locations[key]
+                        expired.append(key)
+
+        return expired
+
+class SessionManager(object):
+    """Session state of many Client IDs, expired by a timer wheel."""
+
+    def __init__(
+            self,
+            timeout=1800,
+            resolution=1.0,
+            on_expire=None,
+        ):
+        """Create a new session manager.
+
+        Params:
+            timeout (int): (optional) Seconds of inactivity after which a
+                    session ends. Default: 1800, like GA's default.
+            resolution (float): (optional) Precision of the timeout in
+                    seconds. Default: 1.0.
+            on_expire (callable): (optional) Called with the Client ID of
+                    each session that times out, e.g. to send a closing hit.
+
+        Raises:
+            ValueError if timeout is not a positive number.
+            ValueError if on_expire is not callable.
+
+        """
+        if not isinstance(timeout, (float, int)) or timeout <= 0:
+            raise ValueError('timeout should be a positive number.')
+        if on_expire is not None and not callable(on_expire):
+            raise ValueError('on_expire should be callable.')
+
+        self.timeout = timeout
+        self.on_expire = on_expire
+        self.wheel = TimerWheel(resolution)
+        # Client ID -> monotonic time of its last hit
+        self.last_seen = {}
+        self.lock = Lock()
+        lifecycle.register(self)
+
+    def after_fork_in_child(self):
+        """Replace the lock, which another thread may have held at fork()."""
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def __contains__(self, client_id):
+        return client_id in self.last_seen
+
+    def __advance(self, now):
+        """Expire idle sessions. The lock must be held."""
+        expired = []
+        for client_id in self.wheel.advance(now):
+            deadline = self.last_seen[client_id] + self.timeout
+            if deadline > now:
+                # the session was extended since it was scheduled
+                self.wheel.schedule(client_id, deadline)
+            else:
+                del self.last_seen[client_id]
+                expired.append(client_id)
+        return expired
+
+    def __notify(self, expired):
+        if self.on_expire is not None:
+            for client_id in expired:
+                self.on_expire(client_id)
+
+    def touch(self, client_id, now=None):
+        """Record a hit for a Client ID.
+
+        Params:
+            client_id (str): Client ID of the hit.
+            now (float): (optional) Current monotonic time in seconds.
+
+        Returns:
+            (bool): Whether the hit starts a new session.
+
+        """
+        now = monotonic() if now is None else now
+        with self.lock:
+            expired = self.__advance(now)
+            started = client_id not in self.last_seen
+            if started:
+                self.wheel.schedule(client_id, now + self.timeout)
+            # extending a session only updates last_seen. The wheel
+            # reschedules the key lazily when its old deadline comes up.
+            self.last_seen[client_id] = now
+
+        self.__notify(expired)
+        return started
+
+    def starts(self, client_id, now=None):
+        """Check whether a hit for a Client ID would start a new session,
+                without recording it. Call touch() once the hit is sent.
+
+        Params:
+            client_id (str): Client ID of the hit.
+            now (float): (optional) Current monotonic time in seconds.
+
+        Returns:
+            (bool): Whether the hit would start a new session.
+
+        """
+        now = monotonic() if now is None else now
+        with self.lock:
+            expired = self.__advance(now)
+            started = client_id not in self.last_seen
+
+        self.__notify(expired)
+        return started
+
+    def end(self, client_id):
+        """End the session of a Client ID now.
+
+        Returns:
+            (bool): Whether the Client ID had a session.
+
+        """
+        with self.lock:
+            self.wheel.cancel(client_id)
+            return self.last_seen.pop(client_id, None) is not None
+
+    def expire(self, now=None):
+        """Expire the sessions that have been idle for longer than timeout.
+                Call this periodically to get on_expire callbacks without
+                waiting for the next hit.
+
+        Params:
+            now (float): (optional) Current monotonic time in seconds.
+
+        Returns:
+            (list): Client IDs whose sessions expired.
+
+        """
+        now = monotonic() if now is None else now
+        with self.lock:
+            expired = self.__advance(now)
+        self.__notify(expired)
+        return expired
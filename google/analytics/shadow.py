@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Validate a sample of production hits against GA's validation server.
+
+
+Example:
+    ```
+    shadow = ShadowValidator(sample_rate=0.001)
+    ga = GoogleAnalytics('UA-12345-6', shadow=shadow)
+    ...
+    shadow.problems() # e.g. {('event', 'ev', 'ERROR'): 12}
+    ```
+
+Hits are sent as usual. A sample of them is also posted to the validation
+server by a background thread, and the messages of its answers are counted
+per hit type, parameter and message type, so payload bugs show up in
+production without validating every hit.
+
+Hits are sampled by their cache buster, which is random, so the sample is
+uniform over hits, and a hit is either in it or not wherever it is sent
+from. Sampling costs the sending thread one integer parse per hit.
+
+
+"""
+
+from collections import deque
+from threading import Lock
+from urllib.parse import urlencode
+from zlib import crc32
+
+from . import lifecycle
+from .measurement_protocol import GA_DEBUG_ENDPOINT
+from .transport import RequestsTransport
+from .worker import BackgroundWorker
+
+SAMPLE_BUCKETS = 10000
+
+class ShadowValidator(object):
+    """Mirrors a sample of hits to the validation server and counts the
+            problems it finds."""
+
+    def __init__(
+            self,
+            sample_rate=0.01,
+            transport=None,
+            max_queue=1000,
+            max_examples=10,
+            worker=None,
+        ):
+        """Create a new validator.
+
+        Params:
+            sample_rate (float): (optional) Fraction of hits to validate,
+                    from 0 to 1. Default: 0.01.
+            transport (RequestsTransport): (optional) Transport to post to
+                    the validation server with. Default: a new
+                    RequestsTransport.
+            max_queue (int): (optional) Most hits waiting to be validated.
+                    Sampled hits that find the queue full are dropped.
+                    Default: 1000.
+            max_examples (int): (optional) Number of the latest invalid hits
+                    to keep with their messages. Default: 10.
+            worker (BackgroundWorker): (optional) Worker to validate from.
+
+        Raises:
+            ValueError if sample_rate is not between 0 and 1.
+
+        """
+        if not isinstance(sample_rate, (float, int)) or not 0 <= sample_rate <= 1:
+            raise ValueError('sample_rate should be between 0 and 1.')
+
+        self.sample_rate = sample_rate
+        self.threshold = int(sample_rate * SAMPLE_BUCKETS)
+        self.transport = transport or RequestsTransport()
+        self.max_examples = max_examples
+        self.worker = worker or BackgroundWorker(
+            max_queue=max_queue,
+            name='google-analytics-shadow',
+        )
+        self.__reset()
+        lifecycle.register(self)
+
+    def __reset(self):
+        self.counters = {
+            'sampled': 0,
+            'validated': 0,
+            'valid': 0,
+            'invalid': 0,
+            'failed': 0,
+        }
+        # (hit type, parameter, message type) -> count
+        self.messages = {}
+        self.examples = deque(maxlen=self.max_examples)
+        self.lock = Lock()
+
+    def after_fork_in_child(self):
+        """Start with new counts in a forked child."""
+        if hasattr(self.transport, 'after_fork_in_child'):
+            self.transport.after_fork_in_child()
+        self.__reset()
+
+    def sampled(self, cache_buster):
+        """Check whether a hit is in the sample, by its cache buster."""
+        if self.threshold >= SAMPLE_BUCKETS:
+            return True
+        try:
+            bucket = int(cache_buster, 16) % SAMPLE_BUCKETS
+        except (TypeError, ValueError):
+            bucket = crc32(str(cache_buster).encode('utf-8')) % SAMPLE_BUCKETS
+        return bucket < self.threshold
+
+    def offer(self, hit_type, data):
+        """Queue a hit for validation if it is in the sample.
+
+        Params:
+            hit_type (str): Type of hit.
+            data (dict): Payload without None values, with its cache buster.
+
+        Returns:
+            (bool): Whether the hit was queued.
+
+        """
+        if not self.sampled(data.get('z')):
+            return False
+        with self.lock:
+            self.counters['sampled'] += 1
+        return self.worker.submit(self.__validate, hit_type, urlencode(data))
+
+    def __validate(self, hit_type, body):
+        try:
+            response = self.transport.request(GA_DEBUG_ENDPOINT, body)
+            result = response.json()['hitParsingResult'][0]
+        except Exception:
+            with self.lock:
+                self.counters['failed'] += 1
+            raise
+
+        messages = result.get('parserMessage') or []
+        with self.lock:
+            self.counters['validated'] += 1
+            self.counters['valid' if result['valid'] else 'invalid'] += 1
+            for message in messages:
+                key = (
+                    hit_type,
+                    message.get('parameter'),
+                    message.get('messageType'),
+                )
+                self.messages[key] = self.messages.get(key, 0) + 1
+            if not result['valid']:
+                self.examples.append((body, messages))
+
+    def problems(self, message_types=None):
+        """Get the counts of the validation server's messages.
+
+        Params:
+            message_types (list): (optional) Message types to count, e.g.
+                    ['ERROR']. Default: None, i.e. all.
+
+        Returns:
+            (dict): Counts by (hit type, parameter, message type), e.g.
+                    { ('event', 'ev', 'ERROR'): 12 }. The parameter is None
+                    for messages about the whole hit.
+
+        """
+        with self.lock:
+            return {
+                key: count for key, count in self.messages.items()
+                if message_types is None or key[2] in message_types
+            }
+
+    def stats(self):
+        """Get the counts of sampled, validated, valid, invalid and failed
+                hits, and of sampled hits dropped because the queue was
+                full."""
+        with self.lock:
+            stats = dict(self.counters)
+        stats['dropped'] = self.worker.dropped
+        return stats
+
+    def flush(self, timeout=None):
+        """Wait for the queued hits to be validated. Refer to
+                BackgroundWorker.flush()."""
+        return self.worker.flush(timeout)
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""Send hits for many properties fairly, with a queue per property.
+
+
+Example:
+    ```
+    manager = TrackerManager(scheduling='drr', connections=4)
+    manager.add_tenant('UA-12345-6', weight=2, max_bytes=512 * 1024)
+
+    ga = manager.tracker('UA-12345-6', client_id=request_client_id)
+    ga.send_pageview('/page', 'domain.com')
+    manager.stats()['tenants']['UA-12345-6'] # e.g. {'queued_hits': 3, ...}
+    ```
+
+Each property, i.e. tenant, has its own queue, capped at its own max_bytes,
+so a noisy tenant drops its own hits instead of everyone else's. Each batch
+holds the hits of one tenant, and tenants take turns at the sender's shared
+connections:
+
+    drr: Deficit round robin. Each turn, a tenant may send up to quantum
+            bytes times its weight, so tenants share the connections by
+            bytes whatever the size of their hits.
+    wrr: Smooth weighted round robin. A tenant with weight 2 sends 2
+            batches for each batch of a tenant with weight 1.
+
+Tenants that were not added get the default weight and max_bytes with
+their first hit.
+
+
+"""
+
+from collections import deque
+from threading import Condition, Lock
+from time import monotonic
+from urllib.parse import unquote
+import re
+
+from .lanes import LANE_POLICIES
+from .measurement_protocol import GoogleAnalytics
+from .sender import BATCH_MAX_BYTES, BATCH_MAX_HITS, QueuedSender
+from .timing import Histogram
+
+SCHEDULING = ['drr', 'wrr']
+
+PROPERTY_PARAMETER = re.compile(r'(?:^|&)tid=([^&]*)')
+
+class Tenant(object):
+    """Queue, weight and cap of one property."""
+
+    def __init__(
+            self,
+            property_id,
+            weight=1,
+            max_bytes=256 * 1024,
+            policy='drop-oldest',
+        ):
+        """Create a new tenant.
+
+        Params:
+            property_id (str): GA property ID, e.g. 'UA-12345-6'.
+            weight (int): (optional) Share of the connections. Default: 1.
+            max_bytes (int): (optional) Most bytes of encoded hits in the
+                    tenant's queue. Default: 256 KiB.
+            policy (str): (optional) What to do when max_bytes is reached.
+                    Refer to LANE_POLICIES. Default: 'drop-oldest'.
+
+        Raises:
+            ValueError if weight is not a positive integer.
+            ValueError if max_bytes is not a positive integer.
+            ValueError if policy is not found in LANE_POLICIES.
+
+        """
+        if not isinstance(weight, int) or weight <= 0:
+            raise ValueError('weight should be a positive integer.')
+        if not isinstance(max_bytes, int) or max_bytes <= 0:
+            raise ValueError('max_bytes should be a positive integer.')
+        if policy not in LANE_POLICIES:
+            raise ValueError('Invalid policy: {}.'.format(policy))
+
+        self.property_id = property_id
+        self.weight = weight
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.reset()
+
+    def reset(self):
+        self.hits = deque()
+        self.bytes = 0
+        self.deficit = 0
+        self.current_weight = 0
+        self.wait = Histogram()
+        self.counters = {
+            'queued': 0,
+            'batches': 0,
+            'dropped_newest': 0,
+            'dropped_oldest': 0,
+            'shed': 0,
+        }
+
+    def popleft(self):
+        hit = self.hits.popleft()
+        self.bytes -= len(hit)
+        return hit
+
+    def stats(self):
+        """Get the counters of the tenant and the wait of its hits.
+
+        Returns:
+            (dict): Counters, queued hits and bytes, and percentiles of the
+                    milliseconds that sent hits waited.
+
+        """
+        stats = {
+            'queued_hits': len(self.hits),
+            'queued_bytes': self.bytes,
+            'wait_p50_ms': self.wait.percentile(50),
+            'wait_p99_ms': self.wait.percentile(99),
+            'wait_max_ms': self.wait.max,
+        }
+        stats.update(self.counters)
+        return stats
+
+class TenantBuffer(object):
+    """Hit buffer with a queue per property. Can be used as QueuedSender's
+            buffer."""
+
+    def __init__(
+            self,
+            scheduling='drr',
+            quantum=BATCH_MAX_BYTES,
+            max_bytes=None,
+            default_weight=1,
+            default_max_bytes=256 * 1024,
+        ):
+        """Create a new tenant buffer.
+
+        Params:
+            scheduling (str): (optional) How tenants take turns. Refer to
+                    SCHEDULING. Default: 'drr'.
+            quantum (int): (optional) Bytes per turn and unit of weight with
+                    'drr'. Default: 16 KiB, i.e. one full batch.
+            max_bytes (int): (optional) Most bytes of encoded hits of all
+                    tenants together. Default: None, i.e. only the tenants'
+                    caps.
+            default_weight (int): (optional) Weight of tenants that were not
+                    added. Default: 1.
+            default_max_bytes (int): (optional) Cap of tenants that were not
+                    added. Default: 256 KiB.
+
+        Raises:
+            ValueError if scheduling is not found in SCHEDULING.
+            ValueError if quantum is not a positive integer.
+
+        """
+        if scheduling not in SCHEDULING:
+            raise ValueError('Invalid scheduling: {}.'.format(scheduling))
+        if not isinstance(quantum, int) or quantum <= 0:
+            raise ValueError('quantum should be a positive integer.')
+
+        self.scheduling = scheduling
+        self.quantum = quantum
+        self.max_bytes = max_bytes
+        self.default_weight = default_weight
+        self.default_max_bytes = default_max_bytes
+        self.tenants = {}
+        self.__reset()
+
+    def __reset(self):
+        self.bytes = 0
+        for tenant in self.tenants.values():
+            tenant.reset()
+        # tenants in turn order; the next one is first
+        self.turns = deque(self.tenants.values())
+        self.granted = False
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+
+    def after_fork_in_child(self):
+        """Start empty in a forked child. The parent still sends the hits
+                it holds."""
+        self.__reset()
+
+    def __len__(self):
+        return sum(len(tenant.hits) for tenant in self.tenants.values())
+
+    @property
+    def counters(self):
+        """Counters of all tenants together."""
+        counters = {}
+        for tenant in list(self.tenants.values()):
+            for name, value in tenant.counters.items():
+                counters[name] = counters.get(name, 0) + value
+        return counters
+
+    def tenant_stats(self):
+        """Get the stats of each tenant by property ID. Refer to
+                Tenant.stats()."""
+        with self.lock:
+            return {
+                property_id: tenant.stats()
+                for property_id, tenant in self.tenants.items()
+            }
+
+    def add_tenant(self, tenant):
+        """Add a tenant, or replace the settings of one with the same
+                property ID. Its queued hits are kept.
+
+        Params:
+            tenant (Tenant): Tenant.
+
+        """
+        with self.lock:
+            current = self.tenants.get(tenant.property_id)
+            if current is None:
+                self.tenants[tenant.property_id] = tenant
+                self.turns.append(tenant)
+            else:
+                current.weight = tenant.weight
+                current.max_bytes = tenant.max_bytes
+                current.policy = tenant.policy
+
+    def tenant_of(self, hit):
+        """Get the tenant of a hit by its property ID, adding it if needed.
+                The lock must be held."""
+        match = PROPERTY_PARAMETER.search(hit.body)
+        property_id = unquote(match.group(1)) if match else None
+        tenant = self.tenants.get(property_id)
+        if tenant is None:
+            tenant = Tenant(
+                property_id,
+                self.default_weight,
+                self.default_max_bytes,
+            )
+            self.tenants[property_id] = tenant
+            self.turns.append(tenant)
+        return tenant
+
+    def put(self, hit):
+        """Add a hit to its tenant's queue, applying the tenant's policy if
+                it is full, and shedding the largest queues if the buffer is
+                full.
+
+        Returns:
+            (bool): Whether the hit was kept.
+
+        """
+        size = len(hit)
+        with self.lock:
+            tenant = self.tenant_of(hit)
+            if tenant.bytes + size > tenant.max_bytes:
+                if tenant.policy == 'drop-newest' or size > tenant.max_bytes:
+                    tenant.counters['dropped_newest'] += 1
+                    return False
+                while tenant.bytes + size > tenant.max_bytes:
+                    self.bytes -= len(tenant.popleft())
+                    tenant.counters['dropped_oldest'] += 1
+
+            if self.max_bytes is not None and self.bytes + size > self.max_bytes:
+                if size > self.max_bytes:
+                    tenant.counters['dropped_newest'] += 1
+                    return False
+                # the tenants that hold the most give way first
+                while self.bytes + size > self.max_bytes:
+                    largest = max(self.tenants.values(), key=lambda t: t.bytes)
+                    self.bytes -= len(largest.popleft())
+                    largest.counters['shed'] += 1
+
+            tenant.hits.append(hit)
+            tenant.bytes += size
+            self.bytes += size
+            tenant.counters['queued'] += 1
+            self.not_empty.notify()
+            return True
+
+    def __next_tenant(self):
+        """Pick the tenant whose turn it is, by weight. The lock must be
+                held."""
+        if self.scheduling == 'wrr':
+            best = None
+            total_weight = 0
+            for tenant in self.turns:
+                if tenant.hits:
+                    tenant.current_weight += tenant.weight
+                    total_weight += tenant.weight
+                    if best is None or tenant.current_weight > best.current_weight:
+                        best = tenant
+            if best is not None:
+                best.current_weight -= total_weight
+            return best
+
+        # the tenant at the head of the turns keeps its turn while its
+        # deficit covers its next hit
+        while True:
+            tenant = self.turns[0]
+            if self.granted:
+                if tenant.hits and len(tenant.hits[0]) + 1 <= tenant.deficit:
+                    return tenant
+                if not tenant.hits:
+                    # idle tenants do not save up turns
+                    tenant.deficit = 0
+                self.turns.rotate(-1)
+                tenant = self.turns[0]
+            if tenant.hits:
+                tenant.deficit += self.quantum * tenant.weight
+            self.granted = True
+
+    def get_batch(
+            self,
+            max_hits=BATCH_MAX_HITS,
+            max_bytes=BATCH_MAX_BYTES,
+            timeout=None,
+            linger=0.0,
+        ):
+        """Take hits of the tenant whose turn it is that fit into one batch.
+
+        Params:
+            Refer to HitBuffer.get_batch().
+
+        Returns:
+            (list): Hits, or an empty list if none came in time.
+
+        """
+        with self.lock:
+            if not self.bytes:
+                self.not_empty.wait(timeout)
+
+            if linger > 0 and self.bytes:
+                deadline = monotonic() + linger
+                while len(self) < max_hits \
+                        and self.bytes + len(self) < max_bytes:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.not_empty.wait(remaining)
+
+            if not self.bytes:
+                return []
+            tenant = self.__next_tenant()
+
+            now = monotonic()
+            batch = []
+            batch_bytes = 0
+            while tenant.hits and len(batch) < max_hits:
+                size = len(tenant.hits[0]) + 1
+                if batch and batch_bytes + size > max_bytes:
+                    break
+                if self.scheduling == 'drr':
+                    if size > tenant.deficit:
+                        break
+                    tenant.deficit -= size
+                hit = tenant.popleft()
+                self.bytes -= len(hit)
+                tenant.wait.record(max(0, int((now - hit.created) * 1000)))
+                batch_bytes += size
+                batch.append(hit)
+
+            if not tenant.hits:
+                tenant.deficit = 0
+            tenant.counters['batches'] += 1
+            return batch
+
+class TrackerManager(object):
+    """Trackers for many properties that share one sender and its
+            connections, with fair queues per property."""
+
+    def __init__(
+            self,
+            scheduling='drr',
+            quantum=BATCH_MAX_BYTES,
+            max_bytes=None,
+            default_weight=1,
+            default_max_bytes=256 * 1024,
+            transport=None,
+            connections=4,
+            linger=0.0,
+            **tracker_kwargs
+        ):
+        """Create a new manager with a TenantBuffer and a QueuedSender.
+
+        Params:
+            scheduling, quantum, max_bytes, default_weight, default_max_bytes:
+                    Refer to TenantBuffer.
+            transport, connections, linger: Refer to QueuedSender.
+                    Default connections: 4.
+            tracker_kwargs: (optional) Parameters of every tracker, e.g.
+                    document_encoding. Refer to GoogleAnalytics.
+
+        """
+        self.buffer = TenantBuffer(
+            scheduling,
+            quantum,
+            max_bytes,
+            default_weight,
+            default_max_bytes,
+        )
+        self.sender = QueuedSender(
+            transport=transport,
+            linger=linger,
+            connections=connections,
+            buffer=self.buffer,
+        )
+        self.tracker_kwargs = tracker_kwargs
+
+    def add_tenant(
+            self,
+            property_id,
+            weight=1,
+            max_bytes=256 * 1024,
+            policy='drop-oldest',
+        ):
+        """Add a property with its own weight and cap. Refer to Tenant."""
+        self.buffer.add_tenant(Tenant(property_id, weight, max_bytes, policy))
+
+    def tracker(self, property_id, client_id=None, **kwargs):
+        """Create a tracker for a property that sends through the shared
+                sender. Trackers are cheap, e.g. one per request.
+
+        Params:
+            property_id (str): GA property ID, e.g. 'UA-12345-6'.
+            client_id (str): (optional) Client ID. Default: a random one.
+            kwargs: (optional) Parameters of this tracker, over the
+                    manager's. Refer to GoogleAnalytics.
+
+        Returns:
+            (GoogleAnalytics): Tracker.
+
+        """
+        tracker_kwargs = dict(self.tracker_kwargs)
+        tracker_kwargs.update(kwargs)
+        tracker_kwargs['sender'] = self.sender
+        return GoogleAnalytics(property_id, client_id, **tracker_kwargs)
+
+    def stats(self):
+        """Get the counters of the sender, with the stats of each tenant
+                under 'tenants'."""
+        stats = self.sender.stats()
+        stats['tenants'] = self.buffer.tenant_stats()
+        return stats
+
+    def flush(self, timeout=None):
+        """Wait for the queued hits of all tenants to be sent. Refer to
+                QueuedSender.flush()."""
+        return self.sender.flush(timeout)
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""Time code and send summarised Timing hits.
+
+
+Example:
+    ```
+    ga = GoogleAnalytics('UA-12345-6', timing_window=60)
+
+    with ga.timer('database', 'query', 'users'):
+        run_query()
+
+    @ga.timer('api', 'render', sample_rate=0.1)
+    def render():
+        ...
+    ```
+
+Measurements are aggregated in memory per (category, var, label). Once per
+window, one Timing hit is sent for each of them with the mean duration, and
+the count and percentiles can be sent as Custom Metrics. A timer closes
+each window that has measurements when it ends, even if no measurement
+follows. The hits are sent from a background thread, so timed code never
+waits on the network, and a failed request never escapes from a timer.
+
+
+"""
+
+from functools import wraps
+from random import random as random_random
+from threading import Lock, Timer as WindowTimer
+from time import perf_counter_ns
+import logging
+
+from .worker import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+
+SUMMARY_FIELDS = ['count', 'mean', 'min', 'max', 'p50', 'p90', 'p95', 'p99']
+
+class Histogram(object):
+    """Log-linear histogram of non-negative integer values.
+
+    Each power of 2 is split into SUB_BUCKET_COUNT buckets, so a value is
+    kept with a relative error of at most 1/SUB_BUCKET_COUNT, and a few dozen
+    buckets cover everything from microseconds to hours.
+
+    """
+
+    __slots__ = ['buckets', 'count', 'total', 'min', 'max']
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def bucket_index(value):
+        """Get the bucket index of a value."""
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        if shift <= 0:
+            return value
+        return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+    @staticmethod
+    def bucket_value(index):
+        """Get the midpoint of the values in a bucket."""
+        if index < SUB_BUCKET_COUNT << 1:
+            return index
+        shift = (index >> SUB_BUCKET_BITS) - 1
+        mantissa = (index & (SUB_BUCKET_COUNT - 1)) + SUB_BUCKET_COUNT
+        return (mantissa << shift) + (1 << (shift - 1))
+
+    def record(self, value, weight=1):
+        """Record a value.
+
+        Params:
+            value (int): Non-negative value.
+            weight (float): (optional) How many values this one stands for,
+                    e.g. 1 / sample rate. Default: 1.
+
+        """
+        index = self.bucket_index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + weight
+        self.count += weight
+        self.total += value * weight
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        """Get the mean of the recorded values."""
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """Get an approximate percentile of the recorded values.
+
+        Params:
+            percent (float): Percentile between 0 and 100.
+
+        Returns:
+            (int): Approximate value, or None if nothing was recorded.
+
+        """
+        if not self.count:
+            return None
+
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= threshold:
+                value = self.bucket_value(index)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+class TimingAggregator(object):
+    """Aggregates timings per (category, var, label) over a time window."""
+
+    def __init__(
+            self,
+            tracker,
+            window=60,
+            summary_metrics=None,
+            worker=None,
+        ):
+        """Create a new timing aggregator.
+
+        Params:
+            tracker (GoogleAnalytics): Tracker to send Timing hits with.
+            window (int): (optional) Seconds between summarised hits.
+                    Default: 60.
+            summary_metrics (dict): (optional) Custom Metric indices to send
+                    summary values with. Refer to SUMMARY_FIELDS for keys.
+                    Syntax: { field: index, field: index, ... }
+                    Example: { 'count': '1', 'p95': '2' }
+            worker (BackgroundWorker): (optional) Worker to send summaries
+                    of closed windows from.
+
+        Raises:
+            ValueError if window is not a positive number.
+            ValueError if summary_metrics has unrecognised fields.
+
+        """
+        if not isinstance(window, (float, int)) or window <= 0:
+            raise ValueError('window should be a positive number.')
+        summary_metrics = summary_metrics or {}
+        for field in summary_metrics:
+            if field not in SUMMARY_FIELDS:
+                raise ValueError(
+                    'Unrecognised summary metric: {}.'.format(field)
+                )
+
+        self.tracker = tracker
+        self.window_ns = int(window * 10**9)
+        self.summary_metrics = summary_metrics
+        self.worker = worker or BackgroundWorker(
+            max_queue=100,
+            name='google-analytics-timing',
+        )
+        self.histograms = {}
+        self.window_start = perf_counter_ns()
+        # closes the current window when it ends, while it has measurements
+        self.window_timer = None
+        self.lock = Lock()
+
+    def after_fork_in_child(self):
+        """Start a new window in a forked child. The parent still sends
+                the measurements of the current one."""
+        self.histograms = {}
+        self.window_start = perf_counter_ns()
+        self.window_timer = None
+        self.lock = Lock()
+
+    def record(
+            self,
+            timing_category,
+            timing_var,
+            elapsed_ns,
+            timing_label=None,
+            weight=1,
+            now_ns=None,
+        ):
+        """Record one measurement. The summaries are sent from the worker
+                once the window closes.
+
+        Params:
+            timing_category (str): Category of the user timing.
+            timing_var (str): Variable of the user timing.
+            elapsed_ns (int): Duration in nanoseconds.
+            timing_label (str): (optional) Label of the user timing.
+            weight (float): (optional) How many measurements this one stands
+                    for. Default: 1.
+            now_ns (int): (optional) perf_counter_ns() at the end of the
+                    measurement.
+
+        """
+        key = (timing_category, timing_var, timing_label)
+        now_ns = perf_counter_ns() if now_ns is None else now_ns
+
+        with self.lock:
+            if not self.histograms \
+                    and now_ns - self.window_start >= self.window_ns:
+                # a window starts with its first measurement
+                self.window_start = now_ns
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            # microseconds keep the histogram small and precise enough
+            histogram.record(elapsed_ns // 1000, weight)
+
+            if now_ns - self.window_start < self.window_ns:
+                self.__schedule(now_ns)
+                return
+            histograms = self.__swap(now_ns)
+
+        # the caller is timed code, which should not wait on the network
+        self.worker.submit(self.__send, histograms)
+
+    def __schedule(self, now_ns):
+        """Start the timer that closes the window. The lock must be held."""
+        if self.window_timer is not None or not self.histograms:
+            return
+        self.window_timer = WindowTimer(
+            max(0, self.window_start + self.window_ns - now_ns) / 10**9,
+            self.__close,
+        )
+        self.window_timer.daemon = True
+        self.window_timer.start()
+
+    def __close(self):
+        """Close the window when no measurement came after it ended."""
+        now_ns = perf_counter_ns()
+        with self.lock:
+            self.window_timer = None
+            if now_ns - self.window_start < self.window_ns:
+                self.__schedule(now_ns)
+                return
+            histograms = self.__swap(now_ns)
+        if histograms:
+            self.worker.submit(self.__send, histograms)
+
+    def __swap(self, now_ns):
+        """Start a new window. The lock must be held."""
+        if self.window_timer is not None:
+            self.window_timer.cancel()
+            self.window_timer = None
+        histograms = self.histograms
+        self.histograms = {}
+        self.window_start = now_ns
+        return histograms
+
+    def summarise(self, histogram):
+        """Get the summary of a histogram in milliseconds.
+
+        Returns:
+            (dict): Values of SUMMARY_FIELDS.
+
+        """
+        summary = {
+            'count': int(round(histogram.count)),
+            'mean': histogram.mean() / 1000.0,
+            'min': histogram.min / 1000.0,
+            'max': histogram.max / 1000.0,
+        }
+        for field in SUMMARY_FIELDS:
+            if field.startswith('p'):
+                summary[field] = histogram.percentile(int(field[1:])) / 1000.0
+        return summary
+
+    def __send(self, histograms):
+        """Send one Timing hit per histogram."""
+        for key, histogram in histograms.items():
+            timing_category, timing_var, timing_label = key
+            summary = self.summarise(histogram)
+
+            custom_metrics = None
+            if self.summary_metrics:
+                custom_metrics = {
+                    index: summary[field]
+                    for field, index in self.summary_metrics.items()
+                }
+
+            self.tracker.send_timing(
+                timing_category,
+                timing_var,
+                # GA needs a whole, non-zero number of milliseconds
+                max(1, int(round(summary['mean']))),
+                timing_label,
+                custom_metrics=custom_metrics,
+            )
+
+    def flush(self, timeout=None):
+        """Send the summaries of the current window and start a new one,
+                after those of closed windows.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait for the
+                    summaries of closed windows.
+
+        """
+        self.worker.flush(timeout)
+        with self.lock:
+            histograms = self.__swap(perf_counter_ns())
+        self.__send(histograms)
+
+class Timer(object):
+    """Context manager and decorator that records durations.
+
+    A Timer that is used as a context manager holds the start time, so use a
+    new one for each `with` block. As a decorator, it can be shared.
+
+    """
+
+    __slots__ = [
+        'aggregator',
+        'timing_category',
+        'timing_var',
+        'timing_label',
+        'sample_rate',
+        'start',
+    ]
+
+    def __init__(
+            self,
+            aggregator,
+            timing_category,
+            timing_var,
+            timing_label=None,
+            sample_rate=1.0,
+        ):
+        """Create a new timer.
+
+        Params:
+            aggregator (TimingAggregator): Aggregator to record timings in.
+            timing_category (str): Category of the user timing.
+            timing_var (str): Variable of the user timing.
+            timing_label (str): (optional) Label of the user timing.
+            sample_rate (float): (optional) Fraction of calls to time.
+                    Default: 1.0.
+
+        Raises:
+            ValueError if timing_category is None.
+            ValueError if timing_var is None.
+            ValueError if sample_rate is not between 0 and 1.
+
+        """
+        if not timing_category:
+            raise ValueError('Missing timing_category when creating timer.')
+        if not timing_var:
+            raise ValueError('Missing timing_var when creating timer.')
+        if not isinstance(sample_rate, (float, int)) \
+                or not 0 < sample_rate <= 1:
+            raise ValueError('sample_rate should be between 0 and 1.')
+
+        self.aggregator = aggregator
+        self.timing_category = timing_category
+        self.timing_var = timing_var
+        self.timing_label = timing_label
+        self.sample_rate = sample_rate
+        self.start = None
+
+    def __sampled(self):
+        return self.sample_rate >= 1 or random_random() < self.sample_rate
+
+    def __record(self, start):
+        end = perf_counter_ns()
+        try:
+            self.aggregator.record(
+                self.timing_category,
+                self.timing_var,
+                end - start,
+                self.timing_label,
+                1.0 / self.sample_rate,
+                end,
+            )
+        except Exception:
+            # never replace the timed code's result or exception
+            logger.debug('Recording a timing failed.', exc_info=True)
+
+    def __enter__(self):
+        self.start = perf_counter_ns() if self.__sampled() else None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start is not None:
+            self.__record(self.start)
+            self.start = None
+        return False
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.__sampled():
+                return func(*args, **kwargs)
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.__record(start)
+        return wrapper
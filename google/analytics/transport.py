@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""Post encoded hits to GA over pooled connections.
+
+
+Example:
+    ```
+    transport = RequestsTransport()
+    status = transport.post(GA_BATCH_ENDPOINT, 'v=1&t=event&...\\nv=1&...')
+
+    # many requests at once over one connection; needs httpx[http2]
+    sender = QueuedSender(transport=HTTP2Transport(), connections=16)
+
+    # re-send requests that are slower than 95% of recent ones
+    sender = QueuedSender(transport=HedgedTransport(budget=2.0, percentile=95))
+    ```
+
+Every request has a timeout, DEFAULT_TIMEOUT unless set otherwise, so a
+stalled connection cannot hang the thread that sends.
+
+HedgedTransport keeps the latency of recent requests. When a request takes
+longer than a percentile of them, the same body is posted once more over
+another pooled connection, and the first response wins. The other request
+is abandoned: its response is ignored and its connection is closed instead
+of going back to the pool. Requests that take longer than the budget fail.
+
+
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+from time import monotonic
+import requests # to send hits to GA's collection endpoint
+
+try:
+    import httpx # optional, for HTTP2Transport
+except ImportError:
+    httpx = None
+
+from .timing import Histogram
+
+DEFAULT_TIMEOUT = 10.0 # seconds
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+JSON_CONTENT_TYPE = 'application/json'
+
+class RequestsTransport(object):
+    """Transport that keeps connections alive in a requests.Session."""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        """Create a new transport.
+
+        Params:
+            timeout (float): (optional) Seconds to wait for a response.
+                    Default: DEFAULT_TIMEOUT.
+
+        """
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def after_fork_in_child(self):
+        """Open new connections in a forked child. The parent's sockets must
+                not be shared."""
+        self.session = requests.Session()
+
+    def request(
+            self,
+            endpoint,
+            body,
+            timeout=None,
+            content_type=FORM_CONTENT_TYPE,
+        ):
+        """Post a request body and get the response.
+
+        Params:
+            endpoint (str): URL to post to.
+            body (str): Encoded hit, hits separated by newlines, or JSON.
+            timeout (float): (optional) Seconds to wait for a response.
+                    Default: the transport's timeout.
+            content_type (str): (optional) Content type of the body.
+                    Default: FORM_CONTENT_TYPE.
+
+        Returns:
+            (requests.Response): The response.
+
+        """
+        return self.session.post(
+            endpoint,
+            data=body.encode('utf-8'),
+            headers={'Content-Type': content_type},
+            timeout=self.timeout if timeout is None else timeout,
+        )
+
+    def post(
+            self,
+            endpoint,
+            body,
+            timeout=None,
+            content_type=FORM_CONTENT_TYPE,
+        ):
+        """Post a request body.
+
+        Params:
+            Refer to request().
+
+        Returns:
+            (int): HTTP status code.
+
+        """
+        return self.request(endpoint, body, timeout, content_type).status_code
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+class HTTP2Transport(object):
+    """Transport that multiplexes concurrent requests over one HTTP/2
+            connection. Needs httpx with HTTP/2 support:
+            pip install httpx[http2]"""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, client=None):
+        """Create a new transport.
+
+        Params:
+            timeout (float): (optional) Seconds to wait for a response.
+                    Default: DEFAULT_TIMEOUT.
+            client (httpx.Client): (optional) Client to send with, e.g. one
+                    with http1=False to talk HTTP/2 to a cleartext server.
+                    Default: a new httpx.Client with http2=True.
+
+        Raises:
+            ImportError if httpx or its HTTP/2 support is not installed.
+
+        """
+        if httpx is None:
+            raise ImportError(
+                'HTTP2Transport needs httpx: pip install httpx[http2].'
+            )
+        self.timeout = timeout
+        self.client = client
+        self.new_client = client is None
+        if self.new_client:
+            self.client = self.__client()
+
+    def __client(self):
+        # raises ImportError if the h2 package is missing
+        return httpx.Client(http2=True, timeout=self.timeout)
+
+    def after_fork_in_child(self):
+        """Open a new connection in a forked child. The parent's connection
+                must not be shared."""
+        if self.new_client:
+            self.client = self.__client()
+
+    def request(
+            self,
+            endpoint,
+            body,
+            timeout=None,
+            content_type=FORM_CONTENT_TYPE,
+        ):
+        """Post a request body and get the response.
+
+        Params:
+            Refer to RequestsTransport.request().
+
+        Returns:
+            (httpx.Response): The response.
+
+        """
+        return self.client.post(
+            endpoint,
+            content=body.encode('utf-8'),
+            headers={'Content-Type': content_type},
+            timeout=self.timeout if timeout is None else timeout,
+        )
+
+    def post(
+            self,
+            endpoint,
+            body,
+            timeout=None,
+            content_type=FORM_CONTENT_TYPE,
+        ):
+        """Post a request body.
+
+        Params:
+            Refer to RequestsTransport.request().
+
+        Returns:
+            (int): HTTP status code.
+
+        """
+        return self.request(endpoint, body, timeout, content_type).status_code
+
+    def close(self):
+        """Close the connection."""
+        self.client.close()
+
+class HedgedTransport(object):
+    """Transport that posts a slow request again over another connection,
+            within a latency budget."""
+
+    def __init__(
+            self,
+            budget=DEFAULT_TIMEOUT,
+            percentile=95,
+            window=1000,
+            min_samples=20,
+            connections=8,
+            transport_factory=RequestsTransport,
+            min_hedge_after=0.001,
+            max_hedge_rate=None,
+        ):
+        """Create a new transport.
+
+        Params:
+            budget (float): (optional) Most seconds that a post takes,
+                    hedge included. Default: DEFAULT_TIMEOUT.
+            percentile (float): (optional) Percentile of recent latencies
+                    after which a request is hedged. Default: 95.
+            window (int): (optional) Number of recent requests that the
+                    percentile is worked out from. Default: 1000.
+            min_samples (int): (optional) Number of requests before the
+                    first hedge. Default: 20.
+            connections (int): (optional) Most requests in flight, hedges
+                    included, each over its own pooled transport.
+                    Default: 8.
+            transport_factory (callable): (optional) Creates a pooled
+                    transport from a timeout. Default: RequestsTransport.
+            min_hedge_after (float): (optional) Fewest seconds to wait
+                    before hedging, however fast recent requests were.
+                    Default: 0.001.
+            max_hedge_rate (float): (optional) Most fraction of the last
+                    window requests that are hedged. Default: None, i.e.
+                    (100 - percentile) / 100.
+
+        Raises:
+            ValueError if budget is not a positive number.
+            ValueError if percentile is not between 0 and 100.
+            ValueError if connections is not a positive integer.
+            ValueError if min_hedge_after is a negative number.
+            ValueError if max_hedge_rate is not between 0 and 1.
+
+        """
+        if not isinstance(budget, (float, int)) or budget <= 0:
+            raise ValueError('budget should be a positive number.')
+        if not isinstance(percentile, (float, int)) or not 0 < percentile < 100:
+            raise ValueError('percentile should be between 0 and 100.')
+        if not isinstance(connections, int) or connections <= 0:
+            raise ValueError('connections should be a positive integer.')
+        if not isinstance(min_hedge_after, (float, int)) or min_hedge_after < 0:
+            raise ValueError('min_hedge_after should be a non-negative number.')
+        if max_hedge_rate is None:
+            max_hedge_rate = (100 - percentile) / 100.0
+        if not isinstance(max_hedge_rate, (float, int)) or not 0 <= max_hedge_rate <= 1:
+            raise ValueError('max_hedge_rate should be between 0 and 1.')
+
+        self.budget = budget
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.connections = connections
+        self.transport_factory = transport_factory
+        self.min_hedge_after = min_hedge_after
+        self.max_hedge_rate = max_hedge_rate
+        self.__reset()
+
+    def __reset(self):
+        self.idle = deque()
+        self.latencies = Histogram()
+        self.hedge_after = None
+        # whether each of the last window requests was hedged
+        self.recent = deque(maxlen=self.window)
+        self.recent_hedges = 0
+        # attempts submitted and not finished, abandoned ones included
+        self.attempts = 0
+        self.counters = {
+            'requests': 0,
+            'hedged': 0,
+            'hedges_skipped': 0,
+            'hedge_wins': 0,
+            'abandoned': 0,
+            'timeouts': 0,
+        }
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.connections,
+            thread_name_prefix='google-analytics-hedge',
+        )
+
+    def after_fork_in_child(self):
+        """Open new connections and threads in a forked child."""
+        self.__reset()
+
+    def stats(self):
+        """Get the counters of requests, hedges, hedges skipped because of
+                max_hedge_rate and timeouts, and the current hedging delay
+                in milliseconds."""
+        with self.lock:
+            stats = dict(self.counters)
+            stats['hedge_after_ms'] = self.hedge_after
+        return stats
+
+    def __record(self, seconds):
+        """Record the latency of a won request, or the budget of one that
+                timed out, and work out the hedging delay again every
+                min_samples requests."""
+        with self.lock:
+            self.latencies.record(int(seconds * 1000))
+            if self.latencies.count % self.min_samples == 0:
+                # sub-millisecond latencies would otherwise hedge everything
+                self.hedge_after = max(
+                    self.latencies.percentile(self.percentile),
+                    self.min_hedge_after * 1000,
+                )
+            if self.latencies.count >= self.window:
+                # forget older requests, keeping the current delay
+                self.latencies = Histogram()
+
+    def __count(self, hedged):
+        """Record whether a request is hedged, and get whether it may be
+                without hedging more than max_hedge_rate of recent
+                requests, or waiting for a connection that abandoned
+                requests still hold."""
+        with self.lock:
+            if hedged and (
+                        self.recent_hedges + 1
+                        > self.max_hedge_rate * (len(self.recent) + 1)
+                        or self.attempts >= self.connections
+                    ):
+                self.counters['hedges_skipped'] += 1
+                hedged = False
+            if len(self.recent) == self.recent.maxlen and self.recent[0]:
+                self.recent_hedges -= 1
+            self.recent.append(hedged)
+            if hedged:
+                self.recent_hedges += 1
+                self.counters['hedged'] += 1
+            return hedged
+
+    def __submit(self, endpoint, body, timeout, content_type):
+        """Submit an attempt to the executor, and count it until it is done
+                or cancelled."""
+        with self.lock:
+            self.attempts += 1
+        future = self.executor.submit(
+            self.__attempt,
+            endpoint,
+            body,
+            timeout,
+            content_type,
+        )
+        future.add_done_callback(self.__attempt_done)
+        return future
+
+    def __attempt_done(self, future):
+        with self.lock:
+            self.attempts -= 1
+
+    def __attempt(self, endpoint, body, timeout, content_type):
+        """Post over an idle pooled transport, in an executor thread.
+
+        Returns:
+            (tuple): Transport and response.
+
+        """
+        with self.lock:
+            transport = self.idle.pop() if self.idle else None
+        if transport is None:
+            transport = self.transport_factory(timeout=self.budget)
+        try:
+            response = transport.request(endpoint, body, timeout, content_type)
+        except Exception:
+            transport.close()
+            raise
+        return transport, response
+
+    def __release(self, future, keep):
+        """Put a finished request's transport back in the pool, or close it
+                if the request was abandoned."""
+        if future.cancelled() or future.exception() is not None:
+            return
+        transport, _ = future.result()
+        if keep:
+            with self.lock:
+                self.idle.append(transport)
+        else:
+            transport.close()
+
+    def request(
+            self,
+            endpoint,
+            body,
+            timeout=None,
+            content_type=FORM_CONTENT_TYPE,
+        ):
+        """Post a request body, hedged, and get the first response.
+
+        Params:
+            Refer to RequestsTransport.request(). timeout is the budget.
+
+        Returns:
+            (requests.Response): The first response.
+
+        Raises:
+            TimeoutError if no response came within the budget.
+            The error of the requests if both failed.
+
+        """
+        budget = self.budget if timeout is None else timeout
+        started = monotonic()
+        deadline = started + budget
+        with self.lock:
+            self.counters['requests'] += 1
+            hedge_after = self.hedge_after
+
+        primary = self.__submit(endpoint, body, budget, content_type)
+        pending = {primary}
+        if hedge_after is None:
+            self.__count(False)
+        else:
+            done, _ = wait(pending, min(hedge_after / 1000.0, budget))
+            remaining = deadline - monotonic()
+            if self.__count(not done and remaining > 0):
+                # the hedge gets what is left of the budget, so that it
+                # frees its connection by the deadline if it loses
+                pending.add(self.__submit(endpoint, body, remaining, content_type))
+
+        error = None
+        while pending:
+            done, pending = wait(
+                pending,
+                max(0, deadline - monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                # the first response wins; the other request is cancelled
+                # if it has not started, and abandoned if it has
+                for loser in pending:
+                    with self.lock:
+                        self.counters['abandoned'] += 1
+                    if loser.cancel():
+                        continue
+                    loser.add_done_callback(
+                        lambda loser: self.__release(loser, keep=False)
+                    )
+                self.__release(future, keep=True)
+                if future is not primary:
+                    with self.lock:
+                        self.counters['hedge_wins'] += 1
+                self.__record(monotonic() - started)
+                return future.result()[1]
+
+        for future in pending:
+            if future.cancel():
+                continue
+            future.add_done_callback(
+                lambda future: self.__release(future, keep=False)
+            )
+        if error is not None and not pending:
+            raise error
+        with self.lock:
+            self.counters['timeouts'] += 1
+        # leaving timeouts out would make the percentile look faster
+        self.__record(budget)
+        raise TimeoutError('No response within {} seconds.'.format(budget))
+
+    def post(
+            self,
+            endpoint,
+            body,
+            timeout=None,
+            content_type=FORM_CONTENT_TYPE,
+        ):
+        """Post a request body, hedged.
+
+        Params:
+            Refer to RequestsTransport.request(). timeout is the budget.
+
+        Returns:
+            (int): HTTP status code.
+
+        """
+        return self.request(endpoint, body, timeout, content_type).status_code
+
+    def close(self):
+        """Close the pooled connections."""
+        self.executor.shutdown(wait=False)
+        with self.lock:
+            while self.idle:
+                self.idle.pop().close()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Run calls on a background thread so that callers never wait on the network.
+
+
+Example:
+    ```
+    worker = BackgroundWorker(max_queue=1000)
+    worker.submit(ga.send_exception, 'ValueError: bad input')
+    worker.flush(timeout=2)
+    ```
+
+
+"""
+
+from queue import Full, Queue
+from threading import Lock, Thread
+from time import monotonic
+import logging
+
+from . import lifecycle
+
+logger = logging.getLogger(__name__)
+
+class BackgroundWorker(object):
+    """Daemon thread that runs queued calls in order."""
+
+    def __init__(self, max_queue=1000, name='google-analytics-worker'):
+        """Create a new background worker. Its thread starts with the first
+                submitted call.
+
+        Params:
+            max_queue (int): (optional) Most calls that can wait in the queue.
+                    Calls submitted to a full queue are dropped.
+                    Default: 1000.
+            name (str): (optional) Name of the thread.
+
+        Raises:
+            ValueError if max_queue is not a positive integer.
+
+        """
+        if not isinstance(max_queue, int) or max_queue <= 0:
+            raise ValueError('max_queue should be a positive integer.')
+
+        self.max_queue = max_queue
+        self.name = name
+        self.queue = Queue(max_queue)
+        self.dropped = 0
+        self.thread = None
+        self.lock = Lock()
+        lifecycle.register(self)
+
+    def after_fork_in_child(self):
+        """Start over with an empty queue and no thread in a forked child.
+                The parent still runs the calls that were queued."""
+        self.queue = Queue(self.max_queue)
+        self.dropped = 0
+        self.thread = None
+        self.lock = Lock()
+
+    def __start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self.__run, name=self.name)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def __run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                func, args, kwargs = item
+                func(*args, **kwargs)
+            except Exception:
+                logger.debug('Background call failed.', exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a call without waiting.
+
+        Params:
+            func (callable): Function to call on the background thread.
+            *args, **kwargs: Arguments of the call.
+
+        Returns:
+            (bool): Whether the call was queued. False if the queue is full.
+
+        """
+        if self.thread is None:
+            self.__start()
+        try:
+            self.queue.put_nowait((func, args, kwargs))
+        except Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """Wait for the queued calls to finish.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait.
+                    Default: None, i.e. wait for as long as it takes.
+
+        Returns:
+            (bool): Whether the queue was emptied in time.
+
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                if deadline is None:
+                    self.queue.all_tasks_done.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return False
+                    self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Finish the queued calls and stop the thread.
+
+        Params:
+            timeout (float): (optional) Most seconds to wait.
+
+        Returns:
+            (bool): Whether the queue was emptied in time.
+
+        """
+        flushed = self.flush(timeout)
+        if self.thread is not None and self.thread.is_alive():
+            try:
+                self.queue.put_nowait(None)
+            except Full:
+                pass
+        return flushed
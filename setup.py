@@ -10,6 +10,17 @@ setup(
     url='https://github.com/yuhui/google-analytics-measurement-protocol',
     packages=find_packages(),
     install_requires=['requests>=2.0,<3.0a0'],
+    extras_require={
+        'http2': ['httpx[http2]'],
+        'gevent': ['gevent'],
+        'eventlet': ['eventlet'],
+    },
+    entry_points={
+        'console_scripts': [
+            'ga-relay = google.analytics.relay:main',
+            'ga-ring-drain = google.analytics.ring:main',
+        ],
+    },
     license='License :: OSI Approved :: MIT License',
     classifiers=[
         'Development Status :: 3 - Alpha',
@@ -17,9 +28,10 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
         'Natural Language :: English',
-        'Programming Language :: Python :: 2',
+        'Programming Language :: Python :: 3',
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
     platforms=['any'],
+    python_requires='>=3.7',
     test_suite='tests'
 )
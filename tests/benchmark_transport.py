@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Benchmark RequestsTransport against HTTP2Transport on local stubs.
+
+Run with: python -m tests.benchmark_transport [requests] [threads] [delay]
+
+Each stub answers after a delay, like a distant server. Over HTTP/1.1 a
+connection carries one request at a time, so throughput is capped by the
+number of pooled connections. Over HTTP/2 all threads share one connection.
+"""
+
+from threading import Thread
+from time import perf_counter
+import sys
+
+from google.analytics.transport import HTTP2Transport, RequestsTransport, httpx
+
+from .stub_server import HTTP1StubServer, HTTP2StubServer, h2
+
+def run(transport, url, requests, threads):
+    """Post requests from threads and get the seconds it took."""
+    per_thread = requests // threads
+
+    def post():
+        for number in range(per_thread):
+            transport.post(url, 'v=1&t=event&el={}'.format(number))
+
+    workers = [Thread(target=post) for _ in range(threads)]
+    started = perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return perf_counter() - started
+
+def report(name, seconds, requests):
+    print('{:<24} {:>8.3f}s {:>10.0f} requests/s'.format(
+        name,
+        seconds,
+        requests / seconds,
+    ))
+
+def main(requests=400, threads=32, delay=0.05):
+    print('{} requests from {} threads, {}s server delay'.format(
+        requests,
+        threads,
+        delay,
+    ))
+
+    server = HTTP1StubServer(delay).start()
+    transport = RequestsTransport(timeout=10)
+    report('HTTP/1.1 requests', run(transport, server.url + '/collect', requests, threads), requests)
+    transport.close()
+    server.stop()
+
+    if httpx is None or h2 is None:
+        print('HTTP/2: skipped, needs httpx[http2]')
+        return
+
+    server = HTTP2StubServer(delay).start()
+    transport = HTTP2Transport(
+        timeout=10,
+        client=httpx.Client(http1=False, http2=True),
+    )
+    seconds = run(transport, server.url + '/collect', requests, threads)
+    report('HTTP/2 httpx', seconds, requests)
+    print('HTTP/2 connections: {}, most concurrent streams: {}'.format(
+        server.connections,
+        server.max_open_streams,
+    ))
+    transport.close()
+    server.stop()
+
+if __name__ == '__main__':
+    main(*[
+        cast(value) for cast, value in zip([int, int, float], sys.argv[1:])
+    ])
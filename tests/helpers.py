@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Transports and hits shared by the unit tests."""
+
+from urllib.parse import parse_qs
+
+from google.analytics.hit import Hit
+
+class RecordingTransport(object):
+    """Transport that records posts instead of sending them."""
+
+    def __init__(self, status=200, release=None):
+        """Create a new transport.
+
+        Params:
+            status (int): (optional) Status to answer with, or None to fail
+                    every post. Default: 200.
+            release (Event): (optional) Event that each post waits for.
+
+        """
+        self.posts = []
+        self.content_types = []
+        self.status = status
+        self.release = release
+
+    def post(self, endpoint, body, timeout=None, content_type=None):
+        if self.release is not None:
+            self.release.wait(5)
+        self.posts.append((endpoint, body))
+        self.content_types.append(content_type)
+        if self.status is None:
+            raise IOError('connection reset')
+        return self.status
+
+    def hits(self):
+        """Get the parameters of every posted hit."""
+        return [
+            {key: values[0] for key, values in parse_qs(line).items()}
+            for endpoint, body in self.posts
+            for line in body.split('\n')
+        ]
+
+def make_hit(
+        number=0,
+        size=0,
+        params=None,
+        hit_type=None,
+        client_id=None,
+        timestamp=None,
+    ):
+    """Make a hit with the parameters, then n=number, padded to size bytes
+            with a p parameter, e.g. make_hit(1, 20, 't=event') is a hit
+            't=event&n=1&p=xxxxx'."""
+    body = 'n={}'.format(number) if params is None \
+        else '{}&n={}'.format(params, number)
+    if len(body) < size:
+        body = (body + '&p=').ljust(size, 'x')
+    return Hit(body, hit_type, client_id, timestamp=timestamp)
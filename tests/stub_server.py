@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Local stand-ins for GA's collection endpoint, for tests and benchmarks."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from threading import Lock, Thread, Timer
+from time import sleep
+import socket
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    h2 = None
+
+class HTTP1StubServer(object):
+    """HTTP/1.1 server that answers every POST with 200 after a delay, and
+            some of them after a longer one."""
+
+    def __init__(self, delay=0.0, slow_rate=0.0, slow_delay=0.0, seed=0):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.requests.append((self.path, body.decode('utf-8')))
+                with stub.lock:
+                    slow = stub.random.random() < stub.slow_rate
+                sleep(stub.slow_delay if slow else stub.delay)
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.delay = delay
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.random = Random(seed)
+        self.lock = Lock()
+        self.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def start(self):
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class HTTP2StubServer(object):
+    """Cleartext HTTP/2 server that answers every request with 200 after a
+            delay, without holding up the other streams of its connection.
+            Needs the h2 package."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self.connections = 0
+        self.open_streams = 0
+        self.max_open_streams = 0
+        self.lock = Lock()
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(16)
+        self.url = 'http://127.0.0.1:{}'.format(self.socket.getsockname()[1])
+
+    def start(self):
+        thread = Thread(target=self.__accept)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.socket.close()
+
+    def __accept(self):
+        while True:
+            try:
+                client, _ = self.socket.accept()
+            except OSError:
+                return
+            self.connections += 1
+            thread = Thread(target=self.__serve, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def __serve(self, client):
+        connection = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(
+                client_side=False,
+                header_encoding='utf-8',
+            ),
+        )
+        send_lock = Lock()
+        with send_lock:
+            connection.initiate_connection()
+            client.sendall(connection.data_to_send())
+
+        paths = {}
+        bodies = {}
+        while True:
+            try:
+                data = client.recv(65535)
+            except OSError:
+                break
+            if not data:
+                break
+
+            with send_lock:
+                events = connection.receive_data(data)
+                for event in events:
+                    if isinstance(event, h2.events.RequestReceived):
+                        paths[event.stream_id] = dict(event.headers)[':path']
+                        bodies[event.stream_id] = b''
+                        with self.lock:
+                            self.open_streams += 1
+                            self.max_open_streams = max(
+                                self.max_open_streams,
+                                self.open_streams,
+                            )
+                    elif isinstance(event, h2.events.DataReceived):
+                        bodies[event.stream_id] += event.data
+                        connection.acknowledge_received_data(
+                            event.flow_controlled_length,
+                            event.stream_id,
+                        )
+                    elif isinstance(event, h2.events.StreamEnded):
+                        self.requests.append((
+                            paths.pop(event.stream_id),
+                            bodies.pop(event.stream_id).decode('utf-8'),
+                        ))
+                        Timer(
+                            self.delay,
+                            self.__respond,
+                            (client, connection, send_lock, event.stream_id),
+                        ).start()
+                client.sendall(connection.data_to_send())
+        client.close()
+
+    def __respond(self, client, connection, send_lock, stream_id):
+        with self.lock:
+            self.open_streams -= 1
+        with send_lock:
+            connection.send_headers(
+                stream_id,
+                [(':status', '200'), ('content-length', '0')],
+                end_stream=True,
+            )
+            try:
+                client.sendall(connection.data_to_send())
+            except OSError:
+                pass
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.recorder's HitRecorder."""
+
+from glob import glob
+import os
+import tempfile
+import unittest
+
+from google.analytics.hit import Hit
+from google.analytics.measurement_protocol import GoogleAnalytics
+from google.analytics.recorder import HitRecorder, read_archive, resend
+from google.analytics.sender import QueuedSender
+
+from .helpers import RecordingTransport
+
+PROPERTY_ID = 'UA-12345-6'
+
+class RecordHits(unittest.TestCase):
+    """Tests for HitRecorder with a QueuedSender."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def __archives(self):
+        return sorted(glob(os.path.join(self.directory.name, 'hits-*')))
+
+    def test_01_archives_sent_hits(self):
+        recorder = HitRecorder(self.directory.name)
+        sender = QueuedSender(transport=RecordingTransport(), recorder=recorder)
+        ga = GoogleAnalytics(PROPERTY_ID, sender=sender)
+        for number in range(5):
+            ga.send_event('menu', 'click', event_value=number)
+        self.assertTrue(ga.flush(timeout=5))
+        self.assertTrue(recorder.close(timeout=5))
+
+        archives = self.__archives()
+        self.assertEqual(len(archives), 1)
+        self.assertTrue(archives[0].endswith('.jsonl.gz'))
+        records = list(read_archive(archives))
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[0]['status'], 200)
+        self.assertIn('ev=0', records[0]['hit'])
+        self.assertIn('ev=4', records[4]['hit'])
+
+    def test_02_rotates_and_keeps_max_files(self):
+        recorder = HitRecorder(
+            self.directory.name,
+            max_bytes=100,
+            max_files=2,
+            buffer_bytes=1,
+        )
+        for number in range(5):
+            recorder.record([Hit('v=1&n={}'.format(number).ljust(120, 'x'))], 200)
+        recorder.close(timeout=5)
+        archives = self.__archives()
+        self.assertEqual(len(archives), 2)
+        self.assertEqual(len(list(read_archive(archives))), 2)
+
+    def test_03_keeps_archives_of_other_processes(self):
+        other = os.path.join(
+            self.directory.name,
+            'hits-20200101000000-{}-0001.jsonl.gz'.format(os.getpid() + 1),
+        )
+        open(other, 'wb').close()
+        recorder = HitRecorder(
+            self.directory.name,
+            max_bytes=100,
+            max_files=1,
+            buffer_bytes=1,
+        )
+        for number in range(3):
+            recorder.record([Hit('v=1&n={}'.format(number).ljust(120, 'x'))], 200)
+        recorder.close(timeout=5)
+        self.assertTrue(os.path.exists(other))
+        self.assertEqual(len(self.__archives()), 2)
+
+    def test_04_resends_failed_hits(self):
+        recorder = HitRecorder(self.directory.name, compress=False)
+        recorder.record([Hit('v=1&n=1')], 200)
+        recorder.record([Hit('v=1&n=2'), Hit('v=1&n=3')], None)
+        recorder.close(timeout=5)
+
+        transport = RecordingTransport()
+        sender = QueuedSender(transport=transport)
+        self.assertEqual(resend(self.__archives(), sender, statuses=[None]), 2)
+        self.assertTrue(sender.flush(timeout=5))
+        sent = [hit for _, body in transport.posts for hit in body.split('\n')]
+        self.assertEqual(sent, ['v=1&n=2', 'v=1&n=3'])
+
+    def test_05_raises_error_with_missing_directory(self):
+        self.assertRaises(
+            ValueError,
+            HitRecorder,
+            os.path.join(self.directory.name, 'missing'),
+        )
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
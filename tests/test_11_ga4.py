@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.ga4's GA4Backend."""
+
+from time import time
+from urllib.parse import parse_qs, urlparse
+import json
+import unittest
+from unittest import mock
+
+from google.analytics.ga4 import (
+    GA4_ENDPOINT,
+    GA4_MAX_EVENT_AGE,
+    GA4Backend,
+    event_name,
+)
+from google.analytics.measurement_protocol import GoogleAnalytics
+
+from .helpers import RecordingTransport
+
+MEASUREMENT_ID = 'G-ABCDE12345'
+API_SECRET = 'secret'
+
+class MapEvents(unittest.TestCase):
+    """Tests for GA4Backend.event()."""
+
+    def setUp(self):
+        self.backend = GA4Backend(API_SECRET, parameter_names={'cd1': 'plan'})
+
+    def test_01_event_name(self):
+        self.assertEqual(event_name('Add to Cart'), 'add_to_cart')
+        self.assertEqual(event_name('404 error'), 'event_404_error')
+        self.assertEqual(len(event_name('x' * 100)), 40)
+
+    def test_02_pageview(self):
+        event = self.backend.event('pageview', {
+            'dh': 'domain.com',
+            'dp': '/page',
+            'dt': 'Page',
+            'cd1': 'pro',
+            'cd2': 'blue',
+        })
+        self.assertEqual(event['name'], 'page_view')
+        self.assertEqual(event['params'], {
+            'page_location': 'https://domain.com/page',
+            'page_title': 'Page',
+            'plan': 'pro',
+            'cd2': 'blue',
+        })
+
+    def test_03_exception(self):
+        event = self.backend.event('exception', {'exd': 'boom', 'exf': 1})
+        self.assertEqual(event, {
+            'name': 'exception',
+            'params': {'description': 'boom', 'fatal': True},
+        })
+
+class SendEvents(unittest.TestCase):
+    """Tests for a tracker with a GA4Backend."""
+
+    def setUp(self):
+        self.transport = RecordingTransport(status=204)
+        self.backend = GA4Backend(API_SECRET, transport=self.transport, max_delay=60)
+        self.ga = GoogleAnalytics(MEASUREMENT_ID, backend=self.backend)
+
+    def tearDown(self):
+        self.backend.close(timeout=5)
+
+    def test_01_batches_25_events_per_client(self):
+        with mock.patch('requests.post') as post:
+            for number in range(30):
+                self.ga.send_event('menu', 'click', event_value=number)
+            self.assertTrue(self.backend.worker.flush(timeout=5))
+            self.assertEqual(len(self.transport.posts), 1)
+            self.assertTrue(self.ga.flush(timeout=5))
+        post.assert_not_called()
+
+        self.assertEqual(
+            [len(json.loads(body)['events']) for _, body in self.transport.posts],
+            [25, 5],
+        )
+        url, body = self.transport.posts[0]
+        body = json.loads(body)
+        self.assertEqual(self.transport.content_types[0], 'application/json')
+        self.assertEqual(url.split('?')[0], GA4_ENDPOINT)
+        self.assertEqual(
+            parse_qs(urlparse(url).query),
+            {'measurement_id': [MEASUREMENT_ID], 'api_secret': [API_SECRET]},
+        )
+        self.assertEqual(body['client_id'], self.ga.client_id)
+        self.assertEqual(body['events'][3], {
+            'name': 'click',
+            'params': {'event_category': 'menu', 'value': 3},
+        })
+
+    def test_02_separate_batches_per_client(self):
+        other = GoogleAnalytics(MEASUREMENT_ID, backend=self.backend)
+        self.ga.send_event('menu', 'click')
+        other.send_event('menu', 'click')
+        self.assertTrue(self.backend.flush(timeout=5))
+        self.assertEqual(
+            sorted(json.loads(body)['client_id'] for _, body in self.transport.posts),
+            sorted([self.ga.client_id, other.client_id]),
+        )
+
+    def test_03_sends_timestamp_and_drops_expired_hits(self):
+        timestamp = time() - 3600
+        self.ga.send_event('menu', 'click', timestamp=timestamp)
+        self.ga.send_event('menu', 'click', timestamp=time() - GA4_MAX_EVENT_AGE - 60)
+        self.ga.send_event('menu', 'click')
+        self.assertTrue(self.backend.flush(timeout=5))
+
+        events = json.loads(self.transport.posts[0][1])['events']
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0]['timestamp_micros'], int(timestamp * 1000000))
+        self.assertNotIn('timestamp_micros', events[1])
+        self.assertEqual(self.ga.expired_hits, 1)
+
+    def test_04_raises_error_without_api_secret(self):
+        self.assertRaises(ValueError, GA4Backend, None)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for sharing a google.analytics.measurement_protocol tracker
+across threads."""
+
+from threading import Barrier, Thread
+import unittest
+from unittest import mock
+
+from google.analytics.measurement_protocol import GoogleAnalytics
+
+PROPERTY_ID = 'UA-12345-6'
+HOSTNAME = 'domain.com'
+THREADS = 8
+HITS = 50
+
+def sent_payloads(post):
+    return [call[1]['data'] for call in post.call_args_list]
+
+class SharePageAcrossThreads(unittest.TestCase):
+    """Tests for page and hostname kept per thread."""
+
+    def setUp(self):
+        self.ga = GoogleAnalytics(PROPERTY_ID)
+
+    def test_01_events_get_page_of_own_thread(self):
+        barrier = Barrier(THREADS)
+
+        def run(number):
+            page = '/page-{}'.format(number)
+            barrier.wait()
+            for _ in range(HITS):
+                self.ga.send_pageview(page, HOSTNAME)
+                self.ga.send_event('thread', 'run', page)
+
+        with mock.patch('requests.post') as post:
+            threads = [Thread(target=run, args=(n,)) for n in range(THREADS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        events = [data for data in sent_payloads(post) if data['t'] == 'event']
+        self.assertEqual(len(events), THREADS * HITS)
+        for data in events:
+            self.assertEqual(data['dp'], data['el'])
+
+    def test_02_page_is_not_seen_by_other_threads(self):
+        with mock.patch('requests.post'):
+            self.ga.send_pageview('/main', HOSTNAME)
+
+        pages = []
+        thread = Thread(target=lambda: pages.append(self.ga.page))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(self.ga.page, '/main')
+        self.assertEqual(pages, [None])
+
+class ShareConfigAcrossThreads(unittest.TestCase):
+    """Tests for set() while other threads send hits."""
+
+    def setUp(self):
+        self.ga = GoogleAnalytics(PROPERTY_ID)
+
+    def test_01_hits_get_whole_config_changes(self):
+        running = [True]
+
+        def change():
+            number = 0
+            while running[0]:
+                number += 1
+                self.ga.set(
+                    user_id='user-{}'.format(number),
+                    custom_dimensions={'1': 'user-{}'.format(number)},
+                )
+
+        with mock.patch('requests.post') as post:
+            thread = Thread(target=change)
+            thread.start()
+            for _ in range(500):
+                self.ga.send_event('config', 'read')
+            running[0] = False
+            thread.join()
+
+        for data in sent_payloads(post):
+            self.assertEqual(data.get('uid'), data.get('cd1'))
+
+    def test_02_trackers_do_not_share_custom_definitions(self):
+        self.ga.set(custom_dimensions={'1': 'foo'})
+        other = GoogleAnalytics(PROPERTY_ID)
+        self.assertEqual(other.custom_dimensions, {})
+
+    def test_03_per_hit_custom_dimensions_leave_config_unchanged(self):
+        self.ga.set(custom_dimensions={'1': 'foo'})
+        with mock.patch('requests.post') as post:
+            self.ga.send_event('config', 'read', custom_dimensions={'1': None})
+            self.ga.send_event('config', 'read')
+
+        payloads = sent_payloads(post)
+        self.assertNotIn('cd1', payloads[0])
+        self.assertEqual(payloads[1]['cd1'], 'foo')
+
+class EndSessionAcrossThreads(unittest.TestCase):
+    """Tests for end_session() with hits from several threads."""
+
+    def test_01_only_one_hit_ends_session(self):
+        ga = GoogleAnalytics(PROPERTY_ID)
+        ga.end_session()
+        ga.end_session()
+
+        with mock.patch('requests.post') as post:
+            threads = [
+                Thread(target=ga.send_event, args=('session', 'end'))
+                for _ in range(THREADS)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        ended = [data for data in sent_payloads(post) if data.get('sc') == 'end']
+        self.assertEqual(len(ended), 1)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
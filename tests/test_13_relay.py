@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.relay's RelayClient and RelayServer."""
+
+from threading import Thread
+from urllib.parse import parse_qs
+import os
+import socket
+import tempfile
+import unittest
+
+from google.analytics.hit import Hit
+from google.analytics.measurement_protocol import (
+    GA_BATCH_ENDPOINT,
+    GoogleAnalytics,
+)
+from google.analytics.relay import RelayClient, RelayServer, parse_address
+from google.analytics.sender import HitBuffer, QueuedSender
+
+from .helpers import RecordingTransport
+
+PROPERTY_ID = 'UA-12345-6'
+
+class ParseRelayAddress(unittest.TestCase):
+    """Tests for parse_address()."""
+
+    def test_01_unix_socket_path(self):
+        self.assertEqual(
+            parse_address('/run/ga-relay.sock'),
+            (socket.AF_UNIX, '/run/ga-relay.sock'),
+        )
+
+    def test_02_udp_port(self):
+        self.assertEqual(
+            parse_address('127.0.0.1:8126'),
+            (socket.AF_INET, ('127.0.0.1', 8126)),
+        )
+        self.assertEqual(
+            parse_address(':8126'),
+            (socket.AF_INET, ('127.0.0.1', 8126)),
+        )
+
+    def test_03_raises_error_with_bad_port(self):
+        self.assertRaises(ValueError, parse_address, 'localhost:port')
+
+class LingerHitBuffer(unittest.TestCase):
+    """Tests for HitBuffer.get_batch() with linger."""
+
+    def test_01_waits_for_batch_to_fill(self):
+        buffer = HitBuffer()
+        buffer.put(Hit('n=0'))
+
+        def fill():
+            for number in range(1, 20):
+                buffer.put(Hit('n={}'.format(number)))
+
+        thread = Thread(target=fill)
+        thread.start()
+        batch = buffer.get_batch(timeout=1.0, linger=5.0)
+        thread.join()
+        self.assertEqual(len(batch), 20)
+
+    def test_02_returns_partial_batch_after_linger(self):
+        buffer = HitBuffer()
+        buffer.put(Hit('n=0'))
+        self.assertEqual(len(buffer.get_batch(linger=0.05)), 1)
+
+class RelayHits(unittest.TestCase):
+    """Tests for relaying hits from a tracker."""
+
+    def setUp(self):
+        self.transport = RecordingTransport()
+        self.sender = QueuedSender(transport=self.transport, linger=0.2)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.close(5)
+        self.client.close()
+
+    def relay(self, address):
+        self.server = RelayServer(address, self.sender)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def assert_relayed(self, hits, received=None):
+        self.server.stop()
+        self.thread.join(5)
+        self.assertTrue(self.sender.flush(5))
+        self.assertEqual(self.server.received, hits if received is None else received)
+        self.assertEqual(len(self.transport.posts), 1)
+        endpoint, body = self.transport.posts[0]
+        self.assertEqual(endpoint, GA_BATCH_ENDPOINT)
+        events = [parse_qs(line) for line in body.split('\n')]
+        self.assertEqual(len(events), hits)
+        self.assertEqual(events[0]['tid'], [PROPERTY_ID])
+
+    def test_01_unix_socket(self):
+        path = os.path.join(self.directory, 'relay.sock')
+        self.relay(path)
+        self.client = RelayClient(path)
+        ga = GoogleAnalytics(PROPERTY_ID, sender=self.client)
+        for number in range(10):
+            ga.send_event('relay', 'unix', str(number))
+        self.assertEqual(self.client.stats()['sent'], 10)
+        self.assert_relayed(10)
+
+    def test_02_udp(self):
+        self.relay('127.0.0.1:0')
+        host, port = self.server.address
+        self.client = RelayClient('{}:{}'.format(host, port))
+        ga = GoogleAnalytics(PROPERTY_ID, sender=self.client)
+        for number in range(5):
+            ga.send_event('relay', 'udp', str(number))
+        self.assert_relayed(5)
+
+    def test_03_removes_socket_on_close(self):
+        path = os.path.join(self.directory, 'relay.sock')
+        self.relay(path)
+        self.client = RelayClient(path)
+        self.server.close(5)
+        self.assertFalse(os.path.exists(path))
+
+    def test_04_drops_malformed_datagrams_and_keeps_serving(self):
+        path = os.path.join(self.directory, 'relay.sock')
+        self.relay(path)
+        self.client = RelayClient(path)
+        raw = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        raw.sendto(b'\xff\xfe not utf-8', path)
+        raw.sendto(b'not a hit', path)
+        raw.sendto(b'v=1&ec=no-type', path)
+        raw.close()
+        ga = GoogleAnalytics(PROPERTY_ID, sender=self.client)
+        for number in range(3):
+            ga.send_event('relay', 'after', str(number))
+        self.assert_relayed(3, received=6)
+        self.assertEqual(self.server.malformed, 3)
+        self.assertFalse(self.thread.is_alive())
+
+class RelayClientWithoutRelay(unittest.TestCase):
+    """Tests for RelayClient when no relay is running."""
+
+    def test_01_drops_without_raising(self):
+        path = os.path.join(tempfile.mkdtemp(), 'missing.sock')
+        client = RelayClient(path)
+        self.assertFalse(client.send(Hit('v=1&t=event')))
+        self.assertEqual(client.stats()['dropped'], 1)
+        self.assertTrue(client.flush())
+        client.close()
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
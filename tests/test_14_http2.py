@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.transport's HTTP2Transport and for
+selecting a transport in GoogleAnalytics."""
+
+from threading import Thread
+from urllib.parse import parse_qs
+import unittest
+from unittest import mock
+
+from google.analytics.measurement_protocol import (
+    GA_BATCH_ENDPOINT,
+    GA_ENDPOINT,
+    GoogleAnalytics,
+)
+from google.analytics.transport import HTTP2Transport, httpx
+
+from .helpers import RecordingTransport
+from .stub_server import HTTP2StubServer, h2
+
+PROPERTY_ID = 'UA-12345-6'
+ROLLUP_PROPERTY_ID = 'UA-12345-7'
+
+class SelectTransport(unittest.TestCase):
+    """Tests for GoogleAnalytics with a transport."""
+
+    def test_01_posts_encoded_hit_with_transport(self):
+        transport = RecordingTransport()
+        ga = GoogleAnalytics(PROPERTY_ID, transport=transport)
+        with mock.patch('requests.post') as post:
+            ga.send_event('transport', 'select')
+        post.assert_not_called()
+
+        self.assertEqual(len(transport.posts), 1)
+        endpoint, body = transport.posts[0]
+        self.assertEqual(endpoint, GA_ENDPOINT)
+        self.assertEqual(parse_qs(body)['tid'], [PROPERTY_ID])
+        self.assertEqual(parse_qs(body)['ea'], ['select'])
+
+    def test_02_posts_copies_in_one_batch(self):
+        transport = RecordingTransport()
+        ga = GoogleAnalytics(
+            [PROPERTY_ID, ROLLUP_PROPERTY_ID],
+            transport=transport,
+        )
+        ga.send_event('transport', 'select')
+
+        endpoint, body = transport.posts[0]
+        self.assertEqual(endpoint, GA_BATCH_ENDPOINT)
+        self.assertEqual(len(body.split('\n')), 2)
+
+class MissingHTTP2(unittest.TestCase):
+    """Tests for HTTP2Transport without httpx."""
+
+    def test_01_raises_import_error(self):
+        with mock.patch('google.analytics.transport.httpx', None):
+            self.assertRaises(ImportError, HTTP2Transport)
+
+@unittest.skipIf(httpx is None or h2 is None, 'needs httpx[http2]')
+class MultiplexHTTP2(unittest.TestCase):
+    """Tests for HTTP2Transport against a local HTTP/2 stub."""
+
+    def setUp(self):
+        self.server = HTTP2StubServer(delay=0.2).start()
+        # prior knowledge, because the stub does not speak TLS
+        self.transport = HTTP2Transport(
+            timeout=5,
+            client=httpx.Client(http1=False, http2=True),
+        )
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+
+    def test_01_posts_body(self):
+        status = self.transport.post(self.server.url + '/collect', 'v=1&t=event')
+        self.assertEqual(status, 200)
+        self.assertEqual(self.server.requests, [('/collect', 'v=1&t=event')])
+
+    def test_02_multiplexes_concurrent_requests(self):
+        statuses = []
+
+        def post(number):
+            statuses.append(self.transport.post(
+                self.server.url + '/batch',
+                'v=1&t=event&el={}'.format(number),
+            ))
+
+        threads = [Thread(target=post, args=(n,)) for n in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * 10)
+        self.assertEqual(self.server.connections, 1)
+        self.assertGreater(self.server.max_open_streams, 1)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.definitions' DefinitionRegistry."""
+
+import unittest
+from unittest import mock
+
+from google.analytics.definitions import DefinitionRegistry
+from google.analytics.measurement_protocol import GoogleAnalytics
+
+PROPERTY_ID = 'UA-12345-6'
+
+def make_registry():
+    registry = DefinitionRegistry()
+    registry.dimension('plan', 3, scope='user')
+    registry.dimension('experiment', 4)
+    registry.metric('basket_value', 1, metric_type='currency')
+    registry.metric('items', 2)
+    return registry
+
+class DeclareDefinitions(unittest.TestCase):
+    """Tests for declaring definitions."""
+
+    def setUp(self):
+        self.registry = make_registry()
+
+    def test_01_resolves_names_to_keys(self):
+        self.assertEqual(
+            self.registry.resolve({'plan': 'pro', 'basket_value': 9.5}),
+            {'cd3': 'pro', 'cm1': 9.5},
+        )
+
+    def test_02_raises_error_with_duplicate_name_or_index(self):
+        self.assertRaises(ValueError, self.registry.dimension, 'plan', 5)
+        self.assertRaises(ValueError, self.registry.dimension, 'tier', 3)
+
+    def test_03_raises_error_with_bad_declaration(self):
+        self.assertRaises(ValueError, self.registry.dimension, 'tier', 201)
+        self.assertRaises(ValueError, self.registry.dimension, 'tier', 5, 'page')
+        self.assertRaises(ValueError, self.registry.metric, 'cost', 5, metric_type='money')
+
+    def test_04_raises_error_with_unknown_name(self):
+        self.assertRaises(ValueError, self.registry.resolve, {'tier': 'gold'})
+
+    def test_05_validates_values(self):
+        self.assertRaises(ValueError, self.registry.resolve, {'items': 1.5})
+        self.assertRaises(ValueError, self.registry.resolve, {'basket_value': '9.5'})
+        self.assertRaises(ValueError, self.registry.resolve, {'plan': 3})
+        self.assertRaises(ValueError, self.registry.resolve, {'plan': 'x' * 151})
+
+    def test_06_parameter_names(self):
+        self.assertEqual(self.registry.parameter_names()['cd3'], 'plan')
+
+class SendNamedDefinitions(unittest.TestCase):
+    """Tests for custom_definitions on a tracker."""
+
+    def setUp(self):
+        self.ga = GoogleAnalytics(PROPERTY_ID, definitions=make_registry())
+        self.ga.set(custom_definitions={'plan': 'pro', 'items': 2})
+
+    def send_event(self, **kwargs):
+        with mock.patch('requests.post') as post:
+            self.ga.send_event('basket', 'add', **kwargs)
+        return post.call_args[1]['data']
+
+    def test_01_set_merges_with_defaults(self):
+        self.assertEqual(self.ga.custom_dimensions, {'cd3': 'pro'})
+        self.assertEqual(self.ga.custom_metrics, {'cm2': 2})
+        data = self.send_event()
+        self.assertEqual(data['cd3'], 'pro')
+        self.assertEqual(data['cm2'], 2)
+
+    def test_02_per_hit_values_override_defaults(self):
+        data = self.send_event(custom_definitions={
+            'plan': 'free',
+            'items': None,
+            'basket_value': 9.5,
+        })
+        self.assertEqual(data['cd3'], 'free')
+        self.assertNotIn('cm2', data)
+        self.assertEqual(data['cm1'], 9.5)
+
+    def test_03_set_none_removes_default(self):
+        self.ga.set(custom_definitions={'plan': None})
+        self.assertEqual(self.ga.custom_dimensions, {})
+
+    def test_04_raises_error_without_definitions(self):
+        ga = GoogleAnalytics(PROPERTY_ID)
+        self.assertRaises(ValueError, ga.set, custom_definitions={'plan': 'pro'})
+        with mock.patch('requests.post'):
+            self.assertRaises(
+                ValueError,
+                ga.send_event,
+                'basket',
+                'add',
+                custom_definitions={'plan': 'pro'},
+            )
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
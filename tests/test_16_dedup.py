@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.dedup's DedupFilter and hit keys."""
+
+import os
+import tempfile
+import unittest
+
+from google.analytics.dedup import DedupFilter
+from google.analytics.hit import Hit
+from google.analytics.measurement_protocol import GoogleAnalytics
+from google.analytics.recorder import HitRecorder, resend
+from google.analytics.sender import QueuedSender
+
+from .helpers import RecordingTransport
+
+PROPERTY_ID = 'UA-12345-6'
+ROLLUP_PROPERTY_ID = 'UA-12345-7'
+
+class HitKey(unittest.TestCase):
+    """Tests for Hit.key."""
+
+    def test_01_property_id_and_cache_buster(self):
+        self.assertEqual(Hit('tid=UA-1&v=1&t=event&z=00ff').key, 'UA-1:00ff')
+
+    def test_02_none_without_cache_buster(self):
+        self.assertIsNone(Hit('tid=UA-1&v=1&t=event').key)
+
+    def test_03_copies_for_each_property_differ(self):
+        transport = RecordingTransport()
+        sender = QueuedSender(transport=transport)
+        sent = []
+        sender.send = sent.append
+        ga = GoogleAnalytics([PROPERTY_ID, ROLLUP_PROPERTY_ID], sender=sender)
+        ga.send_event('dedup', 'key')
+        ga.send_event('dedup', 'key')
+
+        keys = [hit.key for hit in sent]
+        self.assertEqual(len(set(keys)), 4)
+        self.assertTrue(keys[0].startswith(PROPERTY_ID + ':'))
+        self.assertEqual(keys[0].split(':')[1], keys[1].split(':')[1])
+
+class FilterDuplicates(unittest.TestCase):
+    """Tests for DedupFilter.seen()."""
+
+    def test_01_second_copy_is_duplicate(self):
+        dedup = DedupFilter()
+        self.assertFalse(dedup.seen('UA-1:a', now=0))
+        self.assertTrue(dedup.seen('UA-1:a', now=1))
+        self.assertFalse(dedup.seen('UA-1:b', now=1))
+        self.assertEqual(dedup.duplicates, 1)
+
+    def test_02_remembers_for_window_then_forgets(self):
+        dedup = DedupFilter(window=10)
+        dedup.rotated = 0
+        dedup.seen('UA-1:a', now=5)
+        self.assertTrue(dedup.seen('UA-1:a', now=14))
+        self.assertFalse(dedup.seen('UA-1:a', now=40))
+
+    def test_03_false_positive_rate(self):
+        dedup = DedupFilter(capacity=10000, error_rate=0.01)
+        for number in range(10000):
+            dedup.seen('UA-1:{}'.format(number), now=0)
+        false_positives = sum(
+            dedup.seen('UA-2:{}'.format(number), now=0)
+            for number in range(10000)
+        )
+        self.assertLess(false_positives / 10000.0, 0.02)
+
+    def test_04_memory_stays_flat(self):
+        dedup = DedupFilter(capacity=1000)
+        size = dedup.bytes
+        for number in range(20000):
+            dedup.seen('UA-1:{}'.format(number), now=0)
+        self.assertEqual(dedup.bytes, size)
+        self.assertLessEqual(dedup.current.count, 1000)
+
+    def test_05_contains_does_not_remember(self):
+        dedup = DedupFilter()
+        self.assertFalse(dedup.contains('UA-1:a', now=0))
+        self.assertFalse(dedup.contains('UA-1:a', now=1))
+        dedup.remember('UA-1:a', now=1)
+        self.assertTrue(dedup.contains('UA-1:a', now=2))
+
+    def test_06_raises_error_with_bad_arguments(self):
+        self.assertRaises(ValueError, DedupFilter, window=0)
+        self.assertRaises(ValueError, DedupFilter, capacity=0)
+        self.assertRaises(ValueError, DedupFilter, error_rate=1.0)
+
+class SendWithoutDuplicates(unittest.TestCase):
+    """Tests for QueuedSender with a DedupFilter."""
+
+    def test_01_drops_replayed_hit(self):
+        transport = RecordingTransport()
+        sender = QueuedSender(transport=transport, dedup=DedupFilter())
+        body = 'tid=UA-1&v=1&t=event&z=00ff'
+        self.assertTrue(sender.send(Hit(body)))
+        self.assertTrue(sender.flush(5))
+        self.assertFalse(sender.send(Hit(body)))
+        self.assertTrue(sender.flush(5))
+        self.assertEqual(transport.posts, [(transport.posts[0][0], body)])
+        self.assertEqual(sender.stats()['duplicates'], 1)
+
+    def test_02_resends_failed_hits(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        recorder = HitRecorder(directory.name, compress=False)
+        transport = RecordingTransport(status=None)
+        sender = QueuedSender(transport=transport, recorder=recorder, dedup=DedupFilter())
+        ga = GoogleAnalytics(PROPERTY_ID, sender=sender)
+        for number in range(3):
+            ga.send_event('menu', 'click', event_value=number)
+        self.assertTrue(ga.flush(timeout=5))
+        self.assertTrue(recorder.close(timeout=5))
+        self.assertEqual(sender.stats()['failed'], 3)
+
+        sender.recorder = None
+        transport.status = 200
+        archives = [os.path.join(directory.name, name) for name in os.listdir(directory.name)]
+        self.assertEqual(resend(archives, sender, statuses=[None]), 3)
+        self.assertTrue(sender.flush(5))
+        self.assertEqual(sender.stats()['sent'], 3)
+        self.assertEqual(sender.stats()['duplicates'], 0)
+
+        # sent now, so replaying them again drops them
+        self.assertEqual(resend(archives, sender), 0)
+        self.assertEqual(sender.stats()['duplicates'], 3)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
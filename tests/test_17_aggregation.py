@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.aggregation's EventAggregator."""
+
+from time import monotonic, sleep
+import unittest
+from unittest import mock
+
+from google.analytics.definitions import DefinitionRegistry
+from google.analytics.measurement_protocol import GoogleAnalytics
+
+PROPERTY_ID = 'UA-12345-6'
+
+def sent_payloads(post):
+    return [call[1]['data'] for call in post.call_args_list]
+
+class AggregateEvents(unittest.TestCase):
+    """Tests for send_event() with aggregate_events."""
+
+    def setUp(self):
+        self.ga = GoogleAnalytics(PROPERTY_ID, aggregate_events=True)
+
+    def tearDown(self):
+        with mock.patch('requests.post'):
+            self.ga.flush()
+
+    def test_01_merges_matching_events_until_flush(self):
+        with mock.patch('requests.post') as post:
+            for _ in range(1000):
+                self.ga.send_event('queue', 'processed', 'emails')
+            self.ga.send_event('queue', 'processed', 'emails', 5)
+            post.assert_not_called()
+            self.ga.flush()
+
+        payloads = sent_payloads(post)
+        self.assertEqual(len(payloads), 1)
+        self.assertEqual(payloads[0]['ev'], 1005)
+        self.assertEqual(payloads[0]['el'], 'emails')
+
+    def test_02_keeps_dimension_sets_apart(self):
+        with mock.patch('requests.post') as post:
+            for plan in ['free', 'pro', 'pro']:
+                self.ga.send_event(
+                    'queue',
+                    'processed',
+                    custom_dimensions={'1': plan},
+                    custom_metrics={'2': 1.5},
+                )
+            self.ga.flush()
+
+        totals = {data['cd1']: (data['ev'], data['cm2']) for data in sent_payloads(post)}
+        self.assertEqual(totals, {'free': (1, 1.5), 'pro': (2, 3.0)})
+
+    def test_03_sends_when_window_closes(self):
+        events = self.ga.events
+        start = events.window_start = monotonic()
+        with mock.patch('requests.post') as post:
+            events.record('queue', 'processed', now=start + 1)
+            events.record('queue', 'processed', now=start + 61)
+            self.assertTrue(events.worker.flush(5))
+        self.assertEqual(sent_payloads(post)[0]['ev'], 2)
+
+    def test_04_closes_quiet_window(self):
+        ga = GoogleAnalytics(PROPERTY_ID, aggregate_events=True, event_window=0.1)
+        with mock.patch('requests.post') as post:
+            ga.send_event('queue', 'processed')
+            ga.send_event('queue', 'processed')
+            post.assert_not_called()
+            # no event comes after the window
+            sleep(0.3)
+            self.assertTrue(ga.events.worker.flush(5))
+        self.assertEqual(len(sent_payloads(post)), 1)
+        self.assertEqual(sent_payloads(post)[0]['ev'], 2)
+        self.assertIsNone(ga.events.window_timer)
+
+    def test_05_aggregate_false_sends_now(self):
+        with mock.patch('requests.post') as post:
+            self.ga.send_event('queue', 'failed', aggregate=False)
+        self.assertEqual(len(sent_payloads(post)), 1)
+
+    def test_06_raises_error_with_bad_metric(self):
+        self.assertRaises(
+            ValueError,
+            self.ga.send_event,
+            'queue',
+            'processed',
+            custom_metrics={'1': 'many'},
+        )
+
+class AggregateNamedEvents(unittest.TestCase):
+    """Tests for aggregated events with custom_definitions."""
+
+    def test_01_sums_named_metrics(self):
+        definitions = DefinitionRegistry()
+        definitions.dimension('plan', 3)
+        definitions.metric('bytes', 1)
+        ga = GoogleAnalytics(PROPERTY_ID, definitions=definitions)
+
+        with mock.patch('requests.post') as post:
+            for _ in range(3):
+                ga.send_event(
+                    'upload',
+                    'done',
+                    custom_definitions={'plan': 'pro', 'bytes': 10},
+                    aggregate=True,
+                )
+            ga.flush()
+
+        data = sent_payloads(post)[0]
+        self.assertEqual((data['ev'], data['cd3'], data['cm1']), (3, 'pro', 30))
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
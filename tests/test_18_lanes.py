@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.lanes' LaneBuffer."""
+
+import unittest
+
+from google.analytics.hit import Hit
+from google.analytics.lanes import DEFAULT_LANES, Lane, LaneBuffer
+from google.analytics.sender import QueuedSender
+
+from .helpers import RecordingTransport, make_hit
+
+def lane_hit(hit_type, number=0):
+    return make_hit(number, 20, 't=' + hit_type, hit_type)
+
+class RouteLanes(unittest.TestCase):
+    """Tests for LaneBuffer.lane_of()."""
+
+    def setUp(self):
+        self.buffer = LaneBuffer()
+
+    def test_01_by_hit_type(self):
+        self.assertEqual(self.buffer.lane_of(lane_hit('exception')).name, 'high')
+        self.assertEqual(self.buffer.lane_of(lane_hit('event')).name, 'normal')
+        self.assertEqual(self.buffer.lane_of(lane_hit('pageview')).name, 'low')
+
+    def test_02_by_body_without_hit_type(self):
+        self.assertEqual(self.buffer.lane_of(Hit('v=1&t=exception&z=1')).name, 'high')
+
+    def test_03_lanes_are_not_shared(self):
+        self.buffer.put(lane_hit('pageview'))
+        self.assertEqual(len(DEFAULT_LANES[-1].hits), 0)
+
+class DrainLanes(unittest.TestCase):
+    """Tests for weighted draining."""
+
+    def test_01_batches_follow_weights(self):
+        buffer = LaneBuffer()
+        for number in range(100):
+            for hit_type in ['exception', 'event', 'pageview']:
+                buffer.put(lane_hit(hit_type, number))
+
+        batch = buffer.get_batch(max_hits=14, max_bytes=10000)
+        hit_types = [hit.hit_type for hit in batch]
+        self.assertEqual(hit_types.count('exception'), 8)
+        self.assertEqual(hit_types.count('event'), 4)
+        self.assertEqual(hit_types.count('pageview'), 2)
+
+    def test_02_empty_lanes_give_their_share(self):
+        buffer = LaneBuffer()
+        for number in range(30):
+            buffer.put(lane_hit('pageview', number))
+        self.assertEqual(len(buffer.get_batch()), 20)
+
+    def test_03_records_wait(self):
+        buffer = LaneBuffer()
+        hit = lane_hit('exception')
+        hit.created -= 0.5
+        buffer.put(hit)
+        buffer.get_batch()
+        stats = buffer.lane_stats()['high']
+        self.assertGreaterEqual(stats['wait_max_ms'], 500)
+
+class ShedLanes(unittest.TestCase):
+    """Tests for caps and shedding."""
+
+    def test_01_caps_each_lane(self):
+        buffer = LaneBuffer([
+            Lane('high', ['exception'], max_bytes=40, policy='drop-newest'),
+            Lane('low', max_bytes=40),
+        ])
+        for number in range(3):
+            buffer.put(lane_hit('exception', number))
+            buffer.put(lane_hit('pageview', number))
+        stats = buffer.lane_stats()
+        self.assertEqual(stats['high']['dropped_newest'], 1)
+        self.assertEqual(stats['low']['dropped_oldest'], 1)
+
+    def test_02_sheds_low_priority_first(self):
+        buffer = LaneBuffer(max_bytes=100)
+        for number in range(5):
+            buffer.put(lane_hit('pageview', number))
+        for number in range(3):
+            self.assertTrue(buffer.put(lane_hit('exception', number)))
+
+        stats = buffer.lane_stats()
+        self.assertEqual(stats['low']['shed'], 3)
+        self.assertEqual(stats['low']['queued_hits'], 2)
+        self.assertEqual(buffer.bytes, 100)
+
+    def test_03_does_not_shed_higher_priority(self):
+        buffer = LaneBuffer(max_bytes=60)
+        for number in range(3):
+            buffer.put(lane_hit('exception', number))
+        self.assertFalse(buffer.put(lane_hit('pageview')))
+        self.assertEqual(buffer.lane_stats()['low']['dropped_newest'], 1)
+
+class SendLanes(unittest.TestCase):
+    """Tests for QueuedSender with a LaneBuffer."""
+
+    def test_01_sends_and_reports_lanes(self):
+        transport = RecordingTransport()
+        sender = QueuedSender(transport=transport, buffer=LaneBuffer())
+        for number in range(5):
+            sender.send(lane_hit('exception', number))
+        self.assertTrue(sender.flush(5))
+        stats = sender.stats()
+        self.assertEqual(stats['sent'], 5)
+        self.assertEqual(stats['lanes']['high']['queued'], 5)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
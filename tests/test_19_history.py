@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for importing historical hits with google.analytics.history."""
+
+import os
+import tempfile
+import unittest
+from time import time
+from unittest import mock
+
+from google.analytics.history import DeadlineBuffer
+from google.analytics.hit import MAX_QUEUE_TIME, Hit, queue_time
+from google.analytics.measurement_protocol import GoogleAnalytics
+from google.analytics.recorder import HitRecorder, read_archive, resend
+from google.analytics.sender import HitBuffer, QueuedSender
+
+from .helpers import RecordingTransport, make_hit
+
+PROPERTY_ID = 'UA-12345-6'
+
+def aged_hit(number, age):
+    return make_hit(number, params='v=1&t=event', hit_type='event', timestamp=time() - age)
+
+class QueueTime(unittest.TestCase):
+    """Tests for Hit's queue time."""
+
+    def test_01_encodes_queue_time(self):
+        hit = Hit('v=1&t=event', timestamp=1000.0)
+        self.assertEqual(hit.encode(now=1002.5), 'v=1&t=event&qt=2500')
+
+    def test_02_without_timestamp(self):
+        hit = Hit('v=1&t=event')
+        self.assertEqual(hit.encode(), 'v=1&t=event')
+        self.assertFalse(hit.expired())
+
+    def test_03_never_negative(self):
+        self.assertEqual(queue_time(1000.0, now=999.0), 0)
+
+    def test_04_expires_after_4_hours(self):
+        self.assertFalse(aged_hit(1, MAX_QUEUE_TIME - 60).expired())
+        self.assertTrue(aged_hit(1, MAX_QUEUE_TIME + 60).expired())
+
+class OrderByDeadline(unittest.TestCase):
+    """Tests for DeadlineBuffer."""
+
+    def test_01_oldest_first(self):
+        buffer = DeadlineBuffer()
+        for number, age in enumerate([10, 3000, 60, 9000]):
+            buffer.put(aged_hit(number, age))
+        batch = buffer.get_batch(timeout=0)
+        self.assertEqual([hit.body[-3:] for hit in batch], ['n=3', 'n=1', 'n=2', 'n=0'])
+        self.assertEqual(buffer.bytes, 0)
+
+    def test_02_drops_expired_hits(self):
+        buffer = DeadlineBuffer()
+        buffer.put(aged_hit(1, MAX_QUEUE_TIME + 60))
+        buffer.put(aged_hit(2, 60))
+        batch = buffer.get_batch(timeout=0)
+        self.assertEqual([hit.body[-3:] for hit in batch], ['n=2'])
+        self.assertEqual(buffer.counters['expired'], 1)
+
+    def test_03_drop_newest_when_full(self):
+        buffer = DeadlineBuffer(max_bytes=40, policy='drop-newest')
+        self.assertTrue(buffer.put(aged_hit(1, 60)))
+        self.assertTrue(buffer.put(aged_hit(2, 60)))
+        self.assertFalse(buffer.put(aged_hit(3, 60)))
+        self.assertEqual(buffer.counters['dropped_newest'], 1)
+
+    def test_04_block_times_out_when_full(self):
+        buffer = DeadlineBuffer(max_bytes=40, block_timeout=0.05)
+        buffer.put(aged_hit(1, 60))
+        buffer.put(aged_hit(2, 60))
+        self.assertFalse(buffer.put(aged_hit(3, 60)))
+        self.assertEqual(buffer.counters['block_timeouts'], 1)
+
+    def test_05_raises_error_with_invalid_policy(self):
+        self.assertRaises(ValueError, DeadlineBuffer, policy='drop-oldest')
+
+class ImportHits(unittest.TestCase):
+    """Tests for sending hits with a timestamp."""
+
+    def test_01_queued_hits_get_queue_time_when_posted(self):
+        transport = RecordingTransport()
+        sender = QueuedSender(transport=transport, buffer=DeadlineBuffer())
+        ga = GoogleAnalytics(PROPERTY_ID, sender=sender)
+        ga.send_event('app', 'open', timestamp=time() - 60)
+        ga.send_event('app', 'open', timestamp=time() - MAX_QUEUE_TIME - 60)
+        self.assertTrue(ga.flush(timeout=5))
+
+        self.assertEqual(len(transport.posts), 1)
+        qt = int(transport.posts[0][1].rsplit('&qt=', 1)[1])
+        self.assertTrue(60000 <= qt < 70000)
+        self.assertEqual(sender.stats()['expired'], 1)
+
+    @mock.patch('requests.post')
+    def test_02_sent_hits_get_queue_time(self, mock_post):
+        ga = GoogleAnalytics(PROPERTY_ID)
+        ga.send_pageview('/', 'example.com', timestamp=time() - 5)
+        qt = mock_post.call_args[1]['data']['qt']
+        self.assertTrue(5000 <= qt < 15000)
+
+    @mock.patch('requests.post')
+    def test_03_drops_expired_hits(self, mock_post):
+        ga = GoogleAnalytics(PROPERTY_ID)
+        ga.send_pageview('/', 'example.com', timestamp=time() - MAX_QUEUE_TIME - 60)
+        self.assertFalse(mock_post.called)
+        self.assertEqual(ga.expired_hits, 1)
+
+    @mock.patch('requests.post')
+    def test_04_timestamped_events_are_not_aggregated(self, mock_post):
+        ga = GoogleAnalytics(PROPERTY_ID, aggregate_events=True)
+        ga.send_event('app', 'open', timestamp=time() - 5)
+        self.assertTrue(mock_post.called)
+
+    def test_05_raises_error_with_invalid_timestamp(self):
+        ga = GoogleAnalytics(PROPERTY_ID)
+        self.assertRaises(ValueError, ga.send_pageview, '/', 'example.com', timestamp='yesterday')
+
+    def test_06_archives_keep_timestamp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        recorder = HitRecorder(directory.name, compress=False)
+        timestamp = time() - 60
+        recorder.record([Hit('v=1&t=event', timestamp=timestamp)], None)
+        recorder.close(timeout=5)
+
+        paths = [os.path.join(directory.name, name) for name in os.listdir(directory.name)]
+        self.assertEqual(list(read_archive(paths))[0]['timestamp'], timestamp)
+
+        transport = RecordingTransport()
+        sender = QueuedSender(transport=transport)
+        self.assertEqual(resend(paths, sender), 1)
+        self.assertTrue(sender.flush(timeout=5))
+        self.assertIn('&qt=', transport.posts[0][1])
+
+class SpillHits(unittest.TestCase):
+    """Tests for historical hits in HitBuffer's spill file."""
+
+    def test_01_spilled_hits_keep_timestamp(self):
+        directory = tempfile.mkdtemp()
+        buffer = HitBuffer(
+            max_bytes=20,
+            policy='spill',
+            spill_path=os.path.join(directory, 'spill'),
+        )
+        try:
+            # fill the memory queue, so that the next hits spill
+            self.assertTrue(buffer.put(Hit('v=1&t=event&n=0')))
+            hit = Hit('v=1&t=event&n=1', 'event', '555.1', timestamp=time() - 5 * 3600)
+            self.assertTrue(buffer.put(hit))
+            self.assertEqual(buffer.counters['spilled'], 1)
+            self.assertEqual(len(buffer.get_batch()), 1)
+            spilled, = buffer.get_batch()
+            self.assertEqual(spilled.body, hit.body)
+            self.assertEqual(spilled.hit_type, 'event')
+            self.assertEqual(spilled.client_id, '555.1')
+            self.assertEqual(spilled.timestamp, hit.timestamp)
+            self.assertTrue(spilled.expired())
+
+            buffer.put(Hit('v=1&t=event&n=2'))
+            buffer.put(Hit('v=1&t=event&n=3', timestamp=time() - 60))
+            buffer.get_batch()
+            self.assertIn('&qt=6', buffer.get_batch()[0].encode())
+        finally:
+            buffer.spill.close()
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for sending columnar data with google.analytics.bulk."""
+
+import unittest
+from time import time
+from urllib.parse import parse_qs
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+from google.analytics.bulk import encode_columns, pack_batches
+from google.analytics.definitions import DefinitionRegistry
+from google.analytics.hit import MAX_QUEUE_TIME, Hit
+from google.analytics.measurement_protocol import GoogleAnalytics
+from google.analytics.sender import QueuedSender
+
+from .helpers import RecordingTransport
+
+PROPERTY_ID = 'UA-12345-6'
+
+COLUMNS = {
+    'category': ['menu', 'menu', 'search'],
+    'action': ['click', 'open', 'query & more'],
+    'value': [1, None, 3.0],
+    'user': ['a', 'b', 'c'],
+}
+
+MAPPING = {
+    'category': 'ec',
+    'action': 'ea',
+    'value': 'ev',
+    'user': 'cid',
+}
+
+class NA(object):
+    """Missing value that behaves like pandas.NA in comparisons."""
+
+    def __ne__(self, other):
+        return self
+
+    def __eq__(self, other):
+        return self
+
+    def __hash__(self):
+        return id(self)
+
+    def __bool__(self):
+        raise TypeError('boolean value of NA is ambiguous')
+
+def parse(hit):
+    return {key: values[0] for key, values in parse_qs(hit.body).items()}
+
+class EncodeColumns(unittest.TestCase):
+    """Tests for encode_columns()."""
+
+    def test_01_one_hit_per_row(self):
+        hits = list(encode_columns({'v': 1, 'tid': PROPERTY_ID}, COLUMNS, MAPPING))
+        self.assertEqual(len(hits), 3)
+        first, second, third = [parse(hit) for hit in hits]
+        self.assertEqual(first['tid'], PROPERTY_ID)
+        self.assertEqual(first['t'], 'event')
+        self.assertEqual(first['ev'], '1')
+        self.assertNotIn('ev', second)
+        self.assertEqual(third['ea'], 'query & more')
+        self.assertEqual(third['ev'], '3')
+        self.assertEqual(third['cid'], 'c')
+        self.assertEqual(hits[2].client_id, 'c')
+        self.assertNotEqual(first['z'], second['z'])
+
+    def test_02_skips_rows_without_required_values(self):
+        counters = {}
+        columns = dict(COLUMNS, action=['click', None, float('nan')])
+        hits = list(encode_columns({}, columns, MAPPING, counters=counters))
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(counters['missing'], 2)
+
+    def test_03_raises_error_with_invalid_column_type(self):
+        columns = dict(COLUMNS, value=[1, 'two', 3])
+        self.assertRaises(ValueError, encode_columns, {}, columns, MAPPING)
+
+    def test_04_raises_error_with_missing_required_column(self):
+        self.assertRaises(ValueError, encode_columns, {}, COLUMNS, {'category': 'ec'})
+
+    def test_05_raises_error_with_missing_column(self):
+        mapping = dict(MAPPING, label='el')
+        self.assertRaises(ValueError, encode_columns, {}, COLUMNS, mapping)
+
+    def test_06_named_definitions(self):
+        definitions = DefinitionRegistry()
+        definitions.dimension('plan', 3)
+        columns = dict(COLUMNS, plan=['pro', 'free', 'pro'])
+        mapping = dict(MAPPING, plan='plan')
+        hits = list(encode_columns({}, columns, mapping, definitions=definitions))
+        self.assertEqual(parse(hits[0])['cd3'], 'pro')
+
+    def test_07_timestamps(self):
+        counters = {}
+        now = time()
+        columns = dict(COLUMNS, time=[now - 60, None, now - MAX_QUEUE_TIME - 60])
+        mapping = dict(MAPPING, time='timestamp')
+        hits = list(encode_columns({}, columns, mapping, counters=counters))
+        self.assertEqual(len(hits), 2)
+        self.assertEqual(hits[0].timestamp, now - 60)
+        self.assertIsNone(hits[1].timestamp)
+        self.assertEqual(counters['expired'], 1)
+
+    def test_08_na_is_missing(self):
+        counters = {}
+        columns = dict(COLUMNS, action=['click', NA(), 'query'], value=[1, NA(), 3])
+        hits = list(encode_columns({}, columns, MAPPING, counters=counters))
+        self.assertEqual(len(hits), 2)
+        self.assertEqual(counters['missing'], 1)
+
+    @unittest.skipIf(pandas is None, 'needs pandas')
+    def test_09_nullable_integer_column(self):
+        frame = pandas.DataFrame(COLUMNS)
+        frame['value'] = pandas.array([1, None, 3], dtype='Int64')
+        hits = [parse(hit) for hit in encode_columns({}, frame, MAPPING)]
+        self.assertEqual(len(hits), 3)
+        self.assertEqual(hits[0]['ev'], '1')
+        self.assertNotIn('ev', hits[1])
+
+class PackBatches(unittest.TestCase):
+    """Tests for pack_batches()."""
+
+    def test_01_packs_by_count_and_bytes(self):
+        hits = [Hit('v=1&n={}'.format(number)) for number in range(45)]
+        batches = list(pack_batches(hits))
+        self.assertEqual([batch.count('\n') + 1 for batch in batches], [20, 20, 5])
+
+        batches = list(pack_batches(hits, max_bytes=50))
+        self.assertTrue(all(len(batch) <= 50 for batch in batches))
+
+class SendColumns(unittest.TestCase):
+    """Tests for GoogleAnalytics.send_columns()."""
+
+    @mock.patch('requests.post')
+    def test_01_posts_batches(self, mock_post):
+        ga = GoogleAnalytics(PROPERTY_ID)
+        ga.set(custom_dimensions={'1': 'bulk'})
+        columns = {key: values * 10 for key, values in COLUMNS.items()}
+        counters = ga.send_columns(columns, MAPPING)
+        self.assertEqual(counters['hits'], 30)
+        self.assertEqual(mock_post.call_count, 2)
+        body = mock_post.call_args_list[0][1]['data']
+        self.assertIn('tid=UA-12345-6&', body)
+        self.assertIn('cd1=bulk', body)
+
+    def test_02_queues_hits_with_sender(self):
+        transport = RecordingTransport()
+        sender = QueuedSender(transport=transport)
+        ga = GoogleAnalytics(PROPERTY_ID, sender=sender)
+        self.assertEqual(ga.send_columns(COLUMNS, MAPPING)['hits'], 3)
+        self.assertTrue(ga.flush(timeout=5))
+        self.assertEqual(sum(body.count('\n') + 1 for _, body in transport.posts), 3)
+
+    def test_03_raises_error_in_debug_mode(self):
+        ga = GoogleAnalytics(PROPERTY_ID, debug=True)
+        self.assertRaises(ValueError, ga.send_columns, COLUMNS, MAPPING)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
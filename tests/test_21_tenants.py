@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.tenants' TenantBuffer and TrackerManager."""
+
+import unittest
+
+from google.analytics.tenants import Tenant, TenantBuffer, TrackerManager
+
+from .helpers import RecordingTransport, make_hit
+
+def drain(buffer, batches, **kwargs):
+    return [
+        {hit.body.split('&')[0][4:] for hit in buffer.get_batch(timeout=0, **kwargs)}.pop()
+        for _ in range(batches)
+    ]
+
+def tenant_hit(property_id, number=0):
+    return make_hit(number, 100, 'tid={}&v=1'.format(property_id))
+
+class QueueByTenant(unittest.TestCase):
+    """Tests for TenantBuffer.put()."""
+
+    def test_01_adds_tenants_on_first_hit(self):
+        buffer = TenantBuffer()
+        buffer.put(tenant_hit('UA-1-1'))
+        buffer.put(tenant_hit('UA-2-1'))
+        self.assertEqual(sorted(buffer.tenants), ['UA-1-1', 'UA-2-1'])
+        self.assertEqual(len(buffer), 2)
+
+    def test_02_noisy_tenant_drops_its_own_hits(self):
+        buffer = TenantBuffer(default_max_bytes=1000)
+        buffer.put(tenant_hit('UA-2-1'))
+        for number in range(50):
+            buffer.put(tenant_hit('UA-1-1', number))
+        stats = buffer.tenant_stats()
+        self.assertEqual(stats['UA-1-1']['queued_bytes'], 1000)
+        self.assertEqual(stats['UA-1-1']['dropped_oldest'], 40)
+        self.assertEqual(stats['UA-2-1']['queued_hits'], 1)
+
+    def test_03_sheds_largest_tenant_when_full(self):
+        buffer = TenantBuffer(max_bytes=1000)
+        for number in range(9):
+            buffer.put(tenant_hit('UA-1-1', number))
+        buffer.put(tenant_hit('UA-2-1'))
+        buffer.put(tenant_hit('UA-2-1'))
+        stats = buffer.tenant_stats()
+        self.assertEqual(stats['UA-1-1']['shed'], 1)
+        self.assertEqual(stats['UA-2-1']['queued_hits'], 2)
+
+    def test_04_raises_error_with_invalid_scheduling(self):
+        self.assertRaises(ValueError, TenantBuffer, scheduling='fifo')
+
+class ScheduleTenants(unittest.TestCase):
+    """Tests for TenantBuffer.get_batch()."""
+
+    def fill(self, buffer):
+        for number in range(200):
+            buffer.put(tenant_hit('UA-1-1', number))
+            buffer.put(tenant_hit('UA-2-1', number))
+
+    def test_01_batches_hold_one_tenant(self):
+        buffer = TenantBuffer()
+        self.fill(buffer)
+        batch = buffer.get_batch(timeout=0)
+        self.assertEqual(len(batch), 20)
+        self.assertEqual(len({hit.body[:10] for hit in batch}), 1)
+
+    def test_02_drr_shares_bytes_by_weight(self):
+        buffer = TenantBuffer(quantum=1010)
+        buffer.add_tenant(Tenant('UA-1-1', weight=3, max_bytes=10**6))
+        buffer.add_tenant(Tenant('UA-2-1', weight=1, max_bytes=10**6))
+        self.fill(buffer)
+        taken = {'UA-1-1': 0, 'UA-2-1': 0}
+        # two rounds: 30 hits of UA-1-1 in 2 batches, 10 of UA-2-1 in 1
+        for _ in range(6):
+            for hit in buffer.get_batch(timeout=0):
+                taken[hit.body.split('&')[0][4:]] += 1
+        self.assertEqual(taken, {'UA-1-1': 60, 'UA-2-1': 20})
+
+    def test_03_wrr_shares_batches_by_weight(self):
+        buffer = TenantBuffer(scheduling='wrr')
+        buffer.add_tenant(Tenant('UA-1-1', weight=2, max_bytes=10**6))
+        buffer.add_tenant(Tenant('UA-2-1', weight=1, max_bytes=10**6))
+        self.fill(buffer)
+        tenants = drain(buffer, 6)
+        self.assertEqual(tenants.count('UA-1-1'), 4)
+        self.assertEqual(tenants.count('UA-2-1'), 2)
+
+    def test_04_idle_tenants_give_their_turns(self):
+        buffer = TenantBuffer()
+        buffer.add_tenant(Tenant('UA-2-1'))
+        for number in range(60):
+            buffer.put(tenant_hit('UA-1-1', number))
+        self.assertEqual(drain(buffer, 3), ['UA-1-1'] * 3)
+        self.assertEqual(buffer.tenants['UA-2-1'].deficit, 0)
+
+class ManageTrackers(unittest.TestCase):
+    """Tests for TrackerManager."""
+
+    def test_01_trackers_share_one_sender(self):
+        transport = RecordingTransport()
+        manager = TrackerManager(transport=transport, connections=2)
+        manager.add_tenant('UA-1-1', weight=2)
+        first = manager.tracker('UA-1-1', client_id='a')
+        second = manager.tracker('UA-2-1', client_id='b')
+        self.assertIs(first.sender, second.sender)
+
+        for number in range(30):
+            first.send_event('menu', 'click', event_value=number)
+            second.send_event('menu', 'click', event_value=number)
+        self.assertTrue(manager.flush(timeout=5))
+
+        stats = manager.stats()
+        self.assertEqual(stats['sent'], 60)
+        self.assertEqual(stats['tenants']['UA-1-1']['queued'], 30)
+        for _, body in transport.posts:
+            self.assertEqual(len({line.split('&')[0] for line in body.split('\n')}), 1)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.green's GreenSender under gevent."""
+
+from weakref import WeakSet
+import time
+import unittest
+from unittest import mock
+
+from google.analytics import lifecycle
+from google.analytics.green import GreenSender, gevent
+from google.analytics.hit import Hit
+from google.analytics.measurement_protocol import GoogleAnalytics
+
+PROPERTY_ID = 'UA-12345-6'
+
+class SlowTransport(object):
+    """Transport that blocks like a real request, and records posts."""
+
+    def __init__(self, delay=0.005):
+        self.delay = delay
+        self.posts = []
+
+    def post(self, endpoint, body, timeout=None):
+        time.sleep(self.delay) # not monkey-patched, so it blocks its thread
+        self.posts.append((endpoint, body))
+        return 200
+
+    def hits(self):
+        return sum(body.count('\n') + 1 for _, body in self.posts)
+
+@unittest.skipIf(gevent is None, 'needs gevent')
+class SendFromGreenlets(unittest.TestCase):
+    """Tests for GreenSender with many greenlets."""
+
+    def test_01_thousands_of_greenlets_do_not_stall_the_hub(self):
+        transport = SlowTransport()
+        sender = GreenSender(
+            'gevent',
+            max_bytes=8 * 1024 * 1024,
+            transport=transport,
+            workers=8,
+        )
+        ga = GoogleAnalytics(PROPERTY_ID, sender=sender)
+
+        gaps = []
+        def tick():
+            last = time.monotonic()
+            for _ in range(40):
+                gevent.sleep(0.005)
+                now = time.monotonic()
+                gaps.append(now - last)
+                last = now
+
+        def user(number):
+            for value in range(5):
+                ga.send_event('green', 'click', event_value=value)
+                gevent.sleep(0)
+
+        ticker = gevent.spawn(tick)
+        gevent.joinall([gevent.spawn(user, number) for number in range(2000)])
+        self.assertTrue(sender.flush(timeout=30))
+        ticker.join()
+
+        self.assertEqual(transport.hits(), 10000)
+        self.assertEqual(sender.stats()['sent'], 10000)
+        self.assertLess(max(gaps), 0.25)
+
+    def test_02_drop_newest_when_full(self):
+        sender = GreenSender('gevent', max_bytes=40, transport=SlowTransport())
+        self.assertTrue(sender.send(Hit('v=1&n=1'.ljust(20, 'x'))))
+        self.assertTrue(sender.send(Hit('v=1&n=2'.ljust(20, 'x'))))
+        self.assertFalse(sender.send(Hit('v=1&n=3'.ljust(20, 'x'))))
+        self.assertEqual(sender.stats()['dropped_newest'], 1)
+        self.assertTrue(sender.flush(timeout=5))
+
+    def test_03_linger_fills_batches(self):
+        transport = SlowTransport(delay=0)
+        sender = GreenSender('gevent', transport=transport, workers=1, linger=0.2)
+        for number in range(20):
+            sender.send(Hit('v=1&n={}'.format(number)))
+            gevent.sleep(0.001)
+        self.assertTrue(sender.flush(timeout=5))
+        self.assertEqual(len(transport.posts), 1)
+        self.assertEqual(transport.hits(), 20)
+
+    def test_04_flush_all_posts_from_its_thread(self):
+        patcher = mock.patch.object(lifecycle, '_registry', WeakSet())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        transport = SlowTransport(delay=0)
+        sender = GreenSender('gevent', transport=transport)
+        for number in range(50):
+            sender.send(Hit('v=1&n={}'.format(number)))
+
+        # the workers' hub does not run while this thread waits
+        started = time.monotonic()
+        self.assertTrue(lifecycle.flush_all(timeout=3))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(transport.hits(), 50)
+        self.assertEqual(sender.stats()['sent'], 50)
+        self.assertEqual(sender.stats()['queued_hits'], 0)
+
+    def test_05_raises_error_with_invalid_library(self):
+        self.assertRaises(ValueError, GreenSender, 'asyncio')
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.transport's HedgedTransport and request
+timeouts."""
+
+from time import monotonic, sleep
+import unittest
+from unittest import mock
+
+from google.analytics.measurement_protocol import GoogleAnalytics
+from google.analytics.transport import (
+    DEFAULT_TIMEOUT,
+    HedgedTransport,
+    RequestsTransport,
+)
+
+from .stub_server import HTTP1StubServer
+
+PROPERTY_ID = 'UA-12345-6'
+
+class Response(object):
+    status_code = 200
+
+class SleepingTransport(object):
+    """Pooled transport that answers after the delay of a shared list
+            instead of posting, or after slow_delay the first time that a
+            body of the shared slow set is posted."""
+
+    def __init__(self, delays, timeout=None, slow=None, slow_delay=1.0):
+        self.delays = delays
+        self.slow = set() if slow is None else slow
+        self.slow_delay = slow_delay
+
+    def request(self, endpoint, body, timeout=None, content_type=None):
+        try:
+            self.slow.remove(body)
+            delay = self.slow_delay
+        except KeyError:
+            delay = self.delays[0] if self.delays else 0
+        if delay:
+            sleep(delay)
+        return Response()
+
+    def close(self):
+        pass
+
+def p99(latencies):
+    latencies = sorted(latencies)
+    return latencies[int(len(latencies) * 0.99) - 1]
+
+class SendWithTimeout(unittest.TestCase):
+    """Tests for timeouts when sending without a sender."""
+
+    @mock.patch('requests.post')
+    def test_01_requests_have_a_timeout(self, mock_post):
+        GoogleAnalytics(PROPERTY_ID).send_event('menu', 'click')
+        self.assertEqual(mock_post.call_args[1]['timeout'], DEFAULT_TIMEOUT)
+
+    @mock.patch('requests.post')
+    def test_02_timeout_can_be_set(self, mock_post):
+        GoogleAnalytics(PROPERTY_ID, timeout=1.5).send_event('menu', 'click')
+        self.assertEqual(mock_post.call_args[1]['timeout'], 1.5)
+
+class HedgeRequests(unittest.TestCase):
+    """Tests for HedgedTransport with responses of fixed delays."""
+
+    url = 'https://www.google-analytics.com/collect'
+
+    def __latencies(self, transport, requests):
+        latencies = []
+        for number in range(requests):
+            started = monotonic()
+            self.assertEqual(transport.post(self.url, 'v=1&n={}'.format(number)), 200)
+            latencies.append(monotonic() - started)
+        return latencies
+
+    def test_01_bounds_p99_of_slow_responses(self):
+        # after 20 requests to learn the usual latency, 1 in 40 is slow
+        slow = {'v=1&n={}'.format(number) for number in range(39, 220, 40)}
+        transport = HedgedTransport(
+            budget=5.0,
+            percentile=90,
+            min_samples=10,
+            min_hedge_after=0.05,
+            transport_factory=lambda timeout: SleepingTransport([0], timeout, slow),
+        )
+        self.addCleanup(transport.close)
+        latencies = self.__latencies(transport, 220)[20:]
+        stats = transport.stats()
+        self.assertEqual(stats['hedged'], 5)
+        self.assertEqual(stats['hedge_wins'], 5)
+        self.assertEqual(stats['abandoned'], 5)
+        self.assertLess(max(latencies), 0.5)
+        self.assertLess(p99(latencies), 0.25)
+
+    def test_02_times_out_after_budget(self):
+        transport = HedgedTransport(
+            budget=0.2,
+            transport_factory=lambda timeout: SleepingTransport([1.0], timeout),
+        )
+        self.addCleanup(transport.close)
+        started = monotonic()
+        self.assertRaises(TimeoutError, transport.post, self.url, 'v=1')
+        self.assertLess(monotonic() - started, 0.5)
+        self.assertEqual(transport.stats()['timeouts'], 1)
+        # the budget counts as the latency of the request
+        self.assertEqual(transport.latencies.max, 200)
+
+    def test_03_raises_error_with_invalid_percentile(self):
+        self.assertRaises(ValueError, HedgedTransport, percentile=100)
+
+    def test_04_sub_millisecond_latency_does_not_hedge_every_request(self):
+        transport = HedgedTransport(
+            percentile=90,
+            min_samples=10,
+            transport_factory=lambda timeout: SleepingTransport([], timeout),
+        )
+        self.addCleanup(transport.close)
+        for number in range(200):
+            self.assertEqual(transport.post(self.url, 'v=1&n={}'.format(number)), 200)
+        stats = transport.stats()
+        self.assertGreaterEqual(stats['hedge_after_ms'], 1)
+        self.assertLessEqual(stats['hedged'], 20)
+
+    def test_05_caps_hedge_rate(self):
+        delays = [0]
+        transport = HedgedTransport(
+            percentile=90,
+            min_samples=20,
+            transport_factory=lambda timeout: SleepingTransport(delays, timeout),
+        )
+        self.addCleanup(transport.close)
+        for number in range(20):
+            transport.post(self.url, 'v=1&n={}'.format(number))
+
+        # every request is slower than the learnt delay from now on
+        delays[0] = 0.02
+        for number in range(20):
+            transport.post(self.url, 'v=1&n={}'.format(number))
+        stats = transport.stats()
+        self.assertLessEqual(stats['hedged'], 4)
+        self.assertGreater(stats['hedges_skipped'], 0)
+
+    def test_06_raises_error_with_invalid_hedge_limits(self):
+        self.assertRaises(ValueError, HedgedTransport, min_hedge_after=-1)
+        self.assertRaises(ValueError, HedgedTransport, max_hedge_rate=1.5)
+
+    def test_07_does_not_hedge_without_free_connection(self):
+        slow = {'v=1&n=29'}
+        transport = HedgedTransport(
+            percentile=90,
+            min_samples=10,
+            connections=1,
+            min_hedge_after=0.05,
+            transport_factory=lambda timeout: SleepingTransport([0], timeout, slow, 0.2),
+        )
+        self.addCleanup(transport.close)
+        self.__latencies(transport, 30)
+        stats = transport.stats()
+        self.assertEqual(stats['hedged'], 0)
+        self.assertEqual(stats['hedges_skipped'], 1)
+
+class PlainTransportTimeout(unittest.TestCase):
+    """Tests for RequestsTransport against a stub with slow responses."""
+
+    def setUp(self):
+        self.server = HTTP1StubServer(slow_rate=1.0, slow_delay=1.0).start()
+        self.addCleanup(self.server.stop)
+        self.url = self.server.url + '/collect'
+
+    def test_01_is_bounded_by_timeout(self):
+        transport = RequestsTransport(timeout=0.2)
+        self.addCleanup(transport.close)
+        started = monotonic()
+        self.assertRaises(Exception, transport.post, self.url, 'v=1')
+        self.assertLess(monotonic() - started, 0.5)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
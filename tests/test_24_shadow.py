@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.shadow's ShadowValidator."""
+
+from urllib.parse import parse_qs
+import unittest
+from unittest import mock
+
+from google.analytics.measurement_protocol import GA_DEBUG_ENDPOINT, GoogleAnalytics
+from google.analytics.shadow import ShadowValidator
+
+PROPERTY_ID = 'UA-12345-6'
+
+class Response(object):
+
+    def __init__(self, result):
+        self.result = result
+
+    def json(self):
+        return {'hitParsingResult': [self.result]}
+
+class ValidationTransport(object):
+    """Transport that answers like the validation server: hits with an
+            event value of 'bad' are invalid."""
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, endpoint, body, timeout=None):
+        self.requests.append((endpoint, body))
+        hit = parse_qs(body)
+        if hit.get('el') == ['bad']:
+            return Response({
+                'valid': False,
+                'hit': body,
+                'parserMessage': [{
+                    'messageType': 'ERROR',
+                    'description': 'el is bad.',
+                    'parameter': 'el',
+                }],
+            })
+        return Response({'valid': True, 'hit': body, 'parserMessage': []})
+
+class SampleHits(unittest.TestCase):
+    """Tests for ShadowValidator.sampled()."""
+
+    def test_01_samples_by_cache_buster(self):
+        shadow = ShadowValidator(sample_rate=0.1)
+        sampled = [
+            shadow.sampled('{:016x}'.format(number * 7919))
+            for number in range(10000)
+        ]
+        self.assertTrue(900 <= sum(sampled) <= 1100)
+        self.assertEqual(shadow.sampled('00000000000003e8'), shadow.sampled('00000000000003e8'))
+
+    def test_02_all_or_nothing(self):
+        self.assertTrue(ShadowValidator(sample_rate=1.0).sampled('ffff'))
+        self.assertFalse(ShadowValidator(sample_rate=0).sampled('0000'))
+
+    def test_03_raises_error_with_invalid_sample_rate(self):
+        self.assertRaises(ValueError, ShadowValidator, sample_rate=1.5)
+
+class ValidateHits(unittest.TestCase):
+    """Tests for a tracker with a ShadowValidator."""
+
+    @mock.patch('requests.post')
+    def test_01_sends_hits_and_counts_problems(self, mock_post):
+        transport = ValidationTransport()
+        shadow = ShadowValidator(sample_rate=1.0, transport=transport)
+        ga = GoogleAnalytics(PROPERTY_ID, shadow=shadow)
+        ga.send_event('menu', 'click', 'good')
+        ga.send_event('menu', 'click', 'bad')
+        ga.send_event('menu', 'click', 'bad')
+        self.assertTrue(ga.flush(timeout=5))
+
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertEqual(transport.requests[0][0], GA_DEBUG_ENDPOINT)
+        self.assertEqual(shadow.problems(), {('event', 'el', 'ERROR'): 2})
+        stats = shadow.stats()
+        self.assertEqual(stats['validated'], 3)
+        self.assertEqual(stats['invalid'], 2)
+        self.assertEqual(len(shadow.examples), 2)
+
+    @mock.patch('requests.post')
+    def test_02_sampled_out_hits_are_not_validated(self, mock_post):
+        transport = ValidationTransport()
+        shadow = ShadowValidator(sample_rate=0, transport=transport)
+        ga = GoogleAnalytics(PROPERTY_ID, shadow=shadow)
+        ga.send_event('menu', 'click')
+        self.assertTrue(ga.flush(timeout=5))
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(transport.requests, [])
+
+    def test_03_counts_failed_validations(self):
+        transport = mock.Mock()
+        transport.request.side_effect = IOError('connection reset')
+        shadow = ShadowValidator(sample_rate=1.0, transport=transport)
+        shadow.offer('event', {'v': 1, 'z': '1'})
+        self.assertTrue(shadow.flush(timeout=5))
+        self.assertEqual(shadow.stats()['failed'], 1)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
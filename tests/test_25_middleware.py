@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.middleware."""
+
+import asyncio
+from time import perf_counter
+import unittest
+from unittest import mock
+
+from google.analytics.measurement_protocol import GA_BATCH_ENDPOINT, GoogleAnalytics
+from google.analytics.middleware import (
+    ASGIMiddleware,
+    PageviewCollector,
+    WSGIMiddleware,
+    parse_client_id,
+    parse_hostname,
+    parse_language,
+)
+
+from .helpers import RecordingTransport
+
+PROPERTY_ID = 'UA-12345-6'
+
+def make_collector():
+    transport = RecordingTransport()
+    ga = GoogleAnalytics(PROPERTY_ID, transport=transport)
+    # long enough that only tests send
+    return PageviewCollector(ga, flush_interval=3600), transport
+
+def wsgi_app(environ, start_response):
+    status = '404 Not Found' if environ['PATH_INFO'] == '/missing' else '200 OK'
+    start_response(status, [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+def environ(path='/', **headers):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'REMOTE_ADDR': '203.0.113.7',
+    }
+    environ.update(headers)
+    return environ
+
+def call_wsgi(app, environ):
+    response = app(environ, lambda status, headers, exc_info=None: None)
+    body = b''.join(response)
+    if hasattr(response, 'close'):
+        response.close()
+    return body
+
+async def asgi_app(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'ok'})
+
+class ParseHeaders(unittest.TestCase):
+    """Tests for parsing request headers."""
+
+    def test_01_parses_client_id(self):
+        self.assertEqual(
+            parse_client_id('theme=dark; _ga=GA1.2.1234567890.1500000000; _gid=GA1.2.1.2'),
+            '1234567890.1500000000',
+        )
+        self.assertEqual(parse_client_id('_ga=GA1.3.42.1500000000'), '42.1500000000')
+        self.assertIsNone(parse_client_id('_gat=1; x_ga=GA1.2.1.2'))
+        self.assertIsNone(parse_client_id(None))
+
+    def test_02_parses_language_and_hostname(self):
+        self.assertEqual(parse_language('en-US,en;q=0.9'), 'en-us')
+        self.assertIsNone(parse_language('*'))
+        self.assertEqual(parse_hostname('example.com:8000'), 'example.com')
+        self.assertEqual(parse_hostname('[::1]:8000'), '[::1]')
+
+class SendPageviewsFromWSGI(unittest.TestCase):
+    """Tests for WSGIMiddleware."""
+
+    def test_01_sends_pageview_after_response(self):
+        collector, transport = make_collector()
+        app = WSGIMiddleware(wsgi_app, collector=collector)
+
+        response = app(environ(
+            '/products',
+            QUERY_STRING='page=2',
+            HTTP_HOST='example.com:8000',
+            HTTP_USER_AGENT='Mozilla/5.0',
+            HTTP_ACCEPT_LANGUAGE='fr-CA,fr;q=0.8',
+            HTTP_COOKIE='_ga=GA1.2.111.222',
+        ), lambda status, headers, exc_info=None: None)
+        self.assertEqual(list(response), [b'ok'])
+        self.assertEqual(len(collector.rows), 0)
+        response.close()
+        self.assertEqual(len(collector.rows), 1)
+
+        self.assertEqual(collector.send(), 1)
+        self.assertEqual(transport.posts[0][0], GA_BATCH_ENDPOINT)
+        hit = transport.hits()[0]
+        self.assertEqual(hit['t'], 'pageview')
+        self.assertEqual(hit['tid'], PROPERTY_ID)
+        self.assertEqual(hit['dp'], '/products?page=2')
+        self.assertEqual(hit['dh'], 'example.com')
+        self.assertEqual(hit['uip'], '203.0.113.7')
+        self.assertEqual(hit['ua'], 'Mozilla/5.0')
+        self.assertEqual(hit['ul'], 'fr-ca')
+        self.assertEqual(hit['cid'], '111.222')
+
+    def test_02_skips_errors_and_excluded_paths(self):
+        collector, transport = make_collector()
+        app = WSGIMiddleware(wsgi_app, collector=collector, exclude_paths=['/static/'])
+        call_wsgi(app, environ('/missing'))
+        call_wsgi(app, environ('/static/app.js'))
+        self.assertEqual(collector.send(), 0)
+        self.assertEqual(transport.posts, [])
+
+    def test_03_uses_forwarded_address_and_random_client_id(self):
+        collector, transport = make_collector()
+        app = WSGIMiddleware(wsgi_app, collector=collector, trust_forwarded=True)
+        call_wsgi(app, environ(HTTP_X_FORWARDED_FOR='198.51.100.1, 10.0.0.1'))
+        call_wsgi(app, environ())
+        collector.send()
+        first, second = transport.hits()
+        self.assertEqual(first['uip'], '198.51.100.1')
+        self.assertEqual(first['dh'], 'localhost')
+        self.assertNotEqual(first['cid'], second['cid'])
+
+    def test_04_sends_from_background_thread(self):
+        transport = RecordingTransport()
+        ga = GoogleAnalytics(PROPERTY_ID, transport=transport)
+        collector = PageviewCollector(ga, flush_interval=0.05)
+        app = WSGIMiddleware(wsgi_app, collector=collector)
+        for _ in range(30):
+            call_wsgi(app, environ())
+        self.assertTrue(collector.flush(5))
+        self.assertEqual(len(transport.hits()), 30)
+        self.assertEqual(collector.stats()['sent'], 30)
+
+    def test_05_adds_microseconds_to_requests(self):
+        collector, transport = make_collector()
+        collector.max_rows = collector.max_pending = 10**6
+        app = WSGIMiddleware(wsgi_app, collector=collector)
+        request = environ(
+            '/products',
+            HTTP_HOST='example.com',
+            HTTP_USER_AGENT='Mozilla/5.0',
+            HTTP_ACCEPT_LANGUAGE='en-US,en;q=0.9',
+            HTTP_COOKIE='_ga=GA1.2.111.222',
+        )
+        requests = 20000
+
+        def average(app):
+            start = perf_counter()
+            for _ in range(requests):
+                call_wsgi(app, request)
+            return (perf_counter() - start) / requests
+
+        average(app) # warm up
+        overhead = min(average(app) for _ in range(3)) - average(wsgi_app)
+        self.assertLess(overhead, 20e-6)
+        collector.rows.clear()
+
+    def test_06_raises_error_without_tracker(self):
+        self.assertRaises(ValueError, WSGIMiddleware, wsgi_app)
+
+    def test_07_raises_error_with_tracker_that_cannot_send_columns(self):
+        ga = GoogleAnalytics(PROPERTY_ID, debug=True)
+        self.assertRaises(ValueError, PageviewCollector, ga)
+        self.assertRaises(ValueError, WSGIMiddleware, wsgi_app, ga)
+
+    def test_08_counts_failed_pageviews(self):
+        collector, transport = make_collector()
+        app = WSGIMiddleware(wsgi_app, collector=collector)
+        call_wsgi(app, environ())
+        with mock.patch.object(collector.tracker, 'send_columns', side_effect=OSError):
+            self.assertEqual(collector.send(), 0)
+        self.assertEqual(collector.stats()['failed'], 1)
+        self.assertEqual(collector.stats()['requests'], 1)
+
+class SendPageviewsFromASGI(unittest.TestCase):
+    """Tests for ASGIMiddleware."""
+
+    def test_01_sends_pageview_after_response(self):
+        collector, transport = make_collector()
+        app = ASGIMiddleware(asgi_app, collector=collector)
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(app({
+            'type': 'http',
+            'path': '/checkout',
+            'query_string': b'step=1',
+            'headers': [
+                (b'host', b'shop.example.com'),
+                (b'user-agent', b'Mozilla/5.0'),
+                (b'accept-language', b'de'),
+                (b'cookie', b'_ga=GA1.2.333.444'),
+            ],
+            'client': ('192.0.2.5', 50000),
+        }, receive, send))
+        self.assertEqual(len(messages), 2)
+
+        collector.send()
+        hit = transport.hits()[0]
+        self.assertEqual(hit['dp'], '/checkout?step=1')
+        self.assertEqual(hit['dh'], 'shop.example.com')
+        self.assertEqual(hit['uip'], '192.0.2.5')
+        self.assertEqual(hit['ua'], 'Mozilla/5.0')
+        self.assertEqual(hit['ul'], 'de')
+        self.assertEqual(hit['cid'], '333.444')
+
+    def test_02_passes_other_scopes_through(self):
+        collector, transport = make_collector()
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope['type'])
+
+        asyncio.run(ASGIMiddleware(app, collector=collector)({'type': 'lifespan'}, None, None))
+        self.assertEqual(scopes, ['lifespan'])
+        self.assertEqual(len(collector.rows), 0)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
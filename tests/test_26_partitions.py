@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.partitions' PartitionedBuffer."""
+
+from random import Random
+from threading import Lock
+from time import sleep
+import unittest
+
+from google.analytics.partitions import PartitionedBuffer
+from google.analytics.sender import QueuedSender
+
+from .helpers import make_hit
+
+def numbers(batch):
+    return [hit.body.rsplit('=', 1)[1] for hit in batch]
+
+def client_hit(client_id, number=0):
+    return make_hit(number, params='t=event&cid={}'.format(client_id), hit_type='event', client_id=client_id)
+
+class SlowTransport(object):
+    """Transport that takes a random time to post, records the order in
+            which each client's hits arrive and checks that no two batches
+            of a client are in flight at the same time."""
+
+    def __init__(self, seed=0):
+        self.random = Random(seed)
+        self.lock = Lock()
+        self.arrivals = {}
+        self.in_flight = set()
+        self.overlaps = 0
+        self.concurrency = 0
+        self.max_concurrency = 0
+
+    def post(self, endpoint, body, timeout=None):
+        lines = [dict(pair.split('=') for pair in line.split('&')) for line in body.split('\n')]
+        client_ids = set(line['cid'] for line in lines)
+        with self.lock:
+            if self.in_flight & client_ids:
+                self.overlaps += 1
+            self.in_flight |= client_ids
+            self.concurrency += 1
+            self.max_concurrency = max(self.max_concurrency, self.concurrency)
+            delay = self.random.random() * 0.01
+        sleep(delay)
+        with self.lock:
+            for line in lines:
+                self.arrivals.setdefault(line['cid'], []).append(int(line['n']))
+            self.in_flight -= client_ids
+            self.concurrency -= 1
+        return 200
+
+class PartitionHits(unittest.TestCase):
+    """Tests for PartitionedBuffer's partitions and batches."""
+
+    def test_01_same_client_same_partition(self):
+        buffer = PartitionedBuffer(partitions=8)
+        self.assertEqual(
+            buffer.partition_of(client_hit('555.1', 1)),
+            buffer.partition_of(client_hit('555.1', 2)),
+        )
+        indexes = set(buffer.partition_of(client_hit(str(n))) for n in range(100))
+        self.assertEqual(indexes, set(range(8)))
+
+    def test_02_holds_partition_until_released(self):
+        buffer = PartitionedBuffer(partitions=1)
+        for number in range(30):
+            buffer.put(client_hit('a', number))
+
+        batch = buffer.get_batch(max_hits=20)
+        self.assertEqual(numbers(batch), [str(n) for n in range(20)])
+        self.assertEqual(buffer.get_batch(timeout=0.01), [])
+        self.assertEqual(buffer.counters['partition_waits'], 1)
+
+        buffer.release(batch)
+        self.assertEqual(numbers(buffer.get_batch(max_hits=20)), [str(n) for n in range(20, 30)])
+
+    def test_03_other_partitions_are_not_held(self):
+        buffer = PartitionedBuffer(partitions=64)
+        first = client_hit('a')
+        second = next(
+            client_hit(str(n)) for n in range(100)
+            if buffer.partition_of(client_hit(str(n))) != buffer.partition_of(first)
+        )
+        buffer.put(first)
+        buffer.put(second)
+        self.assertEqual(buffer.get_batch(), [first])
+        self.assertEqual(buffer.get_batch(), [second])
+        self.assertEqual(buffer.partition_stats()['in_flight'], sorted([
+            buffer.partition_of(first),
+            buffer.partition_of(second),
+        ]))
+
+    def test_04_drops_newest_when_full(self):
+        buffer = PartitionedBuffer(max_bytes=50)
+        self.assertTrue(buffer.put(client_hit('a', 1)))
+        self.assertTrue(buffer.put(client_hit('a', 2)))
+        self.assertFalse(buffer.put(client_hit('a', 3)))
+        self.assertEqual(buffer.counters['dropped_newest'], 1)
+        self.assertEqual(len(buffer), 2)
+
+    def test_05_raises_error_with_invalid_parameters(self):
+        self.assertRaises(ValueError, PartitionedBuffer, partitions=0)
+        self.assertRaises(ValueError, PartitionedBuffer, max_bytes=0)
+        self.assertRaises(ValueError, PartitionedBuffer, policy='drop-oldest')
+
+class SendInOrder(unittest.TestCase):
+    """Tests for QueuedSender with a PartitionedBuffer."""
+
+    def test_01_keeps_each_clients_order_across_connections(self):
+        transport = SlowTransport()
+        sender = QueuedSender(
+            transport=transport,
+            connections=8,
+            buffer=PartitionedBuffer(partitions=32, max_bytes=8 * 1024 * 1024),
+        )
+        clients = ['{}.1500000000'.format(n) for n in range(50)]
+        for number in range(40):
+            for client_id in clients:
+                self.assertTrue(sender.send(client_hit(client_id, number)))
+        self.assertTrue(sender.flush(30))
+
+        self.assertEqual(transport.overlaps, 0)
+        self.assertGreater(transport.max_concurrency, 1)
+        self.assertEqual(sorted(transport.arrivals), sorted(clients))
+        for client_id in clients:
+            self.assertEqual(transport.arrivals[client_id], list(range(40)))
+        self.assertEqual(sender.stats()['sent'], 2000)
+        self.assertEqual(len(sender.stats()['partitions']['queued_hits']), 32)
+
+    def test_02_plain_buffer_can_reorder(self):
+        transport = SlowTransport()
+        sender = QueuedSender(transport=transport, connections=8, max_bytes=8 * 1024 * 1024)
+        for number in range(40):
+            for client_id in range(50):
+                sender.send(client_hit(str(client_id), number))
+        self.assertTrue(sender.flush(30))
+        self.assertGreater(transport.overlaps, 0)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
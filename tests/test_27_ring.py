@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.ring's HitRing, RingClient and RingDrain."""
+
+from threading import Thread
+from time import perf_counter, time
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from google.analytics.measurement_protocol import GA_BATCH_ENDPOINT, GoogleAnalytics
+from google.analytics.ring import (
+    RECORD,
+    HitRing,
+    RingClient,
+    RingDrain,
+    record_bytes,
+)
+from google.analytics.sender import QueuedSender
+
+from .helpers import RecordingTransport, make_hit
+
+PROPERTY_ID = 'UA-12345-6'
+LANE_BYTES = 2 * record_bytes(8 * 1024)
+
+def ring_hit(number, size=100):
+    return make_hit(number, size, 't=event', 'event')
+
+def produce(path, producer, count):
+    # runs in a forked child
+    ga = GoogleAnalytics(PROPERTY_ID, sender=RingClient(path))
+    for number in range(count):
+        ga.send_event('producer-{}'.format(producer), str(number))
+    os._exit(0 if ga.sender.stats()['sent'] == count else 1)
+
+class RingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ring')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+class WriteAndReadLanes(RingTestCase):
+    """Tests for HitRing.write() and HitRing.read()."""
+
+    def test_01_reads_hits_in_order_across_wraps(self):
+        ring = HitRing(self.path, lanes=2, lane_bytes=LANE_BYTES)
+        lane = ring.claim()
+        read = []
+        timestamp = time()
+        for number in range(2000):
+            hit = ring_hit(number, size=50 + number % 300)
+            self.assertTrue(ring.write(lane, hit.body.encode('utf-8'), timestamp if number % 2 else None))
+            if number % 7 == 0:
+                read.extend(ring.read(lane))
+        read.extend(ring.read(lane))
+
+        self.assertEqual(len(read), 2000)
+        for number, (data, hit_timestamp) in enumerate(read):
+            self.assertTrue(data.startswith('t=event&n={}&'.format(number).encode('utf-8')))
+            self.assertEqual(hit_timestamp, timestamp if number % 2 else None)
+        self.assertEqual(ring.read(lane), [])
+
+    def test_02_drops_hits_when_lane_is_full(self):
+        ring = HitRing(self.path, lanes=1, lane_bytes=LANE_BYTES)
+        data = ring_hit(0, size=1000).body.encode('utf-8')
+        written = 0
+        while ring.write(0, data):
+            written += 1
+        self.assertEqual(written, LANE_BYTES // record_bytes(len(data)))
+        self.assertEqual(ring.lane_stats()[0]['dropped'], 1)
+
+        ring.read(0, max_records=1)
+        self.assertTrue(ring.write(0, data))
+
+    def test_03_skips_records_not_completely_written(self):
+        ring = HitRing(self.path, lanes=1, lane_bytes=LANE_BYTES)
+        ring.write(0, b'first')
+        ring.write(0, b'second')
+        # corrupt the second record, as if its bytes were not visible yet
+        offset = ring.starts[0] + record_bytes(len(b'first')) + RECORD.size
+        ring.buffer[offset:offset + 1] = b'S'
+        self.assertEqual(ring.read(0), [(b'first', None)])
+        ring.buffer[offset:offset + 1] = b's'
+        self.assertEqual(ring.read(0), [(b'second', None)])
+
+    def test_04_reopens_ring_of_same_size(self):
+        ring = HitRing(self.path, lanes=2, lane_bytes=LANE_BYTES)
+        ring.write(1, b'kept')
+        self.assertEqual(HitRing(self.path).read(1), [(b'kept', None)])
+        self.assertEqual(HitRing(self.path, lanes=2, lane_bytes=LANE_BYTES).lanes, 2)
+        self.assertEqual(HitRing(self.path, lanes=3, lane_bytes=LANE_BYTES).read(1), [])
+
+    def test_05_replaces_ring_of_another_size(self):
+        old_ring = HitRing(self.path, lanes=4, lane_bytes=LANE_BYTES)
+        for _ in range(3):
+            old_ring.claim()
+        client = RingClient(self.path)
+        self.assertTrue(client.send(ring_hit(0)))
+        self.assertEqual(client.lane, 3)
+
+        # a lane past the end of the new file would fault if it were
+        # truncated in place
+        ring = HitRing(self.path, lanes=1, lane_bytes=LANE_BYTES)
+        self.assertTrue(old_ring.is_retired())
+        self.assertEqual(ring.lane_stats()[0]['owner'], 0)
+        self.assertTrue(client.send(ring_hit(1)))
+        self.assertEqual(client.lane, 0)
+        self.assertFalse(client.ring.is_retired())
+        self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(self.directory)))
+
+        transport = RecordingTransport()
+        drain = RingDrain(ring, QueuedSender(transport=transport))
+        self.assertEqual(drain.drain(), 2)
+        self.assertTrue(drain.close(5))
+        self.assertEqual(sorted(hit['n'] for hit in transport.hits()), ['0', '1'])
+
+    def test_06_raises_error_with_invalid_parameters(self):
+        self.assertRaises(FileNotFoundError, HitRing, self.path)
+        self.assertRaises(ValueError, HitRing, self.path, lanes=0, lane_bytes=LANE_BYTES)
+        self.assertRaises(ValueError, HitRing, self.path, lanes=1, lane_bytes=1024)
+        with open(self.path, 'wb') as ring_file:
+            ring_file.write(b'not a ring')
+        self.assertRaises(ValueError, HitRing, self.path)
+
+class ClaimLanes(RingTestCase):
+    """Tests for HitRing.claim()."""
+
+    def test_01_claims_free_lanes(self):
+        ring = HitRing(self.path, lanes=2, lane_bytes=LANE_BYTES)
+        self.assertEqual(ring.claim(), 0)
+        self.assertEqual(ring.claim(), 1)
+        self.assertIsNone(ring.claim())
+        ring.release(0)
+        self.assertEqual(ring.claim(), 0)
+
+    def test_02_claims_lanes_of_dead_processes(self):
+        ring = HitRing(self.path, lanes=1, lane_bytes=LANE_BYTES)
+        pid = os.fork()
+        if pid == 0:
+            ring.claim()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(ring.lane_stats()[0]['owner'], pid)
+        self.assertEqual(ring.claim(), 0)
+
+    def test_03_client_counts_hits_without_lane(self):
+        ring = HitRing(self.path, lanes=1, lane_bytes=LANE_BYTES)
+        ring.claim()
+        client = RingClient(ring=ring)
+        self.assertFalse(client.send(ring_hit(0)))
+        self.assertEqual(client.stats()['unavailable'], 1)
+
+    def test_04_writes_without_syscall_in_microseconds(self):
+        client = RingClient(ring=HitRing(self.path, lanes=1, lane_bytes=1024 * 1024))
+        drain = RingDrain(client.ring, QueuedSender(transport=RecordingTransport()))
+        hit = ring_hit(0, size=300)
+        client.send(hit)
+        drain.ring.read(0)
+
+        def write_all():
+            start = perf_counter()
+            for _ in range(1000):
+                client.send(hit)
+            elapsed = perf_counter() - start
+            drain.ring.read(0)
+            return elapsed / 1000
+
+        self.assertLess(min(write_all() for _ in range(5)), 20e-6)
+
+class DrainRing(RingTestCase):
+    """Tests for RingDrain with producers in forked processes."""
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_01_sends_hits_of_every_producer_in_batches(self):
+        transport = RecordingTransport()
+        ring = HitRing(self.path, lanes=8, lane_bytes=64 * 1024)
+        drain = RingDrain(ring, QueuedSender(
+            max_bytes=8 * 1024 * 1024,
+            transport=transport,
+            linger=0.05,
+        ))
+        thread = Thread(target=drain.serve_forever)
+        thread.start()
+
+        context = multiprocessing.get_context('fork')
+        producers = [
+            context.Process(target=produce, args=(self.path, producer, 500))
+            for producer in range(4)
+        ]
+        for process in producers:
+            process.start()
+        for process in producers:
+            process.join(30)
+            self.assertEqual(process.exitcode, 0)
+
+        self.assertTrue(drain.close(10))
+        thread.join(5)
+
+        self.assertEqual(drain.received, 2000)
+        self.assertTrue(all(endpoint == GA_BATCH_ENDPOINT for endpoint, body in transport.posts))
+        hits = transport.hits()
+        self.assertEqual(len(hits), 2000)
+        for producer in range(4):
+            self.assertEqual(
+                [hit['ea'] for hit in hits if hit['ec'] == 'producer-{}'.format(producer)],
+                [str(number) for number in range(500)],
+            )
+        self.assertEqual(drain.stats()['dropped'], 0)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.session's TimerWheel and SessionManager."""
+
+import unittest
+from unittest import mock
+
+from google.analytics.destination import Destination
+from google.analytics.measurement_protocol import GoogleAnalytics
+from google.analytics.session import SessionManager, TimerWheel
+
+PROPERTY_ID = 'UA-12345-6'
+TIMEOUT = 1800
+
+class ExpireTimerWheel(unittest.TestCase):
+    """Tests for TimerWheel.advance()."""
+
+    def setUp(self):
+        self.wheel = TimerWheel(now=0)
+
+    def test_01_expires_in_deadline_order(self):
+        self.wheel.schedule('b', 200)
+        self.wheel.schedule('a', 100)
+        self.wheel.schedule('c', 5000)
+        self.assertEqual(self.wheel.advance(99), [])
+        self.assertEqual(self.wheel.advance(300), ['a', 'b'])
+        self.assertEqual(self.wheel.advance(5000), ['c'])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_02_cancelled_key_does_not_expire(self):
+        self.wheel.schedule('a', 100)
+        self.assertTrue(self.wheel.cancel('a'))
+        self.assertFalse(self.wheel.cancel('a'))
+        self.assertEqual(self.wheel.advance(200), [])
+
+    def test_03_rescheduled_key_expires_once(self):
+        self.wheel.schedule('a', 100)
+        self.wheel.schedule('a', 10000)
+        self.assertEqual(self.wheel.advance(9999), [])
+        self.assertEqual(self.wheel.advance(10000), ['a'])
+
+    def test_04_deadline_beyond_top_level(self):
+        self.wheel.schedule('a', 64 ** 4 + 10)
+        self.assertEqual(self.wheel.advance(64 ** 4), [])
+        self.assertEqual(self.wheel.advance(64 ** 4 + 10), ['a'])
+
+class TouchSessionManager(unittest.TestCase):
+    """Tests for SessionManager.touch(), end() and expire()."""
+
+    def setUp(self):
+        self.expired = []
+        self.sessions = SessionManager(TIMEOUT, on_expire=self.expired.append)
+        self.now = self.sessions.wheel.current_tick
+
+    def test_01_first_hit_starts_session(self):
+        self.assertTrue(self.sessions.touch('cid', self.now))
+        self.assertFalse(self.sessions.touch('cid', self.now + 10))
+
+    def test_02_activity_extends_session(self):
+        self.sessions.touch('cid', self.now)
+        self.sessions.touch('cid', self.now + TIMEOUT - 1)
+        self.assertEqual(self.sessions.expire(self.now + TIMEOUT + 1), [])
+        self.assertEqual(self.sessions.expire(self.now + 2 * TIMEOUT), ['cid'])
+        self.assertEqual(self.expired, ['cid'])
+
+    def test_03_idle_session_restarts(self):
+        self.sessions.touch('cid', self.now)
+        self.assertTrue(self.sessions.touch('cid', self.now + TIMEOUT + 1))
+        self.assertEqual(self.expired, ['cid'])
+
+    def test_04_end_session(self):
+        self.sessions.touch('cid', self.now)
+        self.assertTrue(self.sessions.end('cid'))
+        self.assertNotIn('cid', self.sessions)
+        self.assertTrue(self.sessions.touch('cid', self.now + 1))
+
+    def test_05_raises_error_with_bad_timeout(self):
+        self.assertRaises(ValueError, SessionManager, 0)
+
+    def test_06_starts_does_not_record_hit(self):
+        self.assertTrue(self.sessions.starts('cid', self.now))
+        self.assertNotIn('cid', self.sessions)
+        self.sessions.touch('cid', self.now)
+        self.assertFalse(self.sessions.starts('cid', self.now + 10))
+
+class SendHitWithSessionManager(unittest.TestCase):
+    """Tests for sending hits with session_manager."""
+
+    def setUp(self):
+        self.sessions = SessionManager(TIMEOUT)
+        self.ga = GoogleAnalytics(PROPERTY_ID, session_manager=self.sessions)
+
+    def __send_event(self):
+        with mock.patch('requests.post') as post:
+            self.ga.send_event('menu', 'click')
+        return post.call_args[1]['data']
+
+    def test_01_first_hit_has_session_start(self):
+        self.assertEqual(self.__send_event()['sc'], 'start')
+        self.assertNotIn('sc', self.__send_event())
+
+    def test_02_end_session_with_next_hit(self):
+        self.__send_event()
+        self.ga.end_session()
+        self.assertEqual(self.__send_event()['sc'], 'end')
+        self.assertEqual(self.__send_event()['sc'], 'start')
+
+class DropHitWithSessionManager(unittest.TestCase):
+    """Tests for session control of hits that are dropped."""
+
+    def setUp(self):
+        self.sessions = SessionManager(TIMEOUT)
+        # events are dropped, pageviews are sent
+        self.ga = GoogleAnalytics(
+            Destination(PROPERTY_ID, hit_types=['pageview']),
+            session_manager=self.sessions,
+        )
+
+    def __send(self):
+        with mock.patch('requests.post') as post:
+            self.ga.send_event('menu', 'click')
+            self.ga.send_pageview('/page', 'domain.com')
+        return [call[1]['data'] for call in post.call_args_list]
+
+    def test_01_dropped_hit_does_not_start_session(self):
+        with mock.patch('requests.post'):
+            self.ga.send_event('menu', 'click')
+        self.assertNotIn(self.ga.client_id, self.sessions)
+        self.assertEqual([data['sc'] for data in self.__send()], ['start'])
+
+    def test_02_dropped_hit_keeps_session_end(self):
+        self.__send()
+        self.ga.end_session()
+        self.assertEqual([data['sc'] for data in self.__send()], ['end'])
+        self.assertNotIn(self.ga.client_id, self.sessions)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.timing's Histogram and timer()."""
+
+from time import sleep
+import unittest
+from unittest import mock
+
+import requests
+
+from google.analytics.measurement_protocol import GoogleAnalytics
+from google.analytics.timing import Histogram
+
+PROPERTY_ID = 'UA-12345-6'
+
+class RecordHistogram(unittest.TestCase):
+    """Tests for Histogram.record() and percentile()."""
+
+    def setUp(self):
+        self.histogram = Histogram()
+        for value in range(1, 10001):
+            self.histogram.record(value)
+
+    def test_01_count_and_mean(self):
+        self.assertEqual(self.histogram.count, 10000)
+        self.assertAlmostEqual(self.histogram.mean(), 5000.5)
+
+    def test_02_percentiles_within_precision(self):
+        for percent in [50, 90, 99]:
+            expected = percent * 100
+            actual = self.histogram.percentile(percent)
+            self.assertLess(abs(actual - expected) / expected, 1.0 / 16)
+
+    def test_03_compact_buckets(self):
+        self.assertLess(len(self.histogram.buckets), 200)
+
+    def test_04_bucket_round_trip(self):
+        for value in [0, 15, 31, 32, 1000, 123456789]:
+            index = Histogram.bucket_index(value)
+            self.assertLessEqual(
+                abs(Histogram.bucket_value(index) - value),
+                max(1, value / 16.0),
+            )
+
+class TimeWithTracker(unittest.TestCase):
+    """Tests for timer() as a context manager and decorator."""
+
+    def setUp(self):
+        self.ga = GoogleAnalytics(
+            PROPERTY_ID,
+            timing_window=3600,
+            timing_metrics={'count': '1', 'p95': '2'},
+        )
+
+    def tearDown(self):
+        with mock.patch('requests.post'):
+            self.ga.flush()
+
+    def test_01_no_hit_before_window_closes(self):
+        with mock.patch('requests.post') as post:
+            for _ in range(100):
+                with self.ga.timer('db', 'query'):
+                    pass
+        post.assert_not_called()
+
+    def test_02_one_hit_per_key_on_flush(self):
+        @self.ga.timer('api', 'render', 'home')
+        def render():
+            return 'ok'
+
+        with mock.patch('requests.post') as post:
+            for _ in range(50):
+                self.assertEqual(render(), 'ok')
+            with self.ga.timer('db', 'query'):
+                pass
+            self.ga.flush()
+
+        self.assertEqual(post.call_count, 2)
+        hits = [call[1]['data'] for call in post.call_args_list]
+        render_hit = [hit for hit in hits if hit['utc'] == 'api'][0]
+        self.assertEqual(render_hit['t'], 'timing')
+        self.assertEqual(render_hit['utl'], 'home')
+        self.assertEqual(render_hit['cm1'], 50)
+        self.assertGreaterEqual(render_hit['utt'], 1)
+
+    def test_03_sampled_count_is_scaled(self):
+        with mock.patch('google.analytics.timing.random_random') as random:
+            random.side_effect = [0.1, 0.9] * 50
+            for _ in range(100):
+                with self.ga.timer('db', 'query', sample_rate=0.5):
+                    pass
+        histogram = self.ga.timings.histograms[('db', 'query', None)]
+        self.assertEqual(histogram.count, 100)
+
+    def test_04_raises_error_with_bad_sample_rate(self):
+        self.assertRaises(ValueError, self.ga.timer, 'db', 'query', None, 0)
+
+    def test_05_failed_send_does_not_escape_timer(self):
+        ga = GoogleAnalytics(PROPERTY_ID, timing_window=0.001)
+
+        @ga.timer('api', 'render')
+        def render():
+            sleep(0.002)
+            return 'ok'
+
+        with mock.patch('requests.post', side_effect=requests.ConnectionError) as post:
+            self.assertEqual(render(), 'ok')
+            with self.assertRaises(KeyError):
+                with ga.timer('db', 'query'):
+                    sleep(0.002)
+                    raise KeyError('own')
+            # the last window closes on its timer, which hands it to the worker
+            timer = ga.timings.window_timer
+            while timer is not None:
+                timer.join(5)
+                timer = ga.timings.window_timer
+            self.assertTrue(ga.timings.worker.flush(5))
+        # the summaries were sent from the worker, and failed there
+        self.assertGreaterEqual(post.call_count, 1)
+
+    def test_06_closes_quiet_window(self):
+        ga = GoogleAnalytics(PROPERTY_ID, timing_window=0.1)
+        with mock.patch('requests.post') as post:
+            for _ in range(3):
+                with ga.timer('db', 'query'):
+                    pass
+            post.assert_not_called()
+            # no measurement comes after the window
+            sleep(0.3)
+            self.assertTrue(ga.timings.worker.flush(5))
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(post.call_args[1]['data']['utc'], 'db')
+        self.assertIsNone(ga.timings.window_timer)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
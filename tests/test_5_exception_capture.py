@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.exception_capture's ExceptionCapture."""
+
+import sys
+import threading
+import unittest
+from unittest import mock
+
+from google.analytics.exception_capture import (
+    EXD_MAX_LENGTH,
+    ExceptionCapture,
+    fingerprint,
+)
+from google.analytics.measurement_protocol import GoogleAnalytics
+
+PROPERTY_ID = 'UA-12345-6'
+
+def raise_lookup(user_id):
+    raise LookupError('user {} not found at 0x{:x}'.format(user_id, id(user_id)))
+
+def catch(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        return sys.exc_info()
+
+class FingerprintException(unittest.TestCase):
+    """Tests for fingerprint()."""
+
+    def test_01_same_for_variable_message(self):
+        first_key, first_description = fingerprint(*catch(raise_lookup, 1))
+        second_key, second_description = fingerprint(*catch(raise_lookup, 234))
+        self.assertEqual(first_key, second_key)
+        self.assertEqual(first_description, second_description)
+
+    def test_02_describes_type_and_location(self):
+        _, description = fingerprint(*catch(raise_lookup, 1))
+        self.assertTrue(description.startswith('LookupError: user ? not found'))
+        self.assertIn('@test_5_exception_capture.py:raise_lookup', description)
+
+    def test_03_limits_description_length(self):
+        _, description = fingerprint(*catch(raise_lookup, 'x' * 500))
+        self.assertLessEqual(len(description.encode('utf-8')), EXD_MAX_LENGTH)
+
+class CaptureException(unittest.TestCase):
+    """Tests for ExceptionCapture.capture() and flush()."""
+
+    def setUp(self):
+        self.ga = GoogleAnalytics(PROPERTY_ID)
+        self.capture = ExceptionCapture(self.ga, window=60, count_metric='5')
+
+    def tearDown(self):
+        with mock.patch('requests.post'):
+            self.capture.flush(timeout=5)
+
+    def __sent_hits(self):
+        with mock.patch('requests.post') as post:
+            self.assertTrue(self.capture.flush(timeout=5))
+        return [call[1]['data'] for call in post.call_args_list]
+
+    def test_01_suppresses_repeats_in_window(self):
+        with mock.patch('requests.post') as post:
+            self.assertTrue(self.capture.capture(*catch(raise_lookup, 1)))
+            for user_id in range(10):
+                self.assertFalse(self.capture.capture(*catch(raise_lookup, user_id)))
+            self.capture.worker.flush(timeout=5)
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(self.capture.suppressed, 10)
+
+    def test_02_flush_sends_repeat_count(self):
+        for user_id in range(4):
+            self.capture.capture(*catch(raise_lookup, user_id))
+        self.capture.worker.flush(timeout=5)
+        hits = self.__sent_hits()
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0]['t'], 'exception')
+        self.assertEqual(hits[0]['cm5'], 3)
+
+    def test_03_bounded_fingerprints(self):
+        capture = ExceptionCapture(self.ga, max_fingerprints=2)
+        with mock.patch('requests.post'):
+            for exc_type in [KeyError, ValueError, TypeError]:
+                capture.capture(*catch(self.__raise, exc_type))
+            capture.worker.flush(timeout=5)
+        self.assertEqual(len(capture.fingerprints), 2)
+
+    def __raise(self, exc_type):
+        raise exc_type('boom')
+
+class InstallExceptionCapture(unittest.TestCase):
+    """Tests for ExceptionCapture.install() and uninstall()."""
+
+    def setUp(self):
+        self.ga = GoogleAnalytics(PROPERTY_ID)
+        self.capture = ExceptionCapture(self.ga)
+
+    def tearDown(self):
+        self.capture.uninstall()
+
+    def test_01_captures_thread_exception(self):
+        previous_hook = threading.excepthook
+        self.capture.install()
+        self.assertIsNot(threading.excepthook, previous_hook)
+
+        with mock.patch('requests.post') as post, \
+                mock.patch.object(self.capture, 'previous_threading_excepthook'):
+            thread = threading.Thread(target=raise_lookup, args=(1,))
+            thread.start()
+            thread.join()
+            self.capture.worker.flush(timeout=5)
+
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(post.call_args[1]['data']['exf'], 0)
+
+    def test_02_uninstall_restores_hooks(self):
+        previous_excepthook = sys.excepthook
+        previous_threading_excepthook = threading.excepthook
+        self.capture.install()
+        self.capture.uninstall()
+        self.assertIs(sys.excepthook, previous_excepthook)
+        self.assertIs(threading.excepthook, previous_threading_excepthook)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.handlers' logging handlers."""
+
+import logging
+import unittest
+from unittest import mock
+
+from google.analytics.handlers import EventHandler, ExceptionHandler, RateLimiter
+from google.analytics.measurement_protocol import GoogleAnalytics
+
+PROPERTY_ID = 'UA-12345-6'
+
+class AllowRateLimiter(unittest.TestCase):
+    """Tests for RateLimiter.allow()."""
+
+    def setUp(self):
+        self.rate_limiter = RateLimiter(rate=1.0, burst=2, max_keys=2)
+
+    def test_01_allows_burst_then_limits(self):
+        self.assertTrue(self.rate_limiter.allow('a', 0))
+        self.assertTrue(self.rate_limiter.allow('a', 0))
+        self.assertFalse(self.rate_limiter.allow('a', 0))
+        self.assertEqual(self.rate_limiter.limited, 1)
+
+    def test_02_refills_over_time(self):
+        self.rate_limiter.allow('a', 0)
+        self.rate_limiter.allow('a', 0)
+        self.assertTrue(self.rate_limiter.allow('a', 1))
+
+    def test_03_keys_are_independent_and_bounded(self):
+        for key in ['a', 'b', 'c']:
+            self.assertTrue(self.rate_limiter.allow(key, 0))
+        self.assertEqual(list(self.rate_limiter.buckets), ['b', 'c'])
+
+class EmitExceptionHandler(unittest.TestCase):
+    """Tests for ExceptionHandler."""
+
+    def setUp(self):
+        self.ga = GoogleAnalytics(PROPERTY_ID)
+        self.handler = ExceptionHandler(self.ga, burst=3)
+        self.logger = logging.getLogger('test_6_handlers.exception')
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+    def __sent_hits(self, log):
+        with mock.patch('requests.post') as post:
+            log()
+            self.assertTrue(self.handler.flush(timeout=5))
+        return [call[1]['data'] for call in post.call_args_list]
+
+    def test_01_sends_error_and_ignores_warning(self):
+        def log():
+            self.logger.warning('disk %s is slow', 'sda')
+            self.logger.error('user %s failed', 'raffles')
+        hits = self.__sent_hits(log)
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0]['t'], 'exception')
+        self.assertEqual(hits[0]['exd'], 'test_6_handlers.exception: user %s failed')
+        self.assertEqual(hits[0]['exf'], 0)
+
+    def test_02_critical_is_fatal(self):
+        hits = self.__sent_hits(lambda: self.logger.critical('down'))
+        self.assertEqual(hits[0]['exf'], 1)
+
+    def test_03_describes_exc_info(self):
+        def log():
+            try:
+                {}['missing']
+            except KeyError:
+                self.logger.exception('lookup failed')
+        hits = self.__sent_hits(log)
+        self.assertTrue(hits[0]['exd'].startswith('KeyError: \'?\''))
+
+    def test_04_rate_limits_per_template(self):
+        def log():
+            for user_id in range(10):
+                self.logger.error('user %s failed', user_id)
+            self.logger.error('other failure')
+        hits = self.__sent_hits(log)
+        self.assertEqual(len(hits), 4)
+        self.assertEqual(self.handler.dropped, 7)
+
+class EmitEventHandler(unittest.TestCase):
+    """Tests for EventHandler."""
+
+    def test_01_maps_record_to_event(self):
+        ga = GoogleAnalytics(PROPERTY_ID)
+        handler = EventHandler(
+            ga,
+            level=logging.WARNING,
+            event_category='logs',
+            event_label=lambda record: record.getMessage(),
+        )
+        logger = logging.getLogger('test_6_handlers.event')
+        logger.propagate = False
+        logger.addHandler(handler)
+        with mock.patch('requests.post') as post:
+            logger.warning('disk %s is slow', 'sda')
+            handler.flush(timeout=5)
+        logger.removeHandler(handler)
+        handler.close()
+
+        hit = post.call_args[1]['data']
+        self.assertEqual(hit['t'], 'event')
+        self.assertEqual(hit['ec'], 'logs')
+        self.assertEqual(hit['ea'], 'WARNING')
+        self.assertEqual(hit['el'], 'disk sda is slow')
+        self.assertEqual(hit['ni'], 1)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
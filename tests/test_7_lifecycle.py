@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.lifecycle's fork and exit handling."""
+
+from time import monotonic, sleep
+from weakref import WeakSet
+import os
+import unittest
+from unittest import mock
+
+from google.analytics import lifecycle
+from google.analytics.measurement_protocol import GoogleAnalytics
+from google.analytics.worker import BackgroundWorker
+
+PROPERTY_ID = 'UA-12345-6'
+
+class Flushable(object):
+    """Registered object that takes a while to flush."""
+
+    def __init__(self, delay=0, result=True):
+        self.delay = delay
+        self.result = result
+        self.flushed = False
+
+    def flush(self, timeout=None):
+        sleep(self.delay)
+        self.flushed = True
+        return self.result
+
+class FlushAll(unittest.TestCase):
+    """Tests for flush_all()."""
+
+    def setUp(self):
+        patcher = mock.patch.object(lifecycle, '_registry', WeakSet())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_01_flushes_registered_objects(self):
+        objects = [Flushable(), Flushable()]
+        for obj in objects:
+            lifecycle.register(obj)
+        self.assertTrue(lifecycle.flush_all(timeout=5))
+        self.assertTrue(all(obj.flushed for obj in objects))
+
+    def test_02_hard_deadline(self):
+        slow = Flushable(delay=10)
+        lifecycle.register(slow)
+        start = monotonic()
+        self.assertFalse(lifecycle.flush_all(timeout=0.1))
+        self.assertLess(monotonic() - start, 1)
+
+    def test_03_flushes_tracker_timings(self):
+        ga = GoogleAnalytics(PROPERTY_ID)
+        with ga.timer('db', 'query'):
+            pass
+        with mock.patch('requests.post') as post:
+            self.assertTrue(lifecycle.flush_all(timeout=5))
+        self.assertEqual(post.call_count, 1)
+
+    def test_04_unregister(self):
+        obj = Flushable()
+        lifecycle.register(obj)
+        lifecycle.unregister(obj)
+        lifecycle.flush_all(timeout=5)
+        self.assertFalse(obj.flushed)
+
+    def test_05_reports_flush_that_timed_out(self):
+        objects = [Flushable(), Flushable(result=False), Flushable()]
+        for obj in objects:
+            lifecycle.register(obj)
+        self.assertFalse(lifecycle.flush_all(timeout=1.0))
+        self.assertTrue(all(obj.flushed for obj in objects))
+
+    def test_06_raises_error_with_bad_exit_timeout(self):
+        self.assertRaises(ValueError, lifecycle.set_exit_timeout, -1)
+
+@unittest.skipUnless(hasattr(os, 'register_at_fork'), 'needs os.register_at_fork')
+class ForkWorker(unittest.TestCase):
+    """Tests for BackgroundWorker across fork()."""
+
+    def test_01_child_resets_queue_and_parent_keeps_it(self):
+        worker = BackgroundWorker()
+        calls = []
+        worker.submit(calls.append, 'parent')
+        worker.flush(timeout=5)
+        # block the parent's thread so that a call stays queued over fork()
+        worker.submit(sleep, 0.5)
+        worker.submit(calls.append, 'queued')
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            child_calls = []
+            worker.submit(child_calls.append, 'child')
+            flushed = worker.flush(timeout=5)
+            os.write(write_fd, repr((flushed, child_calls)).encode('utf-8'))
+            os._exit(0)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd) as reader:
+            child_result = reader.read()
+        os.waitpid(pid, 0)
+
+        self.assertEqual(child_result, repr((True, ['child'])))
+        self.assertTrue(worker.flush(timeout=5))
+        self.assertEqual(calls, ['parent', 'queued'])
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
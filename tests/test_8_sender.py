@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for google.analytics.sender's HitBuffer and QueuedSender."""
+
+from threading import Event
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from google.analytics.measurement_protocol import (
+    GA_BATCH_ENDPOINT,
+    GA_ENDPOINT,
+    GoogleAnalytics,
+)
+from google.analytics.sender import HitBuffer, QueuedSender
+
+from .helpers import RecordingTransport, make_hit
+
+PROPERTY_ID = 'UA-12345-6'
+
+def bodies(hits):
+    return [hit.body for hit in hits]
+
+class PutHitBuffer(unittest.TestCase):
+    """Tests for HitBuffer.put() with each policy."""
+
+    def test_01_caps_bytes_not_hits(self):
+        buffer = HitBuffer(max_bytes=100)
+        self.assertTrue(buffer.put(make_hit(1, size=60)))
+        self.assertFalse(buffer.put(make_hit(2, size=60)))
+        self.assertTrue(buffer.put(make_hit(3, size=40)))
+        self.assertEqual(buffer.bytes, 100)
+
+    def test_02_drop_newest(self):
+        buffer = HitBuffer(max_bytes=30, policy='drop-newest')
+        for number in range(5):
+            buffer.put(make_hit(number, size=10))
+        self.assertEqual(bodies(buffer.get_batch()), bodies([make_hit(n, size=10) for n in range(3)]))
+        self.assertEqual(buffer.counters['dropped_newest'], 2)
+
+    def test_03_drop_oldest(self):
+        buffer = HitBuffer(max_bytes=30, policy='drop-oldest')
+        for number in range(5):
+            self.assertTrue(buffer.put(make_hit(number, size=10)))
+        self.assertEqual(bodies(buffer.get_batch()), bodies([make_hit(n, size=10) for n in range(2, 5)]))
+        self.assertEqual(buffer.counters['dropped_oldest'], 2)
+
+    def test_04_block_times_out(self):
+        buffer = HitBuffer(max_bytes=10, policy='block', block_timeout=0.05)
+        self.assertTrue(buffer.put(make_hit(1, size=10)))
+        self.assertFalse(buffer.put(make_hit(2, size=10)))
+        self.assertEqual(buffer.counters['block_timeouts'], 1)
+
+    def test_05_spill_keeps_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            buffer = HitBuffer(
+                max_bytes=30,
+                policy='spill',
+                spill_path=os.path.join(directory, 'spill'),
+            )
+            for number in range(8):
+                self.assertTrue(buffer.put(make_hit(number, size=10)))
+            self.assertEqual(buffer.counters['spilled'], 5)
+
+            received = []
+            while len(buffer):
+                received.extend(buffer.get_batch(timeout=0))
+            self.assertEqual(bodies(received), bodies([make_hit(n, size=10) for n in range(8)]))
+            buffer.spill.close()
+
+    def test_06_batch_limits(self):
+        buffer = HitBuffer()
+        for number in range(25):
+            buffer.put(make_hit(number, size=10))
+        self.assertEqual(len(buffer.get_batch()), 20)
+        self.assertEqual(len(buffer.get_batch(max_bytes=35)), 3)
+
+    def test_07_raises_error_with_bad_policy(self):
+        self.assertRaises(ValueError, HitBuffer, 100, 'drop-random')
+        self.assertRaises(ValueError, HitBuffer, 100, 'spill')
+
+class SendQueuedSender(unittest.TestCase):
+    """Tests for QueuedSender with a tracker."""
+
+    def test_01_tracker_does_not_post(self):
+        transport = RecordingTransport()
+        sender = QueuedSender(transport=transport)
+        ga = GoogleAnalytics(PROPERTY_ID, sender=sender)
+        with mock.patch('requests.post') as post:
+            ga.send_event('menu', 'click')
+            self.assertTrue(ga.flush(timeout=5))
+        post.assert_not_called()
+        self.assertEqual(transport.posts[0][0], GA_ENDPOINT)
+        self.assertIn('t=event', transport.posts[0][1])
+        self.assertEqual(sender.stats()['sent'], 1)
+
+    def test_02_sends_queued_hits_in_batches(self):
+        release = Event()
+        transport = RecordingTransport(release=release)
+        sender = QueuedSender(transport=transport)
+        sender.send(make_hit(0, size=10))
+        for number in range(1, 41):
+            sender.send(make_hit(number, size=10))
+        release.set()
+        self.assertTrue(sender.flush(timeout=5))
+
+        batches = [body for endpoint, body in transport.posts if endpoint == GA_BATCH_ENDPOINT]
+        self.assertEqual(sum(len(body.split('\n')) for body in batches), 40)
+        self.assertEqual(len(transport.posts), 3)
+
+    def test_03_rejects_oversized_hit(self):
+        sender = QueuedSender(transport=RecordingTransport())
+        self.assertFalse(sender.send(make_hit(1, size=9000)))
+        self.assertEqual(sender.stats()['oversized'], 1)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for sending to several google.analytics.destination Destinations."""
+
+from urllib.parse import parse_qs
+import unittest
+from unittest import mock
+
+from google.analytics.destination import Destination
+from google.analytics.measurement_protocol import (
+    GA_BATCH_ENDPOINT,
+    GoogleAnalytics,
+)
+
+PROPERTY_ID = 'UA-12345-6'
+ROLLUP_PROPERTY_ID = 'UA-12345-7'
+ERRORS_PROPERTY_ID = 'UA-12345-8'
+
+def parse_hit(body):
+    return {key: values[0] for key, values in parse_qs(body).items()}
+
+class AcceptDestination(unittest.TestCase):
+    """Tests for Destination.accepts()."""
+
+    def test_01_hit_type_allow_list(self):
+        destination = Destination(PROPERTY_ID, hit_types=['exception'])
+        self.assertTrue(destination.accepts('exception', '1.2'))
+        self.assertFalse(destination.accepts('pageview', '1.2'))
+
+    def test_02_sampling_is_stable_per_client_id(self):
+        destination = Destination(PROPERTY_ID, sample_rate=0.25)
+        client_ids = ['{}.{}'.format(number, 1500000000) for number in range(4000)]
+        accepted = [client_id for client_id in client_ids if destination.accepts('event', client_id)]
+        self.assertAlmostEqual(len(accepted) / 4000.0, 0.25, delta=0.03)
+        self.assertEqual(
+            accepted,
+            [client_id for client_id in client_ids if destination.accepts('event', client_id)],
+        )
+
+    def test_03_raises_error_with_bad_sample_rate(self):
+        self.assertRaises(ValueError, Destination, PROPERTY_ID, 1.5)
+
+class SendToDestinations(unittest.TestCase):
+    """Tests for a tracker with several properties."""
+
+    def setUp(self):
+        self.ga = GoogleAnalytics([
+            PROPERTY_ID,
+            ROLLUP_PROPERTY_ID,
+            Destination(ERRORS_PROPERTY_ID, hit_types=['exception']),
+        ])
+
+    def test_01_property_id_is_first_destination(self):
+        self.assertEqual(self.ga.property_id, PROPERTY_ID)
+        self.assertEqual(len(self.ga.destinations), 3)
+
+    def test_02_copies_share_one_batch(self):
+        with mock.patch('requests.post') as post:
+            self.ga.send_event('menu', 'click')
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(post.call_args[0][0], GA_BATCH_ENDPOINT)
+
+        hits = [parse_hit(body) for body in post.call_args[1]['data'].split('\n')]
+        self.assertEqual([hit['tid'] for hit in hits], [PROPERTY_ID, ROLLUP_PROPERTY_ID])
+        for hit in hits:
+            del hit['tid']
+        self.assertEqual(hits[0], hits[1])
+
+    def test_03_allow_list_adds_destination(self):
+        with mock.patch('requests.post') as post:
+            self.ga.send_exception('boom')
+        bodies = post.call_args[1]['data'].split('\n')
+        self.assertEqual(len(bodies), 3)
+        self.assertEqual(parse_hit(bodies[2])['tid'], ERRORS_PROPERTY_ID)
+
+    def test_04_single_filtered_destination_skips_hit(self):
+        ga = GoogleAnalytics(Destination(PROPERTY_ID, hit_types=['exception']))
+        with mock.patch('requests.post') as post:
+            ga.send_event('menu', 'click')
+        post.assert_not_called()
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()